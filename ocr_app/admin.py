@@ -1,7 +1,8 @@
 # ocr_app/admin.py
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser, OCRDocument
+from django.db.models import Avg, Count, Sum
+from .models import CustomUser, OCRDocument, ExtractionUsage, TranslationMemory
 
 class CustomUserAdmin(UserAdmin):
     list_display = ('username', 'email', 'is_staff', 'is_app_user')
@@ -10,5 +11,62 @@ class CustomUserAdmin(UserAdmin):
         ('App Access', {'fields': ('is_app_user',)}),
     )
 
+class ExtractionUsageAdmin(admin.ModelAdmin):
+    """Model usage per extraction, most expensive first, with totals per document type and prompt"""
+    change_list_template = 'admin/ocr_app/extractionusage/change_list.html'
+    list_display = ('extraction', 'document_type', 'user', 'calls', 'failed_calls', 'total_tokens',
+                    'payload_bytes', 'latency_ms', 'created_at')
+    list_filter = ('extraction__document_type', 'created_at')
+    list_select_related = ('extraction__user',)
+    ordering = ('-total_tokens',)
+    readonly_fields = [field.name for field in ExtractionUsage._meta.fields]
+
+    @admin.display(ordering='extraction__document_type')
+    def document_type(self, usage):
+        return usage.extraction.document_type
+
+    @admin.display(ordering='extraction__user__username')
+    def user(self, usage):
+        return usage.extraction.user
+
+    def has_add_permission(self, request):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        try:
+            queryset = response.context_data['cl'].queryset
+        except (AttributeError, KeyError):
+            # A redirect or an error page, nothing to summarize
+            return response
+        # Aliases must not reuse the model's field names, or Avg('total_tokens') would read the Sum
+        totals = {
+            'documents': Count('id'),
+            'sum_calls': Sum('calls'),
+            'sum_tokens': Sum('total_tokens'),
+            'avg_tokens': Avg('total_tokens'),
+            'sum_payload_bytes': Sum('payload_bytes'),
+            'sum_latency_ms': Sum('latency_ms'),
+        }
+        response.context_data['summary_by_type'] = (
+            queryset.values('extraction__document_type').annotate(**totals).order_by('-sum_tokens')
+        )
+        response.context_data['summary_by_prompt'] = (
+            queryset.values('extraction__custom_prompt').annotate(**totals).order_by('-sum_tokens')[:10]
+        )
+        return response
+
+class TranslationMemoryAdmin(admin.ModelAdmin):
+    """Remembered translations; delete an entry to have the value translated again"""
+    list_display = ('source_text', 'language', 'translated', 'created_at')
+    list_filter = ('language',)
+    search_fields = ('source_text', 'translated')
+    readonly_fields = ('source_hash', 'source_text', 'created_at')
+
+    def has_add_permission(self, request):
+        return False
+
 admin.site.register(CustomUser, CustomUserAdmin)
-admin.site.register(OCRDocument)
\ No newline at end of file
+admin.site.register(OCRDocument)
+admin.site.register(ExtractionUsage, ExtractionUsageAdmin)
+admin.site.register(TranslationMemory, TranslationMemoryAdmin)
@@ -0,0 +1,83 @@
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ocr_app.services.page_executor import run_pages
+from ocr_app.services.rasterize import iter_pdf_pages, shutdown_render_pool
+
+MODES = ('eager', 'streaming')
+
+
+def _simulated_extract(latency):
+    """Stand-in for a model call: encode the page as the real extractor would, then wait"""
+    def extract(image, model, custom_prompt=None):
+        buffered = BytesIO()
+        image.save(buffered, format="PNG")
+        time.sleep(latency)
+        return {'bytes': len(buffered.getvalue())}
+    return extract
+
+
+def _run_mode(pdf_path, mode, max_in_flight, latency):
+    start = time.perf_counter()
+    pages = iter_pdf_pages(pdf_path)
+    if mode == 'eager':
+        # The old behaviour: every page is rendered and held before extraction starts
+        pages = list(pages)
+    results = run_pages(pages, _simulated_extract(latency), None, max_in_flight=max_in_flight)
+    elapsed = time.perf_counter() - start
+    shutdown_render_pool()
+    return {
+        'mode': mode,
+        'pages': len(results),
+        'seconds': round(elapsed, 3),
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'peak_worker_rss_mb': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+
+
+class Command(BaseCommand):
+    help = "Compare peak memory of eager and streaming page rasterization, each in a fresh process"
+
+    def add_arguments(self, parser):
+        parser.add_argument('pdf_path', help="PDF to rasterize")
+        parser.add_argument('--max-in-flight', type=int, default=4,
+                            help="Pages extracted concurrently by the simulated model")
+        parser.add_argument('--latency', type=float, default=0.5,
+                            help="Seconds each simulated model call takes")
+        parser.add_argument('--mode', choices=MODES, default=None,
+                            help="Run a single mode in this process and print its result as JSON")
+
+    def handle(self, *args, **options):
+        pdf_path = options['pdf_path']
+        if not os.path.exists(pdf_path):
+            raise CommandError(f"File not found: {pdf_path}")
+
+        if options['mode']:
+            result = _run_mode(pdf_path, options['mode'], options['max_in_flight'], options['latency'])
+            self.stdout.write(json.dumps(result))
+            return
+
+        # Peak RSS only ever grows, so each mode gets its own interpreter
+        manage_py = os.path.join(settings.BASE_DIR, 'manage.py')
+        for mode in MODES:
+            completed = subprocess.run(
+                [sys.executable, manage_py, 'benchmark_page_memory', pdf_path, '--mode', mode,
+                 '--max-in-flight', str(options['max_in_flight']), '--latency', str(options['latency'])],
+                capture_output=True, text=True
+            )
+            if completed.returncode != 0:
+                raise CommandError(f"{mode} run failed:\n{completed.stderr}")
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            self.stdout.write(
+                f"{result['mode']:>10}: {result['pages']} pages in {result['seconds']:.2f}s, "
+                f"peak RSS {result['peak_rss_mb']} MB (render workers {result['peak_worker_rss_mb']} MB)"
+            )
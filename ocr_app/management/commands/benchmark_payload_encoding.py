@@ -0,0 +1,57 @@
+import os
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ocr_app.services.page_encoder import PAYLOAD_FORMATS, encode_page_payload, get_payload_config
+from ocr_app.services.rasterize import iter_pdf_pages
+
+
+class Command(BaseCommand):
+    help = "Compare encode time and payload size of each page image format over a PDF's pages"
+
+    def add_arguments(self, parser):
+        parser.add_argument('pdf_path', help="PDF to rasterize")
+        parser.add_argument('--pages', type=int, default=None, help="Only encode the first N pages")
+        parser.add_argument('--formats', default=','.join(PAYLOAD_FORMATS),
+                            help="Comma-separated formats to compare")
+        parser.add_argument('--png-compress-level', type=int, default=None)
+        parser.add_argument('--jpeg-quality', type=int, default=None)
+        parser.add_argument('--webp-quality', type=int, default=None)
+
+    def handle(self, *args, **options):
+        pdf_path = options['pdf_path']
+        if not os.path.exists(pdf_path):
+            raise CommandError(f"File not found: {pdf_path}")
+        formats = [name.strip().lower() for name in options['formats'].split(',') if name.strip()]
+        unknown = [name for name in formats if name not in PAYLOAD_FORMATS]
+        if unknown:
+            raise CommandError(f"Unknown formats: {', '.join(unknown)}")
+
+        config = get_payload_config()
+        for option, key in (('png_compress_level', 'PNG_COMPRESS_LEVEL'),
+                            ('jpeg_quality', 'JPEG_QUALITY'),
+                            ('webp_quality', 'WEBP_QUALITY')):
+            if options[option] is not None:
+                config[key] = options[option]
+
+        totals = {name: [0.0, 0] for name in formats}
+        header = f"{'page':>5}" + ''.join(f" {name + ' ms':>10} {name + ' bytes':>12}" for name in formats)
+        self.stdout.write(header)
+        pages = 0
+        for page_number, image in enumerate(islice(iter_pdf_pages(pdf_path, workers=1), options['pages']), 1):
+            line = f"{page_number:>5}"
+            for name in formats:
+                encode_page_payload(image, {**config, 'FORMAT': name})
+                totals[name][0] += image.info['encode_ms']
+                totals[name][1] += image.info['payload_bytes']
+                line += f" {image.info['encode_ms']:>10.1f} {image.info['payload_bytes']:>12}"
+            self.stdout.write(line)
+            pages += 1
+
+        if not pages:
+            raise CommandError("The PDF has no pages")
+        self.stdout.write("")
+        for name in formats:
+            encode_ms, payload_bytes = totals[name]
+            self.stdout.write(f"{name:>5}: {encode_ms / pages:.1f} ms and {payload_bytes // pages} bytes per page")
@@ -0,0 +1,59 @@
+import os
+import time
+
+import fitz  # PyMuPDF
+from django.core.management.base import BaseCommand, CommandError
+
+from ocr_app.services.rasterize import (
+    PREPROCESS_PROFILES, effective_dpi, estimate_noise, get_max_long_side, get_noise_threshold,
+    get_render_dpi, pixmap_to_array, preprocess_array,
+)
+
+
+class Command(BaseCommand):
+    help = "Time each page preprocessing profile over the pages of a PDF"
+
+    def add_arguments(self, parser):
+        parser.add_argument('pdf_path', help="PDF to rasterize")
+        parser.add_argument('--pages', type=int, default=None, help="Only process the first N pages")
+        parser.add_argument('--dpi', type=int, default=None, help="Render DPI (defaults to RASTERIZE_DPI)")
+
+    def handle(self, *args, **options):
+        pdf_path = options['pdf_path']
+        if not os.path.exists(pdf_path):
+            raise CommandError(f"File not found: {pdf_path}")
+        target_dpi = options['dpi'] or get_render_dpi()
+
+        totals = {profile: 0.0 for profile in PREPROCESS_PROFILES}
+        header = f"{'page':>5} {'noise':>7}" + ''.join(f" {profile + ' ms':>9}" for profile in PREPROCESS_PROFILES)
+        self.stdout.write(header + "  auto chose")
+        pages = 0
+        with fitz.open(pdf_path) as pdf_document:
+            page_count = len(pdf_document)
+            if options['pages']:
+                page_count = min(page_count, options['pages'])
+            for page_num in range(page_count):
+                page = pdf_document.load_page(page_num)
+                zoom = effective_dpi(page, target_dpi, get_max_long_side()) / 72
+                pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+                gray = pixmap_to_array(pix)
+
+                line = f"{page_num + 1:>5} {estimate_noise(gray):>7.2f}"
+                chosen = None
+                for profile in PREPROCESS_PROFILES:
+                    start = time.perf_counter()
+                    _, applied_profile = preprocess_array(gray, profile)
+                    elapsed = time.perf_counter() - start
+                    totals[profile] += elapsed
+                    line += f" {elapsed * 1000:>9.1f}"
+                    if profile == 'auto':
+                        chosen = applied_profile
+                self.stdout.write(f"{line}  {chosen}")
+                pages += 1
+
+        if not pages:
+            raise CommandError("The PDF has no pages")
+        self.stdout.write("")
+        self.stdout.write(f"Noise threshold for 'auto': {get_noise_threshold()}")
+        for profile in PREPROCESS_PROFILES:
+            self.stdout.write(f"{profile:>5}: {totals[profile] / pages * 1000:.1f} ms per page")
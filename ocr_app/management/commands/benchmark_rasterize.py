@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+import time
+
+import cv2
+import fitz  # PyMuPDF
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+from ocr_app.services.rasterize import DEFAULT_DPI, enhance_image_array, render_page_image
+
+
+def _io_write_bytes():
+    """Bytes this process has passed to write(), or None where /proc is unavailable"""
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _legacy_render(page, page_num, temp_dir, target_dpi):
+    """The previous temp-PNG pipeline: save, imread, imwrite and reopen each page.
+
+    Returns the PIL image and the number of bytes written to the temp directory.
+    """
+    zoom = target_dpi / 72
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+    image_path = os.path.join(temp_dir, f"page_{page_num + 1}.png")
+    pix.save(image_path)
+    written = os.path.getsize(image_path)
+    enhanced = enhance_image_array(cv2.imread(image_path, cv2.IMREAD_GRAYSCALE), 'full')
+    cv2.imwrite(image_path, enhanced)
+    written += os.path.getsize(image_path)
+    image = Image.open(image_path)
+    image.load()
+    return image, written
+
+
+class Command(BaseCommand):
+    help = "Compare per-page time and bytes written for temp-file and in-memory PDF rasterization"
+
+    def add_arguments(self, parser):
+        parser.add_argument('pdf_path', help="PDF to rasterize")
+        parser.add_argument('--dpi', type=int, default=DEFAULT_DPI)
+        parser.add_argument('--pages', type=int, default=None, help="Only render the first N pages")
+
+    def handle(self, *args, **options):
+        pdf_path = options['pdf_path']
+        if not os.path.exists(pdf_path):
+            raise CommandError(f"File not found: {pdf_path}")
+
+        rows = []
+        temp_dir = tempfile.mkdtemp()
+        try:
+            with fitz.open(pdf_path) as pdf_document:
+                page_count = len(pdf_document)
+                if options['pages']:
+                    page_count = min(page_count, options['pages'])
+                for page_num in range(page_count):
+                    page = pdf_document.load_page(page_num)
+
+                    before = _io_write_bytes()
+                    start = time.perf_counter()
+                    _, legacy_files = _legacy_render(page, page_num, temp_dir, options['dpi'])
+                    legacy_time = time.perf_counter() - start
+                    after = _io_write_bytes()
+                    legacy_bytes = after - before if before is not None else legacy_files
+
+                    before = _io_write_bytes()
+                    start = time.perf_counter()
+                    render_page_image(page, options['dpi'], 'full')
+                    memory_time = time.perf_counter() - start
+                    after = _io_write_bytes()
+                    memory_bytes = after - before if before is not None else 0
+
+                    rows.append((page_num + 1, legacy_time, memory_time, legacy_bytes, memory_bytes))
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+        if not rows:
+            raise CommandError("The PDF has no pages")
+
+        self.stdout.write(f"{'page':>5} {'temp-file ms':>13} {'in-memory ms':>13} {'temp-file bytes':>16} {'in-memory bytes':>16}")
+        for page, legacy_time, memory_time, legacy_bytes, memory_bytes in rows:
+            self.stdout.write(
+                f"{page:>5} {legacy_time * 1000:>13.1f} {memory_time * 1000:>13.1f} {legacy_bytes:>16} {memory_bytes:>16}"
+            )
+
+        legacy_total = sum(row[1] for row in rows)
+        memory_total = sum(row[2] for row in rows)
+        self.stdout.write("")
+        self.stdout.write(f"Mean per page: temp-file {legacy_total / len(rows) * 1000:.1f} ms, "
+                          f"in-memory {memory_total / len(rows) * 1000:.1f} ms "
+                          f"({legacy_total / memory_total if memory_total else 0:.2f}x)")
+        self.stdout.write(f"Bytes written: temp-file {sum(row[3] for row in rows)}, "
+                          f"in-memory {sum(row[4] for row in rows)}")
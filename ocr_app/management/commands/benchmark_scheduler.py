@@ -0,0 +1,82 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from statistics import median
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ocr_app.services.fake_model import FakeModel
+from ocr_app.services.scheduler import PRIORITY_BULK, PRIORITY_INTERACTIVE, CallScheduler, ScheduledModel
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+class Command(BaseCommand):
+    help = "Drive the model call scheduler with a fake model that injects 429s, errors and latency"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interactive', type=int, default=20, help="Interactive calls to make")
+        parser.add_argument('--bulk', type=int, default=100, help="Bulk calls to make")
+        parser.add_argument('--threads', type=int, default=16, help="Concurrent callers")
+        parser.add_argument('--rpm', type=int, default=600, help="Scheduler requests per minute")
+        parser.add_argument('--tpm', type=int, default=None, help="Scheduler tokens per minute")
+        parser.add_argument('--latency', type=float, default=0.05, help="Fake call latency in seconds")
+        parser.add_argument('--rate-limit-ratio', type=float, default=0.1, help="Share of calls answered with 429")
+        parser.add_argument('--error-ratio', type=float, default=0.02, help="Share of calls answered with 503")
+        parser.add_argument('--quota', type=int, default=None,
+                            help="Requests per minute the fake itself allows before answering 429")
+        parser.add_argument('--max-retries', type=int, default=5)
+        parser.add_argument('--base-delay', type=float, default=0.05, help="Backoff base delay in seconds")
+        parser.add_argument('--timeout', type=float, default=None, help="Deadline per call in seconds")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['interactive'] + options['bulk'] <= 0:
+            raise CommandError("Nothing to run")
+        fake = FakeModel(
+            latency=options['latency'], jitter=options['latency'] / 2,
+            rate_limit_ratio=options['rate_limit_ratio'], error_ratio=options['error_ratio'],
+            response_text={'borrower_name': 'Ram'}, requests_per_minute=options['quota'], seed=options['seed'],
+        )
+        scheduler = CallScheduler(
+            requests_per_minute=options['rpm'], tokens_per_minute=options['tpm'],
+            max_retries=options['max_retries'], base_delay=options['base_delay'],
+            max_delay=options['base_delay'] * 32,
+        )
+
+        latencies = {PRIORITY_INTERACTIVE: [], PRIORITY_BULK: []}
+        failures = {PRIORITY_INTERACTIVE: 0, PRIORITY_BULK: 0}
+
+        def run(priority):
+            deadline = time.monotonic() + options['timeout'] if options['timeout'] else None
+            model = ScheduledModel(fake, scheduler, priority, deadline)
+            start = time.perf_counter()
+            try:
+                model.generate_content("Extract the borrower name from this page")
+            except Exception:
+                failures[priority] += 1
+                return
+            latencies[priority].append(time.perf_counter() - start)
+
+        # Bulk callers start first and fill the queue; interactive calls, made
+        # from their own threads, should still be served ahead of them
+        total = options['bulk'] + options['interactive']
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as bulk_executor, \
+                ThreadPoolExecutor(max_workers=options['threads']) as interactive_executor:
+            bulk_executor.map(run, [PRIORITY_BULK] * options['bulk'])
+            time.sleep(min(1.0, options['latency'] * 4))
+            interactive_executor.map(run, [PRIORITY_INTERACTIVE] * options['interactive'])
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(f"{total} calls in {elapsed:.2f}s ({total / elapsed:.1f} calls/s)")
+        for name, priority in (('interactive', PRIORITY_INTERACTIVE), ('bulk', PRIORITY_BULK)):
+            values = latencies[priority]
+            self.stdout.write(
+                f"{name:>12}: {len(values)} ok, {failures[priority]} failed, "
+                f"p50 {median(values) if values else 0:.3f}s, p95 {_percentile(values, 0.95):.3f}s"
+            )
+        self.stdout.write(f"Scheduler: {scheduler.get_stats()}")
+        self.stdout.write(f"Fake model: {fake.stats}")
@@ -0,0 +1,188 @@
+import contextlib
+import io
+import json
+import os
+import time
+from difflib import SequenceMatcher
+from statistics import mean, median
+
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+from ocr_app.services.batch import collect_directory
+from ocr_app.services.model_registry import get_model
+from ocr_app.services.rag_utils import extract_page_data
+from ocr_app.services.rasterize import get_preprocess_profile, iter_pdf_pages, limit_long_side
+from ocr_app.services.scheduler import PRIORITY_BULK, scheduled
+from ocr_app.services.translation import get_translation_stats
+from ocr_app.services.translation_memory import normalize_source, without_translation_memory
+from ocr_app.services.usage import metered
+
+MODES = ('separate', 'inline')
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def _iter_fixture_pages(path, document_type):
+    if path.lower().endswith('.pdf'):
+        yield from iter_pdf_pages(path, profile=get_preprocess_profile(document_type))
+    else:
+        with Image.open(path) as image:
+            image.load()
+            yield limit_long_side(image.copy())
+
+
+def _translated_values(result):
+    """Flatten a page result into ``{key: {original, language, translated}}``"""
+    values = {}
+    for field, value in (result or {}).items():
+        if isinstance(value, list):
+            for index, item in enumerate(value):
+                if isinstance(item, dict):
+                    values[f"{field}[{index}]"] = item
+        elif isinstance(value, dict):
+            values[field] = value
+    return values
+
+
+def _same(a, b):
+    return normalize_source(str(a or '')).casefold() == normalize_source(str(b or '')).casefold()
+
+
+def compare_results(baseline, candidate):
+    """Per-value agreement of a page extracted in both modes.
+
+    Values empty in both results are skipped. Returns the counts and the
+    values that differ, with the similarity of their translations.
+    """
+    baseline_values = _translated_values(baseline)
+    candidate_values = _translated_values(candidate)
+    agreement = {'values': 0, 'original': 0, 'language': 0, 'translated': 0, 'similarity': 0.0}
+    differences = []
+    for key in sorted(set(baseline_values) | set(candidate_values)):
+        expected = baseline_values.get(key, {})
+        actual = candidate_values.get(key, {})
+        if not expected.get('original') and not actual.get('original'):
+            continue
+        similarity = SequenceMatcher(
+            None, str(expected.get('translated') or '').casefold(), str(actual.get('translated') or '').casefold()
+        ).ratio()
+        matches = {
+            'original': _same(expected.get('original'), actual.get('original')),
+            'language': _same(expected.get('language'), actual.get('language')),
+            'translated': _same(expected.get('translated'), actual.get('translated')),
+        }
+        agreement['values'] += 1
+        agreement['similarity'] += similarity
+        for name, matched in matches.items():
+            agreement[name] += matched
+        if not all(matches.values()):
+            differences.append({'key': key, 'separate': expected, 'inline': actual,
+                                'similarity': round(similarity, 3)})
+    return agreement, differences
+
+
+class Command(BaseCommand):
+    help = ("Extract every page of a fixture set in the separate and the inline translation modes and "
+            "compare model calls, latency and agreement")
+
+    def add_arguments(self, parser):
+        parser.add_argument('fixtures', help="Directory of PDFs and images")
+        parser.add_argument('--document-type', default='loan', choices=['loan', 'property'])
+        parser.add_argument('--max-pages', type=int, default=None, help="Stop after this many pages")
+        parser.add_argument('--output', help="Write per-page results and differences to this JSON-lines file")
+        parser.add_argument('--verbose', action='store_true', help="Show the pipeline's own output")
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(options['fixtures']):
+            raise CommandError(f"Not a directory: {options['fixtures']}")
+        files = collect_directory(options['fixtures'])
+        if not files:
+            raise CommandError("No supported documents found")
+        document_type = options['document_type']
+        base_model = get_model()
+
+        measurements = {mode: {'latency': [], 'calls': [], 'tokens': [], 'failed': 0} for mode in MODES}
+        agreement = {'values': 0, 'original': 0, 'language': 0, 'translated': 0, 'similarity': 0.0}
+        inline_stats = {'inline_accepted': 0, 'inline_fallbacks': 0}
+        output = open(options['output'], 'w', encoding='utf-8') if options['output'] else None
+        pages = 0
+        try:
+            for name, path in files:
+                for page_number, page in enumerate(_iter_fixture_pages(path, document_type), 1):
+                    if options['max_pages'] and pages >= options['max_pages']:
+                        break
+                    pages += 1
+                    results = {}
+                    # Alternate which mode goes first so neither always meets a cold scheduler
+                    for mode in (MODES if pages % 2 else MODES[::-1]):
+                        model, ledger = metered(base_model)
+                        model = scheduled(model, PRIORITY_BULK)
+                        before = get_translation_stats()
+                        quiet = (contextlib.nullcontext() if options['verbose']
+                                 else contextlib.redirect_stdout(io.StringIO()))
+                        start = time.perf_counter()
+                        # The memory would answer the second mode with the first one's translations
+                        with quiet, without_translation_memory():
+                            try:
+                                # A re-render rewrites the page's info, so each mode gets its own copy
+                                results[mode] = extract_page_data(
+                                    page.copy(), model, document_type, None, translation_mode=mode
+                                )
+                            except Exception as e:
+                                self.stderr.write(f"{name} page {page_number} ({mode}): {str(e)}")
+                                results[mode] = None
+                        latency = time.perf_counter() - start
+                        totals = ledger.summary()['totals']
+                        measurements[mode]['latency'].append(latency)
+                        measurements[mode]['calls'].append(totals['calls'])
+                        measurements[mode]['tokens'].append(totals['total_tokens'])
+                        if results[mode] is None:
+                            measurements[mode]['failed'] += 1
+                        if mode == 'inline':
+                            after = get_translation_stats()
+                            for key in inline_stats:
+                                inline_stats[key] += after.get(key, 0) - before.get(key, 0)
+                    page_agreement, differences = compare_results(results['separate'], results['inline'])
+                    for key, value in page_agreement.items():
+                        agreement[key] += value
+                    self.stdout.write(
+                        f"{name} page {page_number}: calls {measurements['separate']['calls'][-1]} -> "
+                        f"{measurements['inline']['calls'][-1]}, {len(differences)} of "
+                        f"{page_agreement['values']} values differ"
+                    )
+                    if output:
+                        output.write(json.dumps({
+                            'file': name, 'page': page_number, 'results': results, 'differences': differences,
+                        }, ensure_ascii=False) + "\n")
+                if options['max_pages'] and pages >= options['max_pages']:
+                    break
+        finally:
+            if output:
+                output.close()
+
+        if not pages:
+            raise CommandError("No pages could be read")
+        self.stdout.write("")
+        self.stdout.write(f"{pages} pages of {document_type} fixtures")
+        for mode in MODES:
+            values = measurements[mode]
+            self.stdout.write(
+                f"{mode:>9}: {mean(values['calls']):.2f} calls/page, {mean(values['tokens']):.0f} tokens/page, "
+                f"latency mean {mean(values['latency']):.2f}s, p50 {median(values['latency']):.2f}s, "
+                f"p95 {_percentile(values['latency'], 0.95):.2f}s, {values['failed']} failed pages"
+            )
+        self.stdout.write(
+            f"Inline mode: {inline_stats['inline_accepted']} values translated by the extraction call, "
+            f"{inline_stats['inline_fallbacks']} sent to translation calls"
+        )
+        if agreement['values']:
+            total = agreement['values']
+            self.stdout.write(
+                f"Agreement over {total} values: original {agreement['original'] / total:.1%}, "
+                f"language {agreement['language'] / total:.1%}, translation exact "
+                f"{agreement['translated'] / total:.1%}, similarity {agreement['similarity'] / total:.3f}"
+            )
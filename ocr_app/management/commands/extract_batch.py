@@ -0,0 +1,87 @@
+import json
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from ocr_app.services.batch import collect_batch_files, run_batch, save_batch_results
+
+
+class Command(BaseCommand):
+    help = "Extract every document in a directory or ZIP archive with one shared model call budget"
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help="Directory or ZIP archive of PDFs and images")
+        parser.add_argument('--document-type', required=True, choices=['loan', 'property', 'table'])
+        parser.add_argument('--user', help="Username the extractions are saved for")
+        parser.add_argument('--prompt-file', help="File holding a custom extraction prompt")
+        parser.add_argument('--max-in-flight', type=int, default=None,
+                            help="Model calls in flight across all documents (defaults to GEMINI_MAX_CONCURRENT_CALLS)")
+        parser.add_argument('--no-cache', action='store_true', help="Ignore cached extraction results")
+        parser.add_argument('--dry-run', action='store_true', help="Extract without saving anything")
+        parser.add_argument('--summary-json', help="Also write the batch summary to this file")
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options['source']):
+            raise CommandError(f"Not found: {options['source']}")
+        user = None
+        if not options['dry_run']:
+            if not options['user']:
+                raise CommandError("--user is required unless --dry-run is given")
+            try:
+                user = get_user_model().objects.get(username=options['user'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No such user: {options['user']}")
+        custom_prompt = None
+        if options['prompt_file']:
+            with open(options['prompt_file'], encoding='utf-8') as f:
+                custom_prompt = f.read().strip() or None
+
+        workdir = tempfile.mkdtemp(prefix='batch_')
+        try:
+            try:
+                files = collect_batch_files(options['source'], workdir)
+            except ValueError as e:
+                raise CommandError(str(e))
+            if not files:
+                raise CommandError("No supported documents found")
+            self.stdout.write(f"Extracting {len(files)} document(s) as {options['document_type']}")
+
+            def report(processed_pages, total_pages):
+                if processed_pages and (processed_pages % 10 == 0 or processed_pages == total_pages):
+                    self.stdout.write(f"  {processed_pages}/{total_pages} pages")
+
+            batch = run_batch(
+                files, options['document_type'], custom_prompt, max_in_flight=options['max_in_flight'],
+                use_cache=not options['no_cache'], progress_callback=report,
+            )
+            if user is not None:
+                save_batch_results(user, options['document_type'], custom_prompt, batch)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        for entry in batch['documents']:
+            result = entry['result']
+            if result['success']:
+                failed = f", failed pages {result['failed_pages']}" if result.get('failed_pages') else ''
+                saved = f" -> extraction {entry['extraction_id']}" if entry.get('extraction_id') else ''
+                self.stdout.write(f"OK   {entry['name']}{failed}{saved}")
+            else:
+                self.stdout.write(self.style.WARNING(f"FAIL {entry['name']}: {result.get('error')}"))
+
+        summary = batch['summary']
+        self.stdout.write("")
+        self.stdout.write(
+            f"{summary['succeeded']}/{summary['documents']} documents ({summary['cached']} cached), "
+            f"{summary['pages']} pages in {summary['elapsed_s']}s: {summary['pages_per_second']} pages/s, "
+            f"{summary['documents_per_minute']} documents/min with {summary['max_in_flight']} calls in flight"
+        )
+        self.stdout.write(
+            f"{summary['model_calls']} model calls, {summary['total_tokens']} tokens, "
+            f"{summary['payload_bytes']} payload bytes"
+        )
+        if options['summary_json']:
+            with open(options['summary_json'], 'w', encoding='utf-8') as f:
+                json.dump(summary, f, indent=2)
@@ -0,0 +1,188 @@
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from statistics import median
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, transaction
+
+from ocr_app.models import CustomExtraction, ExtractionFileCheckpoint, ExtractionUsage
+from ocr_app.services.batch import collect_directory
+from ocr_app.services.checkpoints import (
+    completed_files, default_run_name, finish_file, get_checkpoint_page_cache, get_run, record_file_progress,
+    start_file,
+)
+from ocr_app.services.extraction_cache import hash_file
+from ocr_app.services.rag_utils import build_processed_data, extract_data_from_document
+from ocr_app.services.scheduler import PRIORITY_BULK
+from ocr_app.services.usage import save_extraction_usage
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+class Command(BaseCommand):
+    help = ("Extract every document under a directory with a pool of workers, checkpointing finished "
+            "files and pages to the database so an interrupted run resumes where it stopped")
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help="Directory of PDFs and images")
+        parser.add_argument('--document-type', required=True, choices=['loan', 'property', 'table'])
+        parser.add_argument('--run', help="Checkpoint name to resume (defaults to the directory and document type)")
+        parser.add_argument('--workers', type=int, default=4, help="Files processed at once")
+        parser.add_argument('--max-in-flight', type=int, default=None,
+                            help="Model calls in flight per file (defaults to GEMINI_MAX_CONCURRENT_CALLS)")
+        parser.add_argument('--prompt-file', help="File holding a custom extraction prompt")
+        parser.add_argument('--user', help="Also save a CustomExtraction per file for this username")
+        parser.add_argument('--output', help="Append JSON-lines results to this file instead of stdout")
+        parser.add_argument('--skip-failed', action='store_true', help="Do not retry files that failed before")
+        parser.add_argument('--restart', action='store_true', help="Drop the run's checkpoints and start over")
+        parser.add_argument('--no-cache', action='store_true', help="Ignore the extraction result cache")
+
+    def handle(self, *args, **options):
+        source = os.path.abspath(options['source'])
+        if not os.path.isdir(source):
+            raise CommandError(f"Not a directory: {source}")
+        document_type = options['document_type']
+        custom_prompt = None
+        if options['prompt_file']:
+            with open(options['prompt_file'], encoding='utf-8') as f:
+                custom_prompt = f.read().strip() or None
+        user = None
+        if options['user']:
+            try:
+                user = get_user_model().objects.get(username=options['user'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No such user: {options['user']}")
+
+        try:
+            run = get_run(options['run'] or default_run_name(source, document_type, custom_prompt),
+                          source, document_type, custom_prompt)
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['restart']:
+            run.files.all().delete()
+            run.pages.all().delete()
+
+        files = collect_directory(source)
+        done = completed_files(run)
+        failed_before = set(
+            run.files.filter(status=ExtractionFileCheckpoint.STATUS_FAILED).values_list('path', flat=True)
+        )
+        pending = []
+        skipped = 0
+        for name, path in files:
+            file_hash = hash_file(path)
+            if done.get(name) == file_hash or (options['skip_failed'] and name in failed_before):
+                skipped += 1
+                continue
+            pending.append((name, path, file_hash))
+        self.stderr.write(f"Run {run.name!r}: {len(files)} file(s), {skipped} already done or skipped, "
+                          f"{len(pending)} to process with {options['workers']} worker(s)")
+
+        page_cache = get_checkpoint_page_cache(run)
+
+        def save_file_extraction(checkpoint, result):
+            extracted_data = build_processed_data(document_type, result.get('structured_data', {}))
+            # A file retried on resume updates the extraction saved by its earlier attempt
+            extraction = checkpoint.extraction
+            if extraction is None or extraction.user_id != user.pk:
+                extraction = CustomExtraction.objects.create(
+                    user=user,
+                    document_type=document_type,
+                    extracted_data=extracted_data,
+                    custom_prompt=custom_prompt or "Default extraction"
+                )
+            else:
+                extraction.extracted_data = extracted_data
+                extraction.save(update_fields=['extracted_data'])
+                ExtractionUsage.objects.filter(extraction=extraction).delete()
+            save_extraction_usage(extraction, result.get('usage'))
+            return extraction
+
+        def process(name, path, file_hash):
+            close_old_connections()
+            try:
+                checkpoint = start_file(run, name, file_hash)
+                start = time.perf_counter()
+                try:
+                    result = extract_data_from_document(
+                        path, document_type, custom_prompt, max_in_flight=options['max_in_flight'],
+                        use_cache=not options['no_cache'], priority=PRIORITY_BULK, page_cache=page_cache,
+                        progress_callback=lambda processed, total: record_file_progress(checkpoint, processed, total),
+                    )
+                except Exception as e:
+                    result = {'success': False, 'error': str(e)}
+                latency = time.perf_counter() - start
+                # The extraction and the checkpoint pointing at it are saved together or not at all
+                with transaction.atomic():
+                    extraction = None
+                    if user is not None and result['success']:
+                        extraction = save_file_extraction(checkpoint, result)
+                    finish_file(checkpoint, result, latency, extraction)
+                return result, latency, checkpoint.total_pages
+            finally:
+                close_old_connections()
+
+        output = open(options['output'], 'a', encoding='utf-8') if options['output'] else sys.stdout
+        latencies = []
+        pages = 0
+        succeeded = failed = 0
+        model_calls = total_tokens = 0
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, options['workers']), thread_name_prefix='extract') as executor:
+                futures = {executor.submit(process, *item): item[0] for item in pending}
+                for future in as_completed(futures):
+                    name = futures[future]
+                    try:
+                        result, latency, page_count = future.result()
+                    except Exception as e:
+                        result, latency, page_count = {'success': False, 'error': str(e)}, 0.0, 0
+                    usage = (result.get('usage') or {}).get('totals', {})
+                    latencies.append(latency)
+                    pages += page_count
+                    model_calls += usage.get('calls', 0)
+                    total_tokens += usage.get('total_tokens', 0)
+                    if result['success']:
+                        succeeded += 1
+                    else:
+                        failed += 1
+                    output.write(json.dumps({
+                        'file': name,
+                        'success': result['success'],
+                        'error': result.get('error'),
+                        'failed_pages': result.get('failed_pages', []),
+                        'cached': result.get('cached', False),
+                        'pages': page_count,
+                        'latency_s': round(latency, 3),
+                        'usage': usage,
+                        'data': result.get('structured_data'),
+                    }, ensure_ascii=False) + "\n")
+                    output.flush()
+        except KeyboardInterrupt:
+            self.stderr.write("Interrupted; run the same command again to resume")
+            raise
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+        elapsed = time.perf_counter() - start
+        processed = succeeded + failed
+        self.stderr.write("")
+        self.stderr.write(f"Processed {processed} file(s): {succeeded} succeeded, {failed} failed, {skipped} skipped")
+        if processed:
+            self.stderr.write(
+                f"{pages} pages in {elapsed:.1f}s: {processed * 60 / elapsed:.1f} files/min, "
+                f"{pages / elapsed:.2f} pages/s"
+            )
+            self.stderr.write(
+                f"File latency: p50 {median(latencies):.2f}s, p95 {_percentile(latencies, 0.95):.2f}s, "
+                f"max {max(latencies):.2f}s; {sum(latencies) / max(1, pages):.2f}s per page"
+            )
+            self.stderr.write(f"{model_calls} model calls, {total_tokens} tokens")
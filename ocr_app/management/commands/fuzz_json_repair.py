@@ -0,0 +1,147 @@
+import json
+import random
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ocr_app.services.json_repair import parse_model_json
+
+# Responses of the kinds the extractors have had to repair, kept as regression cases
+CAPTURED_RESPONSES = [
+    '```json\n{"borrower_name": "Rajendra Goswami", "loan_amount": "₹ 500000"}\n```',
+    "{'borrower_name': 'राजेंद्र गोस्वामी', 'sex': 'M', 'witness_details': []}",
+    'Here is the extracted data:\n{"property_owner": "Sunita Devi", "property_area": "1200 sq ft",}\nLet me know if you need anything else.',
+    '{"borrower_name": "Ram Kumar" "father_name": "Shyam Kumar"}',
+    '{borrower_name: "Ram", loan_amount: 250000, bank_name: "SBI"}',
+    '{"risk_summary": "Owner said "no dispute" on the land", "property_value": "₹ 40,00,000"}',
+    '{"emi_history": ["2024-01-05: 10000", "2024-02-05: 10000", "2024-03-05',
+    '{"columns": ["Date", "Amount"], "rows": [{"Date": "2024-01-05", "Amount": "10000"}, {"Date": "2024-02',
+    '{"credibility_summary": "Regular payer\nno defaults", "loan_balance": None, "is_guarantor": True}',
+    "{'name': 'D'Souza', 'loan_amount': '75000'}",
+    '{"property_area": 2400 sq ft, "property_size": 3 BHK}',
+    '[{"Date": "2024-01-05", "Amount": "10000"},, {"Date": "2024-02-05", "Amount": "10000"},]',
+]
+
+SEED_DOCUMENTS = [
+    {
+        "borrower_name": "Rajendra Goswami", "date_of_birth": "1980-04-12", "sex": "M",
+        "father_name": "राम गोस्वामी", "loan_amount": "₹ 500000", "loan_balance": "120000",
+        "witness_details": ["Sunil Kumar", "Anita Sharma"], "emi_history": ["2024-01-05: 10000"],
+        "credibility_summary": "Regular payments", "bank_name": "State Bank of India",
+    },
+    {
+        "property_owner": "சுந்தர் ராஜன்", "property_area": "1200 sq ft", "property_value": "₹ 4500000",
+        "property_coordinates": "12.97° N, 77.59° E", "risk_summary": "", "bank_name": "Canara Bank",
+    },
+    {
+        "columns": ["Date", "Principal", "Interest"],
+        "rows": [{"Date": "2024-01-05", "Principal": "1000", "Interest": "250"},
+                 {"Date": "2024-02-05", "Principal": "1010", "Interest": "240"}],
+    },
+]
+
+
+def _mutate(text, rng):
+    """Apply one random model-style corruption; returns (text, whether the value must survive)"""
+    mutation = rng.choice(['fence', 'prose', 'single_quotes', 'trailing_comma', 'drop_comma',
+                           'unquoted_keys', 'truncate'])
+    if mutation == 'fence':
+        return f"```json\n{text}\n```", True
+    if mutation == 'prose':
+        return f"Sure, here is the JSON:\n{text}\nHope this helps.", True
+    if mutation == 'single_quotes':
+        return text.replace('"', "'"), True
+    if mutation == 'trailing_comma':
+        index = text.rfind('}')
+        return text[:index] + ',' + text[index:], True
+    if mutation == 'drop_comma':
+        commas = [i for i, char in enumerate(text) if char == ',' and text[i + 1:i + 3] == ' "']
+        if not commas:
+            return text, True
+        index = rng.choice(commas)
+        return text[:index] + text[index + 1:], True
+    if mutation == 'unquoted_keys':
+        return text.replace('"borrower_name"', 'borrower_name').replace('"columns"', 'columns'), True
+    return text[:rng.randrange(1, len(text))], False
+
+
+class Command(BaseCommand):
+    help = "Fuzz and time the tolerant model JSON parser against captured and mutated responses"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=2000, help="Number of fuzzed responses")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--corpus', default=None,
+                            help="JSON-lines file of captured responses (strings or {\"response\": ...})")
+
+    def handle(self, *args, **options):
+        captured = list(CAPTURED_RESPONSES)
+        if options['corpus']:
+            try:
+                with open(options['corpus'], encoding='utf-8') as f:
+                    for line in f:
+                        if line.strip():
+                            entry = json.loads(line)
+                            captured.append(entry['response'] if isinstance(entry, dict) else entry)
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f"Could not read corpus: {str(e)}")
+
+        repairs = Counter()
+        failures = []
+        start = time.perf_counter()
+        for response in captured:
+            try:
+                parsed = parse_model_json(response)
+            except Exception as e:
+                failures.append((response, f"raised {type(e).__name__}: {str(e)}"))
+                continue
+            repairs.update(parsed.repairs)
+            if not parsed.ok or not isinstance(parsed.value, (dict, list)):
+                failures.append((response, "no JSON value recovered"))
+        captured_time = time.perf_counter() - start
+        self.stdout.write(f"Captured responses: {len(captured)}, failures: {len(failures)}, "
+                          f"{captured_time / max(1, len(captured)) * 1e6:.0f} us per response")
+
+        rng = random.Random(options['seed'])
+        mismatches = 0
+        fuzz_time = 0.0
+        for _ in range(options['iterations']):
+            document = rng.choice(SEED_DOCUMENTS)
+            text, must_survive = _mutate(json.dumps(document, ensure_ascii=False), rng)
+            if rng.random() < 0.3:
+                text, survives = _mutate(text, rng)
+                must_survive = must_survive and survives
+            begin = time.perf_counter()
+            try:
+                parsed = parse_model_json(text)
+            except Exception as e:
+                failures.append((text, f"raised {type(e).__name__}: {str(e)}"))
+                continue
+            finally:
+                fuzz_time += time.perf_counter() - begin
+            repairs.update(parsed.repairs)
+            if must_survive and parsed.value != document:
+                mismatches += 1
+                failures.append((text, f"value changed: {str(parsed.value)[:120]}"))
+            elif not must_survive and '{' in text and not isinstance(parsed.value, dict):
+                failures.append((text, "truncated response lost its object"))
+
+        clean_text = [json.dumps(document, ensure_ascii=False) for document in SEED_DOCUMENTS]
+        begin = time.perf_counter()
+        for _ in range(200):
+            for text in clean_text:
+                json.loads(text)
+        baseline = (time.perf_counter() - begin) / (200 * len(clean_text))
+
+        iterations = max(1, options['iterations'])
+        self.stdout.write(f"Fuzzed responses: {options['iterations']}, value mismatches: {mismatches}, "
+                          f"{fuzz_time / iterations * 1e6:.0f} us per response "
+                          f"(json.loads on clean output: {baseline * 1e6:.0f} us)")
+        self.stdout.write("Repairs applied:")
+        for name, count in repairs.most_common():
+            self.stdout.write(f"  {name}: {count}")
+        for text, problem in failures[:20]:
+            self.stdout.write(self.style.WARNING(f"{problem}\n  {text[:160]!r}"))
+        if failures:
+            raise CommandError(f"{len(failures)} response(s) were not handled")
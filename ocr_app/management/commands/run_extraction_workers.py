@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from ocr_app.services.job_queue import run_worker_pool
+
+
+class Command(BaseCommand):
+    help = "Run a pool of workers that process queued document extraction jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Number of worker threads (defaults to EXTRACTION_JOB_WORKERS)")
+        parser.add_argument('--poll-interval', type=float, default=None,
+                            help="Seconds to wait between polls when the queue is empty")
+
+    def handle(self, *args, **options):
+        self.stdout.write("Starting extraction workers, press CTRL-C to stop")
+        run_worker_pool(options['workers'], options['poll_interval'])
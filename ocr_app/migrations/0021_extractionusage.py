@@ -0,0 +1,32 @@
+# Generated by Django 5.0 on 2026-10-18 11:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ocr_app', '0020_extractionjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExtractionUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calls', models.PositiveIntegerField(default=0)),
+                ('failed_calls', models.PositiveIntegerField(default=0)),
+                ('latency_ms', models.FloatField(default=0)),
+                ('prompt_tokens', models.PositiveIntegerField(default=0)),
+                ('response_tokens', models.PositiveIntegerField(default=0)),
+                ('total_tokens', models.PositiveIntegerField(db_index=True, default=0)),
+                ('payload_bytes', models.PositiveBigIntegerField(default=0)),
+                ('kinds', models.JSONField(blank=True, default=dict)),
+                ('pages', models.JSONField(blank=True, default=dict)),
+                ('fields', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('extraction', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='usage', to='ocr_app.customextraction')),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0 on 2026-10-18 15:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ocr_app', '0023_translationmemory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='extractionjob',
+            name='batch_files',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='extractionjob',
+            name='batch_result',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -264,4 +264,145 @@ class CustomExtraction(models.Model):
     uploaded_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
-        return f"Custom Extraction - {self.id}"
\ No newline at end of file
+        return f"Custom Extraction - {self.id}"
+
+class ExtractionUsage(models.Model):
+    """Model calls, latency, tokens and payload bytes spent on one extraction"""
+    extraction = models.OneToOneField(CustomExtraction, on_delete=models.CASCADE, related_name='usage')
+    calls = models.PositiveIntegerField(default=0)
+    failed_calls = models.PositiveIntegerField(default=0)
+    latency_ms = models.FloatField(default=0)
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    response_tokens = models.PositiveIntegerField(default=0)
+    total_tokens = models.PositiveIntegerField(default=0, db_index=True)
+    payload_bytes = models.PositiveBigIntegerField(default=0)
+    # Totals broken down by call kind (extraction, translation), page number and field
+    kinds = models.JSONField(default=dict, blank=True)
+    pages = models.JSONField(default=dict, blank=True)
+    fields = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Usage for Custom Extraction {self.extraction_id}"
+
+class ExtractionRun(models.Model):
+    """A named offline extraction of a directory, resumable from its checkpoints"""
+    name = models.CharField(max_length=255, unique=True)
+    source = models.CharField(max_length=500)
+    document_type = models.CharField(max_length=20)
+    custom_prompt = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Extraction Run {self.name}"
+
+class ExtractionFileCheckpoint(models.Model):
+    """Progress and outcome of one file of an ExtractionRun"""
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    run = models.ForeignKey(ExtractionRun, on_delete=models.CASCADE, related_name='files')
+    path = models.CharField(max_length=500)
+    file_hash = models.CharField(max_length=64)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_RUNNING, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    total_pages = models.PositiveIntegerField(default=0)
+    processed_pages = models.PositiveIntegerField(default=0)
+    failed_pages = models.JSONField(default=list, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    latency_s = models.FloatField(null=True, blank=True)
+    extraction = models.ForeignKey(CustomExtraction, null=True, blank=True, on_delete=models.SET_NULL)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ['run', 'path']
+
+    def __str__(self):
+        return f"{self.path} ({self.status})"
+
+class ExtractionPageCheckpoint(models.Model):
+    """A finished page result of an ExtractionRun, keyed like the page result cache"""
+    run = models.ForeignKey(ExtractionRun, on_delete=models.CASCADE, related_name='pages')
+    key = models.CharField(max_length=100)
+    payload = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ['run', 'key']
+
+    def __str__(self):
+        return f"Page checkpoint {self.key}"
+
+class TranslationMemory(models.Model):
+    """A field value translated once and reused across documents, keyed by its normalized text"""
+    source_hash = models.CharField(max_length=64, unique=True)
+    source_text = models.TextField()
+    language = models.CharField(max_length=20)
+    translated = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = 'translation memory'
+
+    def __str__(self):
+        return f"{self.source_text[:50]} ({self.language})"
+
+class ExtractionJob(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    document_type = models.CharField(max_length=20)
+    original_filename = models.CharField(max_length=255)
+    file_path = models.CharField(max_length=500)
+    custom_prompt = models.TextField(blank=True, null=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True)
+    total_pages = models.PositiveIntegerField(default=0)
+    processed_pages = models.PositiveIntegerField(default=0)
+    failed_pages = models.JSONField(default=list, blank=True)
+    error = models.TextField(blank=True, default='')
+    extraction = models.ForeignKey(CustomExtraction, null=True, blank=True, on_delete=models.SET_NULL)
+    # A batch job lists its documents as [name, path] pairs, and file_path is the directory holding them
+    batch_files = models.JSONField(default=list, blank=True)
+    batch_result = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Touched by the worker on every page, so a job whose worker died stops beating
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+
+    def __str__(self):
+        return f"Extraction Job {self.id} ({self.status})"
+
+    @property
+    def is_batch(self):
+        return bool(self.batch_files)
+
+    @property
+    def progress(self):
+        """Return the fraction of pages processed, between 0 and 1"""
+        if self.status == self.STATUS_DONE:
+            return 1.0
+        if not self.total_pages:
+            return 0.0
+        return min(1.0, self.processed_pages / self.total_pages)
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+
+from PIL import Image
+
+from .extraction_cache import get_extraction_cache, get_page_cache, hash_file, hash_page_image
+from .model_registry import get_model
+from .page_encoder import release_page_payload
+from .page_executor import get_max_in_flight
+from .local_table import extract_local_table
+from .rag_utils import (
+    build_extraction_contents, clean_table_data, describe_pages, get_effective_prompt, is_mostly_empty,
+    merge_page_results, parse_extraction_response, record_rerender, track_page_info,
+)
+from .rasterize import (
+    get_pdf_page_count, get_preprocess_profile, iter_pdf_pages, limit_long_side, rerender_page,
+)
+from .schemas import (
+    extraction_generation_config, record_extraction_request, record_structured_output, uses_inline_translation,
+)
+from .scheduler import PRIORITY_INTERACTIVE, get_deadline, scheduled
+from .text_layer import TextPage
+from .usage import metered, usage_scope
+from .translation import _generate_async, split_inline_translations, translate_extracted_fields_async
+
+logger = logging.getLogger(__name__)
+
+
+async def _run_blocking(func, *args):
+    """Run CPU-bound or blocking work (rasterizing, encoding, hashing, cache I/O) in the default executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, func, *args)
+
+
+async def _request_page_fields_async(image, model, document_type, custom_prompt, semaphore,
+                                     inline_translation=False):
+    """Return the page's fields and, in inline translation mode, the translations the model gave"""
+    contents = await _run_blocking(build_extraction_contents, image, document_type, custom_prompt, inline_translation)
+    generation_config = extraction_generation_config(document_type, custom_prompt, inline_translation)
+    record_extraction_request(generation_config)
+    response = await _generate_async(model, contents, semaphore, generation_config)
+    extracted_data = parse_extraction_response(response.text, document_type, custom_prompt)
+    if inline_translation:
+        return split_inline_translations(extracted_data)
+    return extracted_data, None
+
+
+async def extract_page_data_async(image, model, document_type, custom_prompt=None, semaphore=None,
+                                  translation_mode=None):
+    """Async variant of extract_page_data; returns None if the page could not be extracted"""
+    try:
+        if document_type == 'table' and isinstance(image, TextPage):
+            local_table = extract_local_table(image)
+            if local_table is not None:
+                return clean_table_data(local_table)
+
+        inline = uses_inline_translation(document_type, custom_prompt, translation_mode)
+        extracted_data, candidates = await _request_page_fields_async(
+            image, model, document_type, custom_prompt, semaphore, inline
+        )
+        if is_mostly_empty(extracted_data, document_type):
+            sharper = await _run_blocking(rerender_page, image)
+            if sharper is not None:
+                record_structured_output(retries=1)
+                extracted_data, candidates = await _request_page_fields_async(
+                    sharper, model, document_type, custom_prompt, semaphore, inline
+                )
+                record_rerender(image, sharper)
+        if document_type == 'table':
+            return extracted_data
+        return await translate_extracted_fields_async(extracted_data, model, custom_prompt, semaphore, candidates)
+    except Exception as e:
+        logger.error(f"Error in extract_page_data_async: {str(e)}")
+        return None
+
+
+async def _extract_page_cached(image, model, document_type, custom_prompt, semaphore, page_cache, prompt):
+    """Extract one page, reusing and filling the per-page result cache"""
+    key = None
+    if page_cache is not None:
+        page_hash = await _run_blocking(hash_page_image, image)
+        key = page_cache.make_key(page_hash, document_type, prompt)
+        cached = await _run_blocking(page_cache.get, key)
+        if cached is not None:
+            return cached
+    result = await extract_page_data_async(image, model, document_type, custom_prompt, semaphore)
+    if result and key is not None:
+        await _run_blocking(page_cache.set, key, result)
+    return result
+
+
+def _load_image(file_path):
+    with Image.open(file_path) as image:
+        image.load()
+        return limit_long_side(image.copy())
+
+
+async def extract_data_from_document_async(file_path, document_type='loan', custom_prompt=None, model=None,
+                                           max_in_flight=None, use_cache=True, priority=PRIORITY_INTERACTIVE,
+                                           timeout=None):
+    """Async version of extract_data_from_document for the ASGI deployment
+
+    Rasterizing and image encoding run in an executor, while page extraction
+    and translation calls use the model's async API concurrently, bounded by a
+    single semaphore of ``max_in_flight`` model calls. Returns the same result
+    dict as the synchronous pipeline.
+    """
+    try:
+        logger.info(f"Starting async document processing of {file_path} ({document_type})")
+
+        prompt = get_effective_prompt(document_type, custom_prompt)
+        cache = get_extraction_cache() if use_cache else None
+        if cache:
+            cache_key = cache.make_key(await _run_blocking(hash_file, file_path), document_type, prompt)
+            cached_data = await _run_blocking(cache.get, cache_key)
+            if cached_data is not None:
+                logger.info("Extraction cache hit, skipping model calls")
+                return {
+                    'success': True,
+                    'structured_data': cached_data,
+                    'cached': True
+                }
+
+        if model is None:
+            model = get_model()
+        model, ledger = metered(model)
+        model = scheduled(model, priority, get_deadline(timeout))
+        semaphore = asyncio.Semaphore(max_in_flight or get_max_in_flight())
+        page_cache = get_page_cache() if use_cache else None
+
+        page_info = []
+        if file_path.lower().endswith('.pdf'):
+            logger.info(f"Streaming {await _run_blocking(get_pdf_page_count, file_path)} PDF pages")
+            pages = track_page_info(
+                iter_pdf_pages(file_path, profile=get_preprocess_profile(document_type)), page_info
+            )
+        else:
+            pages = track_page_info([await _run_blocking(_load_image, file_path)], page_info)
+
+        # Only max_in_flight pages are rendered and held at a time; the next
+        # page is pulled from the generator when one finishes
+        page_slots = asyncio.Semaphore(max_in_flight or get_max_in_flight())
+
+        async def extract_and_release(image, page_number):
+            try:
+                with usage_scope(page=page_number):
+                    return await _extract_page_cached(
+                        image, model, document_type, custom_prompt, semaphore, page_cache, prompt
+                    )
+            finally:
+                release_page_payload(image)
+                page_slots.release()
+
+        tasks = []
+        try:
+            try:
+                while True:
+                    await page_slots.acquire()
+                    image = await _run_blocking(next, pages, None)
+                    if image is None:
+                        break
+                    tasks.append(asyncio.create_task(extract_and_release(image, len(tasks) + 1)))
+            finally:
+                pages.close()
+
+            # gather keeps results in page order regardless of completion order
+            page_results = await asyncio.gather(*tasks)
+        except BaseException:
+            # A page failed to render or the request was cancelled: stop the pages still in flight
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        all_extracted_data = [result for result in page_results if result]
+        failed_pages = [i for i, result in enumerate(page_results, 1) if not result]
+        if not all_extracted_data:
+            return {
+                'success': False,
+                'error': 'Failed to extract data from document'
+            }
+
+        merged_data = merge_page_results(all_extracted_data, document_type, custom_prompt)
+        if cache and not failed_pages:
+            await _run_blocking(cache.set, cache_key, merged_data)
+
+        logger.info(f"Async processing of {file_path} complete")
+        return {
+            'success': True,
+            'structured_data': merged_data,
+            'failed_pages': failed_pages,
+            'page_stats': describe_pages(page_info),
+            'usage': ledger.summary()
+        }
+
+    except Exception as e:
+        logger.error(f"Error in extract_data_from_document_async: {str(e)}")
+        return {
+            'success': False,
+            'error': str(e)
+        }
@@ -0,0 +1,274 @@
+import logging
+import os
+import shutil
+import time
+import zipfile
+
+from django.conf import settings
+from PIL import Image
+
+from .extraction_cache import get_extraction_cache, get_page_cache, hash_file
+from .model_registry import get_model
+from .page_encoder import release_page_payload
+from .page_executor import get_max_in_flight, iter_pages, with_page_cache
+from .rag_utils import (
+    build_processed_data, describe_pages, get_effective_prompt, get_extract_function, merge_page_results,
+    track_page_info,
+)
+from .rasterize import get_pdf_page_count, get_preprocess_profile, iter_pdf_pages, limit_long_side
+from .scheduler import PRIORITY_BULK, get_deadline, scheduled
+from .usage import build_extraction_usage, metered, usage_scope
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ALLOWED_EXTENSIONS = ['pdf', 'png', 'jpg', 'jpeg']
+# Upper bound on the uncompressed size of a batch archive
+DEFAULT_BATCH_MAX_BYTES = 1024 * 1024 * 1024
+
+
+def get_allowed_extensions():
+    return [ext.lower().lstrip('.') for ext in getattr(settings, 'ALLOWED_EXTENSIONS', DEFAULT_ALLOWED_EXTENSIONS)]
+
+
+def is_supported_document(name):
+    """True for files the extractors can read, skipping hidden files and archive metadata"""
+    base = os.path.basename(name)
+    if not base or base.startswith('.') or '__MACOSX' in name.replace('\\', '/').split('/'):
+        return False
+    return os.path.splitext(base)[1].lower().lstrip('.') in get_allowed_extensions()
+
+
+def collect_directory(directory):
+    """Return ``(name, path)`` for every supported document under a directory, sorted by name"""
+    files = []
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, directory)
+            if is_supported_document(name):
+                files.append((name, path))
+    return sorted(files)
+
+
+def extract_archive(archive, workdir, max_bytes=None):
+    """Unpack the supported documents of a ZIP archive (a path or file object) into workdir.
+
+    Member paths are never used on disk: every document is written flat
+    under workdir, so an archive cannot write outside it. Returns
+    ``(name, path)`` pairs in archive order. Raises ValueError for an invalid
+    archive or one larger than ``max_bytes`` (BATCH_MAX_BYTES) uncompressed.
+    """
+    if max_bytes is None:
+        max_bytes = getattr(settings, 'BATCH_MAX_BYTES', DEFAULT_BATCH_MAX_BYTES)
+    try:
+        with zipfile.ZipFile(archive) as zf:
+            members = [m for m in zf.infolist() if not m.is_dir() and is_supported_document(m.filename)]
+            if sum(m.file_size for m in members) > max_bytes:
+                raise ValueError(f"Archive expands to more than {max_bytes} bytes")
+            files = []
+            for index, member in enumerate(members):
+                target = os.path.join(workdir, f"{index:05d}_{os.path.basename(member.filename)}")
+                with zf.open(member) as source, open(target, 'wb') as destination:
+                    shutil.copyfileobj(source, destination)
+                files.append((member.filename, target))
+            return files
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"Not a valid ZIP archive: {str(e)}")
+
+
+def collect_batch_files(source, workdir):
+    """Return ``(name, path)`` for the documents in a directory or ZIP archive path"""
+    if os.path.isdir(source):
+        return collect_directory(source)
+    return extract_archive(source, workdir)
+
+
+def _load_image(path):
+    with Image.open(path) as image:
+        image.load()
+        return limit_long_side(image.copy())
+
+
+class _BatchDocument:
+    """Book-keeping for one document of a batch while its pages are in flight"""
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.total_pages = 0
+        self.page_info = []
+        self.results = {}
+        self.error = None
+        self.cache_key = None
+        self.cached_data = None
+        self.model = None
+        self.ledger = None
+
+    @property
+    def is_pdf(self):
+        return self.path.lower().endswith('.pdf')
+
+
+def _iter_batch_pages(documents, base_model, document_type, order, priority, timeout):
+    """Yield every page of every document as ``(document, page_number, page)``, lazily.
+
+    Each document gets its own metered model, so usage is kept per document,
+    and its deadline starts when its first page is pulled, not when the batch
+    starts. ``order`` records what was yielded, in order, to map
+    ``iter_pages`` indexes back to documents.
+    """
+    profile = get_preprocess_profile(document_type)
+    for document in documents:
+        if document.error or document.cached_data is not None:
+            continue
+        model, document.ledger = metered(base_model)
+        document.model = scheduled(model, priority, get_deadline(timeout))
+        try:
+            pages = iter_pdf_pages(document.path, profile=profile) if document.is_pdf else [_load_image(document.path)]
+            for page_number, page in enumerate(track_page_info(pages, document.page_info), 1):
+                order.append((document, page_number))
+                yield document, page_number, page
+        except Exception as e:
+            logger.error(f"Could not read {document.name}: {str(e)}")
+            document.error = f"Could not read document: {str(e)}"
+
+
+def _document_result(document, document_type, custom_prompt, cache):
+    """Merge a finished document's pages into the result dict extract_data_from_document returns"""
+    if document.cached_data is not None:
+        return {'success': True, 'structured_data': document.cached_data, 'cached': True}
+    total_pages = max(document.total_pages, len(document.page_info))
+    page_results = [document.results.get(page_number) for page_number in range(1, total_pages + 1)]
+    extracted = [result for result in page_results if result]
+    if not extracted:
+        return {'success': False, 'error': document.error or 'Failed to extract data from document'}
+    failed_pages = [page_number for page_number, result in enumerate(page_results, 1) if not result]
+    merged_data = merge_page_results(extracted, document_type, custom_prompt)
+    if cache and not failed_pages and not document.error:
+        cache.set(document.cache_key, merged_data)
+    return {
+        'success': True,
+        'structured_data': merged_data,
+        'failed_pages': failed_pages,
+        'page_stats': describe_pages(document.page_info),
+        'usage': document.ledger.summary() if document.ledger else None,
+    }
+
+
+def run_batch(files, document_type='loan', custom_prompt=None, model=None, max_in_flight=None,
+              use_cache=True, priority=PRIORITY_BULK, timeout=None, progress_callback=None):
+    """Extract many documents with one shared budget of in-flight model calls.
+
+    ``files`` are ``(name, path)`` pairs. The pages of all documents are
+    streamed, in order, through a single ``iter_pages`` window of
+    ``max_in_flight`` calls, so a small document never leaves slots idle
+    while a large one is rendering. ``progress_callback(processed_pages,
+    total_pages)`` is called as pages finish. Returns ``{'documents': [...],
+    'summary': {...}}`` where each document holds its ``name``, ``path`` and
+    the same ``result`` dict extract_data_from_document returns.
+    """
+    start = time.perf_counter()
+    max_in_flight = max_in_flight or get_max_in_flight()
+    base_model = model or get_model()
+    prompt = get_effective_prompt(document_type, custom_prompt)
+    cache = get_extraction_cache() if use_cache else None
+
+    documents = []
+    for name, path in files:
+        document = _BatchDocument(name, path)
+        try:
+            if cache:
+                document.cache_key = cache.make_key(hash_file(path), document_type, prompt)
+                document.cached_data = cache.get(document.cache_key)
+            if document.cached_data is None:
+                document.total_pages = get_pdf_page_count(path) if document.is_pdf else 1
+        except Exception as e:
+            logger.error(f"Could not open {name}: {str(e)}")
+            document.error = f"Could not open document: {str(e)}"
+        documents.append(document)
+
+    extract_function = get_extract_function(document_type)
+    if use_cache:
+        extract_function = with_page_cache(extract_function, get_page_cache(), document_type, prompt)
+
+    def extract_batch_page(item, _model, custom_prompt):
+        document, page_number, page = item
+        try:
+            with usage_scope(page=page_number):
+                return extract_function(page, document.model, custom_prompt)
+        finally:
+            release_page_payload(page)
+
+    total_pages = sum(document.total_pages for document in documents)
+    order = []
+    processed_pages = 0
+    if progress_callback:
+        progress_callback(0, total_pages)
+    pages = _iter_batch_pages(documents, base_model, document_type, order, priority, timeout)
+    for index, result in iter_pages(pages, extract_batch_page, None, custom_prompt, max_in_flight):
+        document, page_number = order[index]
+        document.results[page_number] = result
+        processed_pages += 1
+        if progress_callback:
+            progress_callback(processed_pages, total_pages)
+
+    results = []
+    for document in documents:
+        try:
+            result = _document_result(document, document_type, custom_prompt, cache)
+        except Exception as e:
+            logger.error(f"Could not merge {document.name}: {str(e)}")
+            result = {'success': False, 'error': str(e)}
+        results.append({'name': document.name, 'path': document.path, 'result': result})
+
+    elapsed = time.perf_counter() - start
+    return {'documents': results, 'summary': summarize_batch(results, processed_pages, elapsed, max_in_flight)}
+
+
+def summarize_batch(results, processed_pages, elapsed, max_in_flight):
+    """Counts and throughput of a finished batch"""
+    succeeded = [entry['result'] for entry in results if entry['result']['success']]
+    usages = [result['usage']['totals'] for result in succeeded if result.get('usage')]
+    return {
+        'documents': len(results),
+        'succeeded': len(succeeded),
+        'failed': len(results) - len(succeeded),
+        'cached': sum(1 for result in succeeded if result.get('cached')),
+        'pages': processed_pages,
+        'failed_pages': sum(len(result.get('failed_pages', [])) for result in succeeded),
+        'max_in_flight': max_in_flight,
+        'elapsed_s': round(elapsed, 2),
+        'pages_per_second': round(processed_pages / elapsed, 2) if elapsed else 0.0,
+        'documents_per_minute': round(len(results) * 60 / elapsed, 1) if elapsed else 0.0,
+        'model_calls': sum(usage['calls'] for usage in usages),
+        'total_tokens': sum(usage['total_tokens'] for usage in usages),
+        'payload_bytes': sum(usage['payload_bytes'] for usage in usages),
+    }
+
+
+def save_batch_results(user, document_type, custom_prompt, batch):
+    """Store one CustomExtraction per successful document, and its usage, with bulk_create.
+
+    Sets ``extraction_id`` on each successful document entry of ``batch``.
+    """
+    from ..models import CustomExtraction, ExtractionUsage
+
+    entries = [entry for entry in batch['documents'] if entry['result']['success']]
+    extractions = CustomExtraction.objects.bulk_create([
+        CustomExtraction(
+            user=user,
+            document_type=document_type,
+            extracted_data=build_processed_data(document_type, entry['result'].get('structured_data', {})),
+            custom_prompt=custom_prompt or "Default extraction",
+        )
+        for entry in entries
+    ])
+    usages = []
+    for entry, extraction in zip(entries, extractions):
+        entry['extraction_id'] = extraction.pk
+        # Backends that do not return primary keys from bulk_create cannot link the usage
+        if extraction.pk and entry['result'].get('usage'):
+            usages.append(build_extraction_usage(extraction, entry['result']['usage']))
+    if usages:
+        ExtractionUsage.objects.bulk_create(usages)
+    return extractions
@@ -0,0 +1,116 @@
+import logging
+
+from django.utils import timezone
+
+from .extraction_cache import ExtractionCache, hash_text
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointBackend:
+    """Page result cache backend that stores entries as ExtractionPageCheckpoint rows of a run.
+
+    Plugged into an ExtractionCache, it lets ``with_page_cache`` skip every
+    page a crashed or interrupted run already finished.
+    """
+
+    def __init__(self, run):
+        self.run = run
+        self.evictions = 0
+
+    def get(self, key):
+        from ..models import ExtractionPageCheckpoint
+        return ExtractionPageCheckpoint.objects.filter(run=self.run, key=key).values_list('payload', flat=True).first()
+
+    def set(self, key, payload, ttl=None):
+        from ..models import ExtractionPageCheckpoint
+        ExtractionPageCheckpoint.objects.update_or_create(run=self.run, key=key, defaults={'payload': payload})
+
+    def delete(self, key):
+        self.run.pages.filter(key=key).delete()
+
+    def clear(self):
+        self.run.pages.all().delete()
+
+
+def get_checkpoint_page_cache(run):
+    """Return a page result cache backed by the run's page checkpoints"""
+    # Same namespace as PAGE_RESULT_CACHE, so keys are built the same way
+    return ExtractionCache(CheckpointBackend(run), ttl=None, namespace='page')
+
+
+def default_run_name(source, document_type, custom_prompt=None):
+    name = f"{source}:{document_type}"
+    if custom_prompt:
+        name += f":{hash_text(custom_prompt)[:12]}"
+    return name[-255:]
+
+
+def get_run(name, source, document_type, custom_prompt=None):
+    """Return the named run, creating it; raises ValueError if it was started with other settings"""
+    from ..models import ExtractionRun
+
+    run, created = ExtractionRun.objects.get_or_create(
+        name=name, defaults={'source': source, 'document_type': document_type, 'custom_prompt': custom_prompt}
+    )
+    if not created and (run.document_type != document_type or (run.custom_prompt or None) != (custom_prompt or None)):
+        raise ValueError(f"Run {name!r} was started with a different document type or prompt")
+    return run
+
+
+def completed_files(run):
+    """Return ``{path: file_hash}`` of the run's finished files"""
+    from ..models import ExtractionFileCheckpoint
+    return dict(run.files.filter(status=ExtractionFileCheckpoint.STATUS_DONE).values_list('path', 'file_hash'))
+
+
+def start_file(run, path, file_hash):
+    """Mark a file as running, resetting its checkpoint if the file changed since the last attempt"""
+    from ..models import ExtractionFileCheckpoint
+
+    checkpoint, _ = ExtractionFileCheckpoint.objects.get_or_create(
+        run=run, path=path, defaults={'file_hash': file_hash}
+    )
+    if checkpoint.file_hash != file_hash:
+        checkpoint.file_hash = file_hash
+        checkpoint.attempts = 0
+        checkpoint.result = None
+    checkpoint.status = ExtractionFileCheckpoint.STATUS_RUNNING
+    checkpoint.attempts += 1
+    checkpoint.processed_pages = 0
+    checkpoint.error = ''
+    checkpoint.started_at = timezone.now()
+    checkpoint.finished_at = None
+    checkpoint.save()
+    return checkpoint
+
+
+def record_file_progress(checkpoint, processed_pages, total_pages):
+    checkpoint.processed_pages = processed_pages
+    checkpoint.total_pages = total_pages
+    checkpoint.__class__.objects.filter(pk=checkpoint.pk).update(
+        processed_pages=processed_pages, total_pages=total_pages
+    )
+
+
+def finish_file(checkpoint, result, latency, extraction=None):
+    """Store a file's outcome; only complete successes are marked done and skipped on resume"""
+    from ..models import ExtractionFileCheckpoint
+
+    checkpoint.latency_s = latency
+    checkpoint.finished_at = timezone.now()
+    # A failed retry keeps the extraction of an earlier attempt, for the next one to update
+    if extraction is not None:
+        checkpoint.extraction = extraction
+    if result.get('success'):
+        checkpoint.result = result.get('structured_data')
+        checkpoint.failed_pages = result.get('failed_pages', [])
+    else:
+        checkpoint.error = result.get('error', 'Unknown error')
+    # A file with failed pages is retried on resume; its finished pages come from the page checkpoints
+    if result.get('success') and not checkpoint.failed_pages:
+        checkpoint.status = ExtractionFileCheckpoint.STATUS_DONE
+    else:
+        checkpoint.status = ExtractionFileCheckpoint.STATUS_FAILED
+    checkpoint.save()
+    return checkpoint
@@ -0,0 +1,304 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .schemas import get_structured_output_mode, get_translation_mode
+from .text_layer import TextPage
+
+logger = logging.getLogger(__name__)
+
+# Bump when the extraction pipeline changes in a way that invalidates stored results
+CACHE_VERSION = 1
+
+DEFAULT_TTL = 7 * 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def hash_file(file_path, chunk_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file's bytes"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_text(text):
+    """Return the SHA-256 hex digest of a text value"""
+    return hashlib.sha256((text or '').encode('utf-8')).hexdigest()
+
+
+def hash_page_image(page):
+    """Return the SHA-256 hex digest of a page (PIL image, TextPage or base64 string)"""
+    digest = hashlib.sha256()
+    if isinstance(page, str):
+        digest.update(page.encode('utf-8'))
+    elif isinstance(page, TextPage):
+        digest.update(b"text:")
+        digest.update(page.text.encode('utf-8'))
+    else:
+        digest.update(f"{page.mode}:{page.size[0]}x{page.size[1]}:".encode('utf-8'))
+        digest.update(page.tobytes())
+    return digest.hexdigest()
+
+
+class InMemoryLRUBackend:
+    """Process-local LRU store bounded by entry count and total payload size in UTF-8 bytes"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, payload, _ = entry
+            if expires_at is not None and expires_at < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return payload
+
+    def set(self, key, payload, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            size = len(payload.encode('utf-8'))
+            self._entries[key] = (expires_at, payload, size)
+            self._size += size
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._size > self.max_bytes
+            ):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._size -= size
+
+
+class FileSystemBackend:
+    """On-disk store, one JSON file per key, evicting least recently used files"""
+
+    def __init__(self, location, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.location = str(location)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.location, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.location, f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('expires_at') is not None and entry['expires_at'] < time.time():
+            self.delete(key)
+            return None
+        try:
+            os.utime(path)  # Mark as recently used for LRU eviction
+        except OSError:
+            pass
+        return entry.get('payload')
+
+    def set(self, key, payload, ttl=None):
+        entry = {'expires_at': time.time() + ttl if ttl else None, 'payload': payload}
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.location):
+            if name.endswith('.json'):
+                try:
+                    os.remove(os.path.join(self.location, name))
+                except OSError:
+                    pass
+
+    def _evict(self):
+        with self._lock:
+            files = []
+            for name in os.listdir(self.location):
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(self.location, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+            files.sort()
+            total = sum(size for _, size, _ in files)
+            while files and (len(files) > self.max_entries or total > self.max_bytes):
+                _, size, path = files.pop(0)
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                self.evictions += 1
+
+
+class DjangoCacheBackend:
+    """Store entries in a configured Django cache (Redis, Memcached, database, ...)
+
+    Size-based eviction is left to the cache itself (e.g. its ``MAX_ENTRIES``).
+    """
+
+    def __init__(self, alias='default'):
+        from django.core.cache import caches
+        self.cache = caches[alias]
+        self.evictions = 0
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, payload, ttl=None):
+        self.cache.set(key, payload, timeout=ttl)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class ExtractionCache:
+    """JSON result cache in front of a pluggable backend, with hit/miss stats"""
+
+    def __init__(self, backend, ttl=DEFAULT_TTL, namespace='extraction'):
+        self.backend = backend
+        self.ttl = ttl
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+        self._lock = threading.Lock()
+
+    def make_key(self, content_hash, document_type, prompt):
+        """Build a key from a content hash, the document type and the effective prompt.
+
+        The translation and structured output modes change what is extracted,
+        so results of one setting are never served under another.
+        """
+        raw = (f"v{CACHE_VERSION}:{content_hash}:{document_type}:{hash_text(prompt)}:"
+               f"{get_translation_mode()}:{get_structured_output_mode()}")
+        return f"{self.namespace}-{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+    def get(self, key):
+        payload = self.backend.get(key)
+        with self._lock:
+            if payload is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(payload)
+
+    def set(self, key, value):
+        try:
+            payload = json.dumps(value, ensure_ascii=False)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Not caching unserializable result: {str(e)}")
+            return
+        self.backend.set(key, payload, self.ttl)
+        with self._lock:
+            self.sets += 1
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'sets': self.sets,
+                'evictions': getattr(self.backend, 'evictions', 0),
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+def build_cache_backend(config):
+    """Create a cache backend from a settings dict, or None when caching is disabled"""
+    backend = config.get('BACKEND', 'memory')
+    max_entries = config.get('MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+    max_bytes = config.get('MAX_BYTES', DEFAULT_MAX_BYTES)
+    if backend == 'memory':
+        return InMemoryLRUBackend(max_entries=max_entries, max_bytes=max_bytes)
+    if backend == 'filesystem':
+        return FileSystemBackend(config['LOCATION'], max_entries=max_entries, max_bytes=max_bytes)
+    if backend == 'django':
+        return DjangoCacheBackend(config.get('CACHE_ALIAS', 'default'))
+    if backend in (None, 'none'):
+        return None
+    raise ValueError(f"Unknown extraction cache backend: {backend}")
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def _get_cache(namespace, setting_name):
+    with _caches_lock:
+        if namespace not in _caches:
+            config = getattr(settings, setting_name, {})
+            backend = build_cache_backend(config)
+            _caches[namespace] = (
+                ExtractionCache(backend, ttl=config.get('TTL', DEFAULT_TTL), namespace=namespace)
+                if backend else None
+            )
+        return _caches[namespace]
+
+
+def get_extraction_cache():
+    """Return the process-wide document result cache configured by EXTRACTION_CACHE"""
+    return _get_cache('extraction', 'EXTRACTION_CACHE')
+
+
+def get_page_cache():
+    """Return the process-wide per-page result cache configured by PAGE_RESULT_CACHE"""
+    return _get_cache('page', 'PAGE_RESULT_CACHE')
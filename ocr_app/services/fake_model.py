@@ -0,0 +1,89 @@
+import asyncio
+import json
+import random
+import threading
+import time
+
+
+class RateLimitError(Exception):
+    """What the fake raises for an injected 429, shaped like google.api_core's ResourceExhausted"""
+    code = 429
+
+
+class ServiceUnavailableError(Exception):
+    code = 503
+
+
+class FakeUsage:
+    def __init__(self, prompt_tokens, response_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = response_tokens
+        self.total_token_count = prompt_tokens + response_tokens
+
+
+class FakeResponse:
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class FakeModel:
+    """Local stand-in for a Gemini model client, for exercising the pipeline offline.
+
+    Each call sleeps ``latency`` seconds (plus up to ``jitter``), then fails
+    with a 429 with probability ``rate_limit_ratio``, with a 503 with
+    probability ``error_ratio``, or returns ``response_text`` (a string or a
+    dict that is serialized as JSON). A fake can also enforce its own
+    ``requests_per_minute`` quota, answering 429 past it like the real API.
+    Use it with ``model_registry.use_model`` or pass it to the extractors.
+    """
+
+    def __init__(self, latency=0.2, jitter=0.1, rate_limit_ratio=0.0, error_ratio=0.0,
+                 response_text='{}', requests_per_minute=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.error_ratio = error_ratio
+        self.response_text = response_text if isinstance(response_text, str) else json.dumps(response_text)
+        self.requests_per_minute = requests_per_minute
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window = []
+        self.stats = {'calls': 0, 'rate_limited': 0, 'errors': 0}
+
+    def _outcome(self, contents):
+        """Pick the latency and result of one call; returns (delay, error or response)"""
+        with self._lock:
+            self.stats['calls'] += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            roll = self._random.random()
+            now = time.monotonic()
+            if self.requests_per_minute:
+                self._window = [t for t in self._window if now - t < 60]
+                over_quota = len(self._window) >= self.requests_per_minute
+                self._window.append(now)
+            else:
+                over_quota = False
+            if over_quota or roll < self.rate_limit_ratio:
+                self.stats['rate_limited'] += 1
+                return delay / 4, RateLimitError("429 Resource has been exhausted (e.g. check quota).")
+            if roll < self.rate_limit_ratio + self.error_ratio:
+                self.stats['errors'] += 1
+                return delay, ServiceUnavailableError("503 The service is currently unavailable.")
+        prompt_tokens = len(str(contents)) // 4 + 1
+        response_tokens = len(self.response_text) // 4 + 1
+        return delay, FakeResponse(self.response_text, FakeUsage(prompt_tokens, response_tokens))
+
+    def generate_content(self, contents, **kwargs):
+        delay, outcome = self._outcome(contents)
+        time.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    async def generate_content_async(self, contents, **kwargs):
+        delay, outcome = self._outcome(contents)
+        await asyncio.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
@@ -0,0 +1,236 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .batch import run_batch, save_batch_results
+from .rag_utils import extract_data_from_document, build_processed_data
+from .scheduler import PRIORITY_BULK
+from .usage import save_extraction_usage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+DEFAULT_POLL_INTERVAL = 1.0
+# Running jobs without a heartbeat for this long are assumed to belong to a dead worker;
+# longer than GEMINI_SCHEDULER['DOCUMENT_TIMEOUT'], the most a page call can block
+DEFAULT_STALE_AFTER = 15 * 60
+# The columns process_job sets once a job has finished
+RESULT_FIELDS = ['status', 'error', 'extraction', 'failed_pages', 'batch_result', 'finished_at']
+
+
+def enqueue_job(user, document_type, file_path, original_filename, custom_prompt=None):
+    """Create a queued extraction job for a file that has already been saved"""
+    from ..models import ExtractionJob
+
+    return ExtractionJob.objects.create(
+        user=user,
+        document_type=document_type,
+        file_path=file_path,
+        original_filename=original_filename,
+        custom_prompt=custom_prompt,
+    )
+
+
+def enqueue_batch_job(user, document_type, directory, files, custom_prompt=None):
+    """Create one queued job for the ``(name, path)`` files saved under ``directory``"""
+    from ..models import ExtractionJob
+
+    return ExtractionJob.objects.create(
+        user=user,
+        document_type=document_type,
+        file_path=directory,
+        original_filename=f"{len(files)} documents",
+        custom_prompt=custom_prompt,
+        batch_files=[[name, path] for name, path in files],
+    )
+
+
+def claim_next_job():
+    """Atomically move the oldest queued job to 'running' and return it, or None"""
+    from ..models import ExtractionJob
+
+    while True:
+        with transaction.atomic():
+            job = ExtractionJob.objects.filter(status=ExtractionJob.STATUS_QUEUED).order_by('created_at').first()
+            if job is None:
+                return None
+            # Only one worker can win the conditional update, even across processes
+            now = timezone.now()
+            claimed = ExtractionJob.objects.filter(pk=job.pk, status=ExtractionJob.STATUS_QUEUED).update(
+                status=ExtractionJob.STATUS_RUNNING, started_at=now, heartbeat_at=now
+            )
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def requeue_stale_jobs(stale_after=None):
+    """Put jobs abandoned by a crashed worker back on the queue"""
+    from ..models import ExtractionJob
+
+    if stale_after is None:
+        stale_after = getattr(settings, 'EXTRACTION_JOB_STALE_AFTER', DEFAULT_STALE_AFTER)
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    count = ExtractionJob.objects.filter(
+        status=ExtractionJob.STATUS_RUNNING, heartbeat_at__lt=cutoff
+    ).update(status=ExtractionJob.STATUS_QUEUED, started_at=None, heartbeat_at=None, processed_pages=0)
+    if count:
+        logger.warning(f"Requeued {count} stale extraction job(s)")
+    return count
+
+
+def process_job(job):
+    """Run the extraction for a claimed job and record the outcome"""
+    from ..models import ExtractionJob, CustomExtraction
+
+    def update_progress(processed_pages, total_pages):
+        ExtractionJob.objects.filter(pk=job.pk).update(
+            processed_pages=processed_pages, total_pages=total_pages, heartbeat_at=timezone.now()
+        )
+
+    try:
+        if job.is_batch:
+            _run_batch_job(job, update_progress)
+            return job
+        result = extract_data_from_document(
+            job.file_path, job.document_type, job.custom_prompt, progress_callback=update_progress,
+            priority=PRIORITY_BULK
+        )
+        if not result['success']:
+            job.status = ExtractionJob.STATUS_FAILED
+            job.error = result.get('error', 'Unknown error')
+        else:
+            processed_data = build_processed_data(job.document_type, result.get('structured_data', {}))
+            job.extraction = CustomExtraction.objects.create(
+                user=job.user,
+                document_type=job.document_type,
+                extracted_data=processed_data,
+                custom_prompt=job.custom_prompt or "Default extraction"
+            )
+            save_extraction_usage(job.extraction, result.get('usage'))
+            job.failed_pages = result.get('failed_pages', [])
+            job.status = ExtractionJob.STATUS_DONE
+    except Exception as e:
+        logger.error(f"Extraction job {job.pk} failed: {str(e)}")
+        job.status = ExtractionJob.STATUS_FAILED
+        job.error = str(e)
+    finally:
+        job.finished_at = timezone.now()
+        # Progress columns are written by update_progress; saving them from this copy would roll them back
+        job.save(update_fields=RESULT_FIELDS)
+        if job.is_batch:
+            shutil.rmtree(job.file_path, ignore_errors=True)
+        else:
+            try:
+                os.remove(job.file_path)
+            except OSError:
+                pass
+    return job
+
+
+def _run_batch_job(job, update_progress):
+    """Extract every file of a batch job under one concurrency budget and store the results together"""
+    from ..models import ExtractionJob
+
+    batch = run_batch(
+        [(name, path) for name, path in job.batch_files], job.document_type, job.custom_prompt,
+        progress_callback=update_progress
+    )
+    save_batch_results(job.user, job.document_type, job.custom_prompt, batch)
+    job.batch_result = {
+        'summary': batch['summary'],
+        'documents': [
+            {
+                'name': entry['name'],
+                'success': entry['result']['success'],
+                'error': entry['result'].get('error', ''),
+                'failed_pages': entry['result'].get('failed_pages', []),
+                'extraction_id': entry.get('extraction_id'),
+            }
+            for entry in batch['documents']
+        ],
+    }
+    job.failed_pages = []
+    if batch['summary']['succeeded']:
+        job.status = ExtractionJob.STATUS_DONE
+    else:
+        job.status = ExtractionJob.STATUS_FAILED
+        job.error = 'No document of the batch could be extracted'
+
+
+class JobWorkerPool:
+    """Threads that pull queued extraction jobs from the database and run them"""
+
+    def __init__(self, num_workers=None, poll_interval=None):
+        self.num_workers = num_workers or getattr(settings, 'EXTRACTION_JOB_WORKERS', DEFAULT_WORKERS)
+        self.poll_interval = poll_interval or getattr(settings, 'EXTRACTION_JOB_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._run, name=f'extraction-worker-{i + 1}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.num_workers} extraction worker(s)")
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def is_alive(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def _run(self):
+        while not self._stop.is_set():
+            close_old_connections()
+            try:
+                # Checked on every pass so jobs of a worker that died mid-run are picked up again
+                requeue_stale_jobs()
+                job = claim_next_job()
+            except Exception as e:
+                logger.error(f"Could not claim extraction job: {str(e)}")
+                job = None
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            logger.info(f"Processing extraction job {job.pk}")
+            process_job(job)
+        close_old_connections()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def ensure_worker_pool():
+    """Start the in-process worker pool once, unless it is disabled in settings"""
+    global _pool
+    if not getattr(settings, 'EXTRACTION_JOB_AUTOSTART_WORKERS', True):
+        return None
+    with _pool_lock:
+        if _pool is None or not _pool.is_alive():
+            _pool = JobWorkerPool()
+            _pool.start()
+        return _pool
+
+
+def run_worker_pool(num_workers=None, poll_interval=None):
+    """Run a worker pool in the foreground until interrupted"""
+    pool = JobWorkerPool(num_workers, poll_interval)
+    pool.start()
+    try:
+        while pool.is_alive():
+            time.sleep(1)
+    except KeyboardInterrupt:
+        logger.info("Stopping extraction workers")
+    finally:
+        pool.stop(timeout=5)
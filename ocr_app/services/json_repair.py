@@ -0,0 +1,351 @@
+import json
+import re
+import threading
+from collections import Counter
+
+# Repairs reported by parse_model_json, in the order they are first applied
+CODE_FENCE = 'code_fence'
+SURROUNDING_TEXT = 'surrounding_text'
+SINGLE_QUOTES = 'single_quotes'
+UNESCAPED_QUOTE = 'unescaped_quote'
+CONTROL_CHARACTER = 'control_character'
+TRAILING_COMMA = 'trailing_comma'
+MISSING_COMMA = 'missing_comma'
+MISSING_COLON = 'missing_colon'
+MISSING_VALUE = 'missing_value'
+INVALID_ESCAPE = 'invalid_escape'
+UNQUOTED_KEY = 'unquoted_key'
+UNQUOTED_VALUE = 'unquoted_value'
+PYTHON_LITERAL = 'python_literal'
+TRUNCATED = 'truncated'
+
+_WHITESPACE = ' \t\r\n'
+# A quote only closes a string when the next non-blank character is one of these
+_AFTER_VALUE = ',:}]'
+_ESCAPES = {'"': '"', "'": "'", '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+_LITERALS = {'true': True, 'false': False, 'null': None}
+_PYTHON_LITERALS = {'True': True, 'False': False, 'None': None}
+
+_FENCE_RE = re.compile(r'```[A-Za-z]*[ \t]*\n?(.*?)(?:```|$)', re.S)
+_NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?')
+_PLAIN_RUN = {
+    '"': re.compile(r'[^"\\\x00-\x1f]+'),
+    "'": re.compile(r"[^'\\\x00-\x1f]+"),
+}
+_KEY_RE = re.compile(r'[^\s:,{}\[\]"\']+')
+_BARE_VALUE_RE = re.compile(r'[^,}\]\n]+')
+# A quoted key, or a blank and another string, right after a string means the
+# comma between members is missing rather than the quote being part of the text
+_NEXT_MEMBER_RE = re.compile(r'\s*["\'][^"\'\n]*["\']\s*:|\s+["\']')
+
+_MISSING = object()
+
+
+class ParsedJson:
+    """Outcome of parse_model_json: the value and the repairs needed to get it"""
+
+    __slots__ = ('value', 'repairs', 'ok')
+
+    def __init__(self, value, repairs, ok=True):
+        self.value = value
+        self.repairs = repairs
+        self.ok = ok
+
+    def __repr__(self):
+        return f"<ParsedJson ok={self.ok} repairs={self.repairs}>"
+
+
+class _TolerantParser:
+    """Single-pass recursive descent JSON parser that repairs as it reads.
+
+    It accepts single-quoted strings, unescaped quotes and raw control
+    characters inside strings, invalid escapes, unquoted keys and values,
+    Python literals, missing or doubled commas, members without a value (which
+    are dropped), and input that stops mid-way, in which case the containers
+    read so far are closed and incomplete members are dropped.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.length = len(text)
+        self.pos = 0
+        self.repairs = []
+
+    def repair(self, name):
+        if name not in self.repairs:
+            self.repairs.append(name)
+
+    def skip_whitespace(self):
+        while self.pos < self.length and self.text[self.pos] in _WHITESPACE:
+            self.pos += 1
+
+    def peek_after(self, pos):
+        """Return the next non-blank character at or after pos, or '' at the end"""
+        while pos < self.length and self.text[pos] in _WHITESPACE:
+            pos += 1
+        return self.text[pos] if pos < self.length else ''
+
+    def parse_value(self):
+        self.skip_whitespace()
+        if self.pos >= self.length:
+            return _MISSING
+        char = self.text[self.pos]
+        if char == '{':
+            return self.parse_object()
+        if char == '[':
+            return self.parse_array()
+        if char in '"\'':
+            return self.parse_string()
+        if char == '-' or char.isdigit():
+            return self.parse_number()
+        return self.parse_bare_value()
+
+    def _separator(self, closer, has_items, saw_comma):
+        """Handle what sits between members; returns (done, saw_comma) or None to read a member"""
+        self.skip_whitespace()
+        if self.pos >= self.length:
+            self.repair(TRUNCATED)
+            return True, saw_comma
+        char = self.text[self.pos]
+        if char == closer:
+            if saw_comma:
+                self.repair(TRAILING_COMMA)
+            self.pos += 1
+            return True, saw_comma
+        if char in '}]':
+            # Mismatched closer: end this container and let the parent deal with it
+            return True, saw_comma
+        if char == ',':
+            if saw_comma or not has_items:
+                self.repair(TRAILING_COMMA)
+            self.pos += 1
+            return False, True
+        if has_items and not saw_comma:
+            self.repair(MISSING_COMMA)
+        return None
+
+    def parse_object(self):
+        self.pos += 1
+        result = {}
+        members = 0
+        saw_comma = False
+        while True:
+            separator = self._separator('}', members > 0, saw_comma)
+            if separator is not None:
+                done, saw_comma = separator
+                if done:
+                    return result
+                continue
+            saw_comma = False
+
+            key = self.parse_key()
+            self.skip_whitespace()
+            if self.pos >= self.length:
+                self.repair(TRUNCATED)
+                return result
+            if self.text[self.pos] == ':':
+                self.pos += 1
+            else:
+                self.repair(MISSING_COLON)
+            members += 1
+            self.skip_whitespace()
+            if self.pos < self.length and self.text[self.pos] in ',}]':
+                # A member such as "a": , with no value; drop it and read on
+                self.repair(MISSING_VALUE)
+                continue
+            value = self.parse_value()
+            if value is _MISSING:
+                # The response stopped before this member's value
+                self.repair(TRUNCATED)
+                return result
+            result[key] = value
+
+    def parse_array(self):
+        self.pos += 1
+        result = []
+        saw_comma = False
+        while True:
+            separator = self._separator(']', bool(result), saw_comma)
+            if separator is not None:
+                done, saw_comma = separator
+                if done:
+                    return result
+                continue
+            saw_comma = False
+
+            value = self.parse_value()
+            if value is _MISSING:
+                self.repair(TRUNCATED)
+                return result
+            result.append(value)
+
+    def parse_key(self):
+        char = self.text[self.pos]
+        if char in '"\'':
+            return self.parse_string()
+        match = _KEY_RE.match(self.text, self.pos)
+        if match is None:
+            # Not a key at all; skip the character so parsing always advances
+            self.pos += 1
+            return ''
+        self.repair(UNQUOTED_KEY)
+        self.pos = match.end()
+        return match.group()
+
+    def parse_string(self):
+        quote = self.text[self.pos]
+        if quote == "'":
+            self.repair(SINGLE_QUOTES)
+        self.pos += 1
+        plain_run = _PLAIN_RUN[quote]
+        chunks = []
+        while self.pos < self.length:
+            match = plain_run.match(self.text, self.pos)
+            if match:
+                chunks.append(match.group())
+                self.pos = match.end()
+                if self.pos >= self.length:
+                    break
+            char = self.text[self.pos]
+            if char == quote:
+                # peek_after returns '' at the end of the text, which also closes the string
+                if self.peek_after(self.pos + 1) in _AFTER_VALUE or _NEXT_MEMBER_RE.match(self.text, self.pos + 1):
+                    self.pos += 1
+                    return ''.join(chunks)
+                # A quote inside the text that the model forgot to escape
+                self.repair(UNESCAPED_QUOTE)
+                chunks.append(char)
+                self.pos += 1
+            elif char == '\\':
+                chunks.append(self.parse_escape())
+            else:
+                # Anything else the plain run stops at is a raw control character
+                self.repair(CONTROL_CHARACTER)
+                chunks.append(char)
+                self.pos += 1
+        self.repair(TRUNCATED)
+        return ''.join(chunks)
+
+    def parse_escape(self):
+        self.pos += 1
+        if self.pos >= self.length:
+            return ''
+        char = self.text[self.pos]
+        if char == 'u':
+            digits = self.text[self.pos + 1:self.pos + 5]
+            if len(digits) == 4 and all(c in '0123456789abcdefABCDEF' for c in digits):
+                self.pos += 5
+                return chr(int(digits, 16))
+        if char not in _ESCAPES:
+            # Read as the character itself, e.g. \u12 becomes u12
+            self.repair(INVALID_ESCAPE)
+        self.pos += 1
+        return _ESCAPES.get(char, char)
+
+    def parse_number(self):
+        match = _NUMBER_RE.match(self.text, self.pos)
+        if match and self.peek_after(match.end()) in _AFTER_VALUE:
+            self.pos = match.end()
+            number = match.group()
+            return float(number) if any(c in number for c in '.eE') else int(number)
+        # Something like 1200 sq ft without quotes
+        return self.parse_bare_value()
+
+    def parse_bare_value(self):
+        match = _BARE_VALUE_RE.match(self.text, self.pos)
+        if match is None:
+            self.pos += 1
+            return _MISSING
+        self.pos = match.end()
+        word = match.group().strip()
+        if word in _LITERALS:
+            return _LITERALS[word]
+        if word in _PYTHON_LITERALS:
+            self.repair(PYTHON_LITERAL)
+            return _PYTHON_LITERALS[word]
+        self.repair(UNQUOTED_VALUE)
+        return word
+
+
+_stats_lock = threading.Lock()
+_stats = Counter()
+
+
+def reset_repair_stats():
+    """Reset the process-wide JSON parsing counters"""
+    with _stats_lock:
+        _stats.clear()
+
+
+def get_repair_stats():
+    """Return a snapshot of the JSON parsing counters.
+
+    ``responses`` counts every parse, split into ``clean`` (plain json.loads),
+    ``repaired`` and ``failed``; every repair name counts the responses that
+    needed it.
+    """
+    with _stats_lock:
+        stats = {'responses': 0, 'clean': 0, 'repaired': 0, 'failed': 0}
+        stats.update(_stats)
+        return stats
+
+
+def _record(outcome, repairs=()):
+    with _stats_lock:
+        _stats['responses'] += 1
+        _stats[outcome] += 1
+        for name in repairs:
+            _stats[name] += 1
+
+
+def strip_code_fence(text):
+    """Return the text inside a Markdown code fence, and whether there was one"""
+    if '```' not in text:
+        return text, False
+    # Models sometimes open the fence twice; take the first block that holds JSON
+    for match in _FENCE_RE.finditer(text):
+        if '{' in match.group(1) or '[' in match.group(1):
+            return match.group(1), True
+    return text.replace('```', ''), True
+
+
+def parse_model_json(text):
+    """Parse JSON returned by the model, repairing it in a single pass if needed.
+
+    Well-formed output goes straight through ``json.loads``. Anything else is
+    read once by a tolerant parser that handles code fences, text around the
+    JSON, single quotes, trailing or missing commas, unquoted keys and values,
+    Python literals and truncated output. Returns a ``ParsedJson`` whose
+    ``repairs`` lists what had to be fixed; ``ok`` is False when no JSON
+    object or array could be found at all.
+    """
+    if not isinstance(text, str):
+        text = str(text or '')
+    body, fenced = strip_code_fence(text)
+    repairs = [CODE_FENCE] if fenced else []
+
+    try:
+        value = json.loads(body)
+        _record('repaired' if repairs else 'clean', repairs)
+        return ParsedJson(value, repairs)
+    except ValueError:
+        pass
+
+    starts = [index for index in (body.find('{'), body.find('[')) if index >= 0]
+    if not starts:
+        _record('failed')
+        return ParsedJson(None, repairs, ok=False)
+    start = min(starts)
+
+    parser = _TolerantParser(body)
+    parser.repairs = repairs
+    if body[:start].strip():
+        parser.repair(SURROUNDING_TEXT)
+    parser.pos = start
+    value = parser.parse_value()
+    parser.skip_whitespace()
+    if parser.pos < parser.length:
+        parser.repair(SURROUNDING_TEXT)
+
+    _record('repaired', parser.repairs)
+    return ParsedJson(value, parser.repairs)
@@ -0,0 +1,186 @@
+import logging
+import re
+from collections import Counter
+from statistics import median
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIN_CONFIDENCE = 0.8
+
+# A word gap wider than this many word heights starts a new cell
+CELL_GAP_RATIO = 0.9
+# Words whose vertical centres are within this many word heights share a row
+ROW_TOLERANCE_RATIO = 0.5
+
+_NUMERIC_RE = re.compile(r'^[\d\s.,:/%₹$()+-]+$')
+
+
+def get_min_confidence():
+    return getattr(settings, 'LOCAL_TABLE_MIN_CONFIDENCE', DEFAULT_MIN_CONFIDENCE)
+
+
+def _group_rows(words, tolerance):
+    """Group words into text rows by their vertical centre, top to bottom"""
+    rows = []
+    current = []
+    current_y = None
+    for word in sorted(words, key=lambda w: ((w[1] + w[3]) / 2, w[0])):
+        y_center = (word[1] + word[3]) / 2
+        if current and abs(y_center - current_y) > tolerance:
+            rows.append(sorted(current, key=lambda w: w[0]))
+            current = []
+        current.append(word)
+        current_y = sum((w[1] + w[3]) / 2 for w in current) / len(current)
+    if current:
+        rows.append(sorted(current, key=lambda w: w[0]))
+    return rows
+
+
+def _row_cells(row, gap):
+    """Merge the words of a row into cells ``(x0, x1, text)`` split at wide gaps"""
+    cells = []
+    for word in row:
+        if cells and word[0] - cells[-1][1] <= gap:
+            x0, _, text = cells[-1]
+            cells[-1] = (x0, max(cells[-1][1], word[2]), f"{text} {word[4]}")
+        else:
+            cells.append((word[0], word[2], word[4]))
+    return cells
+
+
+def _column_bands(cell_rows):
+    """Derive column x-ranges from the rows that have the most common number of cells"""
+    counts = Counter(len(cells) for cells in cell_rows if len(cells) >= 2)
+    if not counts:
+        return []
+    column_count = max(counts.items(), key=lambda item: (item[1], item[0]))[0]
+    model_rows = [cells for cells in cell_rows if len(cells) == column_count]
+    bands = [
+        (median(cells[i][0] for cells in model_rows), median(cells[i][1] for cells in model_rows))
+        for i in range(column_count)
+    ]
+    # Overlapping bands mean the "columns" are not really separated
+    if any(bands[i][1] > bands[i + 1][0] for i in range(len(bands) - 1)):
+        return []
+    return bands
+
+
+def _assign(cells, bands):
+    """Place each cell in the band it overlaps most; returns (texts, aligned cell count)"""
+    texts = [''] * len(bands)
+    aligned = 0
+    for x0, x1, text in cells:
+        overlaps = [min(x1, b1) - max(x0, b0) for b0, b1 in bands]
+        best = max(range(len(bands)), key=lambda i: overlaps[i])
+        if overlaps[best] <= 0:
+            # No overlap: fall back to the nearest band, but it does not count as aligned
+            center = (x0 + x1) / 2
+            best = min(range(len(bands)), key=lambda i: abs((bands[i][0] + bands[i][1]) / 2 - center))
+        elif not texts[best]:
+            aligned += 1
+        texts[best] = f"{texts[best]} {text}".strip()
+    return texts, aligned
+
+
+def _column_names(header):
+    names = []
+    for i, text in enumerate(header, 1):
+        name = text or f"Column{i}"
+        if name in names:
+            name = f"{name}_{i}"
+        names.append(name)
+    return names
+
+
+def extract_table_from_words(words):
+    """Rebuild ``{"columns": [...], "rows": [...]}`` from PyMuPDF word boxes.
+
+    ``words`` are ``page.get_text("words")`` tuples ``(x0, y0, x1, y1, text, ...)``.
+    Words are grouped into rows by position, split into cells at wide gaps and
+    the cells are matched to columns found from the most common row layout.
+    Lines filling fewer than half the columns are treated as wrapped text of
+    the row above.
+    Returns ``(table, confidence)``, where confidence in [0, 1] combines the
+    share of cells that line up with a column and the share of rows that fill
+    every column.
+    """
+    words = [w for w in words if str(w[4]).strip()]
+    if not words:
+        return {"columns": [], "rows": []}, 0.0
+
+    height = median(w[3] - w[1] for w in words) or 1.0
+    cell_rows = [
+        _row_cells(row, height * CELL_GAP_RATIO)
+        for row in _group_rows(words, height * ROW_TOLERANCE_RATIO)
+    ]
+    bands = _column_bands(cell_rows)
+    if len(bands) < 2:
+        return {"columns": [], "rows": []}, 0.0
+
+    # The first row with the full layout is the header, unless it looks like data;
+    # anything above it (titles, account details) is not part of the table
+    header_index = next(i for i, cells in enumerate(cell_rows) if len(cells) == len(bands))
+    header, _ = _assign(cell_rows[header_index], bands)
+    numeric = sum(1 for text in header if _NUMERIC_RE.match(text))
+    if numeric > len(header) / 2:
+        columns = _column_names([''] * len(bands))
+        data_rows = cell_rows[header_index:]
+    else:
+        columns = _column_names(header)
+        data_rows = cell_rows[header_index + 1:]
+
+    # Single-cell lines after the table are footers ("Page 1 of 3"), not rows
+    while data_rows and len(data_rows[-1]) < 2:
+        data_rows = data_rows[:-1]
+
+    rows = []
+    total_cells = aligned_cells = complete_rows = 0
+    for cells in data_rows:
+        texts, aligned = _assign(cells, bands)
+        total_cells += len(cells)
+        aligned_cells += aligned
+        filled = sum(1 for text in texts if text)
+        if rows and filled < len(bands) / 2:
+            # A wrapped line of the previous row's cells (e.g. a long description)
+            previous = rows[-1]
+            for column, text in zip(columns, texts):
+                if text:
+                    previous[column] = f"{previous[column]} {text}".strip()
+            continue
+        if filled == len(bands):
+            complete_rows += 1
+        rows.append(dict(zip(columns, texts)))
+
+    if not rows:
+        return {"columns": columns, "rows": []}, 0.0
+    confidence = 0.5 * (aligned_cells / total_cells) + 0.5 * (complete_rows / len(rows))
+    return {"columns": columns, "rows": rows}, round(confidence, 3)
+
+
+def extract_local_table(page, min_confidence=None):
+    """Extract a table from a TextPage's word geometry without calling the model.
+
+    Returns the table, or None when the page has no word boxes or the
+    confidence is below ``min_confidence`` (LOCAL_TABLE_MIN_CONFIDENCE), in
+    which case the caller should fall back to the model. The confidence is
+    recorded in ``page.info`` either way.
+    """
+    words = getattr(page, 'words', None)
+    if not words:
+        return None
+    if min_confidence is None:
+        min_confidence = get_min_confidence()
+    try:
+        table, confidence = extract_table_from_words(words)
+    except Exception as e:
+        logger.warning(f"Local table extraction failed: {str(e)}")
+        return None
+    page.info['table_confidence'] = confidence
+    if confidence < min_confidence or not table['rows']:
+        logger.info(f"Local table confidence {confidence} too low, using the model")
+        return None
+    page.info['path'] = 'local'
+    page.info['payload_bytes'] = 0
+    return table
@@ -0,0 +1,88 @@
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_NAME = 'gemini-2.0-flash'
+
+_lock = threading.RLock()
+_models = {}
+_factory = None
+_configured_pid = None
+
+
+def get_default_model_name():
+    return getattr(settings, 'GEMINI_MODEL_NAME', DEFAULT_MODEL_NAME)
+
+
+def _config_key(generation_config):
+    """Return a hashable key for a generation config dict"""
+    if not generation_config:
+        return ''
+    return json.dumps(generation_config, sort_keys=True, default=str)
+
+
+def _gemini_factory(model_name, generation_config):
+    """Create a Gemini model, configuring the API key once per process"""
+    global _configured_pid
+    import google.generativeai as genai
+
+    if _configured_pid != os.getpid():
+        logger.info("Configuring Gemini API")
+        genai.configure(api_key=settings.GOOGLE_API_KEY)
+        _configured_pid = os.getpid()
+    return genai.GenerativeModel(model_name, generation_config=generation_config or None)
+
+
+def get_model(model_name=None, generation_config=None):
+    """Return the shared model client for a model name and generation config.
+
+    Clients are created once per worker process and reused by every request
+    and thread. After a fork the registry is rebuilt, as the underlying
+    connections must not be shared across processes.
+    """
+    model_name = model_name or get_default_model_name()
+    key = (os.getpid(), model_name, _config_key(generation_config))
+    with _lock:
+        model = _models.get(key)
+        if model is None:
+            factory = _factory or _gemini_factory
+            model = factory(model_name, generation_config)
+            _models[key] = model
+            logger.info(f"Created model client for {model_name}")
+        return model
+
+
+def set_model_factory(factory):
+    """Replace the function used to build model clients and drop cached clients.
+
+    ``factory(model_name, generation_config)`` must return an object with a
+    ``generate_content`` method. Pass ``None`` to restore the Gemini factory.
+    """
+    global _factory
+    with _lock:
+        _factory = factory
+        _models.clear()
+
+
+def reset_models():
+    """Drop every cached model client"""
+    with _lock:
+        _models.clear()
+
+
+@contextmanager
+def use_model(model):
+    """Serve ``model`` (e.g. a local fake) from the registry within the block"""
+    with _lock:
+        previous = _factory
+    set_model_factory(lambda model_name, generation_config: model)
+    try:
+        yield model
+    finally:
+        set_model_factory(previous)
@@ -0,0 +1,86 @@
+import logging
+import time
+from io import BytesIO
+
+from django.conf import settings
+from PIL import Image, features
+
+logger = logging.getLogger(__name__)
+
+# Format name -> (PIL format, MIME type sent to the model)
+PAYLOAD_FORMATS = {
+    'png': ('PNG', 'image/png'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+}
+
+DEFAULT_PAYLOAD_CONFIG = {
+    'FORMAT': 'png',
+    'PNG_COMPRESS_LEVEL': 1,
+    'JPEG_QUALITY': 85,
+    'WEBP_QUALITY': 80,
+}
+
+
+def get_payload_config():
+    """Return PAGE_PAYLOAD merged over the defaults"""
+    return {**DEFAULT_PAYLOAD_CONFIG, **getattr(settings, 'PAGE_PAYLOAD', {})}
+
+
+def _save_options(payload_format, config):
+    if payload_format == 'png':
+        return {'compress_level': config['PNG_COMPRESS_LEVEL']}
+    if payload_format == 'jpeg':
+        return {'quality': config['JPEG_QUALITY']}
+    return {'quality': config['WEBP_QUALITY']}
+
+
+def encode_page_payload(image, config=None):
+    """Encode a page image for the model and return ``(data, mime_type)``.
+
+    ``data`` is raw bytes, which the SDK sends as-is, so there is no base64
+    step. The format, size and encode time are recorded in ``image.info`` for
+    the per-page stats. The bytes are kept in ``image.info['payload']`` until
+    ``release_page_payload``, so a page is encoded once: bytes from a render
+    worker, or from an earlier request for the page, are sent again as they are.
+    """
+    config = config or get_payload_config()
+    payload_format = str(config['FORMAT']).lower()
+    if payload_format not in PAYLOAD_FORMATS:
+        raise ValueError(f"Unknown page payload format: {payload_format}")
+    if payload_format == 'webp' and not features.check('webp'):
+        logger.warning("Pillow was built without WebP support, sending PNG instead")
+        payload_format = 'png'
+
+    pil_format, mime_type = PAYLOAD_FORMATS[payload_format]
+    payload = image.info.get('payload')
+    # Resizing or converting the image in place would leave stale bytes behind
+    if payload and payload[1:] == (mime_type, image.size, image.mode):
+        image.info.update(payload_format=payload_format, payload_bytes=len(payload[0]))
+        image.info.setdefault('encode_ms', 0.0)
+        return payload[0], mime_type
+
+    source = image
+    if payload_format == 'jpeg' and image.mode not in ('L', 'RGB'):
+        source = image.convert('RGB' if 'A' in image.mode or image.mode == 'P' else 'L')
+
+    start = time.perf_counter()
+    buffered = BytesIO()
+    source.save(buffered, format=pil_format, **_save_options(payload_format, config))
+    data = buffered.getvalue()
+    encode_ms = (time.perf_counter() - start) * 1000
+
+    image.info.update(payload_format=payload_format, payload_bytes=len(data), encode_ms=round(encode_ms, 1))
+    image.info['payload'] = (data, mime_type, image.size, image.mode)
+    return data, mime_type
+
+
+def keep_page_payload(image, data):
+    """Attach bytes encoded by encode_page_payload to the image decoded from them"""
+    image.info['payload'] = (data, Image.MIME[image.format], image.size, image.mode)
+    return image
+
+
+def release_page_payload(page):
+    """Drop a finished page's encoded bytes, which the per-page stats would otherwise keep alive"""
+    getattr(page, 'info', {}).pop('payload', None)
@@ -0,0 +1,115 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from django.conf import settings
+
+from .extraction_cache import hash_page_image
+from .page_encoder import release_page_payload
+from .usage import usage_scope
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_IN_FLIGHT = 4
+
+
+def get_max_in_flight():
+    """Return the configured maximum number of concurrent model calls"""
+    return max(1, int(getattr(settings, 'GEMINI_MAX_CONCURRENT_CALLS', DEFAULT_MAX_IN_FLIGHT)))
+
+
+def with_page_cache(extract_function, page_cache, document_type, prompt):
+    """Wrap an extractor so each page's result is memoized in page_cache.
+
+    The key is the hash of the rendered page plus the document type and the
+    effective prompt, so a retry of a partially failed document only calls the
+    model for the pages that have no stored result. Failed pages are not stored.
+    """
+    if page_cache is None:
+        return extract_function
+
+    def cached_extract(page, model, custom_prompt=None):
+        key = page_cache.make_key(hash_page_image(page), document_type, prompt)
+        cached = page_cache.get(key)
+        if cached is not None:
+            logger.info("Page result cache hit")
+            return cached
+        result = extract_function(page, model, custom_prompt)
+        if result:
+            page_cache.set(key, result)
+        return result
+
+    return cached_extract
+
+
+def _run_page(extract_function, page, model, custom_prompt, page_number):
+    """Run the extractor for one page, turning unexpected errors into a failed page"""
+    try:
+        with usage_scope(page=page_number):
+            return extract_function(page, model, custom_prompt)
+    except Exception as e:
+        logger.error(f"Unexpected error extracting page {page_number}: {str(e)}")
+        return None
+    finally:
+        release_page_payload(page)
+
+
+def iter_pages(pages, extract_function, model, custom_prompt=None, max_in_flight=None):
+    """Yield ``(index, result)`` for each page as soon as its extraction finishes.
+
+    ``pages`` may be any iterable (including a generator); at most
+    ``max_in_flight`` pages are submitted at once, and the next page is only
+    pulled from ``pages`` when a slot frees up. Results arrive in completion
+    order, with ``None`` for pages that failed.
+    """
+    if max_in_flight is None:
+        max_in_flight = get_max_in_flight()
+    max_in_flight = max(1, int(max_in_flight))
+
+    # A single slot is the old sequential behaviour; no thread needed
+    if max_in_flight == 1:
+        for index, page in enumerate(pages):
+            yield index, _run_page(extract_function, page, model, custom_prompt, index + 1)
+        return
+
+    page_iter = iter(pages)
+    pending = {}
+    exhausted = False
+    submitted = 0
+
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='page-extract') as executor:
+        while pending or not exhausted:
+            # Top up the window until max_in_flight pages are being processed
+            while not exhausted and len(pending) < max_in_flight:
+                try:
+                    page = next(page_iter)
+                except StopIteration:
+                    exhausted = True
+                    break
+                future = executor.submit(
+                    _run_page, extract_function, page, model, custom_prompt, submitted + 1
+                )
+                pending[future] = submitted
+                submitted += 1
+
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+
+
+def run_pages(pages, extract_function, model, custom_prompt=None, max_in_flight=None, on_page_done=None):
+    """Run extract_function over pages with a bounded number of in-flight model calls.
+
+    The returned list holds one result per page in page order, with ``None``
+    for pages that failed, so the caller can merge exactly as it would after a
+    sequential loop. ``on_page_done(index, result)`` is called from the calling
+    thread as each page finishes, in completion order.
+    """
+    results = {}
+    for index, result in iter_pages(pages, extract_function, model, custom_prompt, max_in_flight):
+        results[index] = result
+        if on_page_done:
+            on_page_done(index, result)
+    return [results[i] for i in range(len(results))]
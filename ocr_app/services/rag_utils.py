@@ -1,17 +1,34 @@
-import google.generativeai as genai
 from django.conf import settings
-from pdf2image import convert_from_path
 from PIL import Image
-import tempfile
 import logging
-import json
 import os
+import re
+import copy
 import base64
 from io import BytesIO
-import fitz  # PyMuPDF
 import cv2
 import numpy as np
 
+from .model_registry import get_model
+from .json_repair import get_repair_stats, parse_model_json
+from .schemas import (
+    INLINE_TRANSLATION_FIELDS, declared_fields, extraction_generation_config, get_structured_output_stats,
+    record_extraction_request, record_structured_output, uses_inline_translation,
+)
+from .page_encoder import encode_page_payload
+from .text_layer import TextPage
+from .local_table import extract_local_table
+from .usage import metered
+from .scheduler import PRIORITY_INTERACTIVE, get_deadline, scheduled
+from .page_executor import iter_pages, get_max_in_flight, with_page_cache
+from .extraction_cache import get_extraction_cache, get_page_cache, hash_file
+from .rasterize import (
+    enhance_image_array, get_pdf_page_count, get_preprocess_profile, iter_pdf_pages, limit_long_side,
+    preprocess_array, rerender_page,
+)
+from .translation import get_translation_stats, split_inline_translations, translate_extracted_fields
+from .translation_memory import get_translation_memory_stats
+
 logger = logging.getLogger(__name__)
 
 # Add Poppler to system PATH
@@ -19,174 +36,8 @@ poppler_path = r"C:\Program Files\poppler-24.08.0\Library\bin"
 if poppler_path not in os.environ["PATH"]:
     os.environ["PATH"] += os.pathsep + poppler_path
 
-def image_to_base64(image):
-    """Convert PIL Image to base64 string"""
-    print(f"Converting image to base64. Image size: {image.size}")
-    buffered = BytesIO()
-    image.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode('utf-8')
-    print(f"Base64 string length: {len(img_str)}")
-    return img_str
-
-def convert_pdf_to_images(pdf_path, target_dpi=300):
-    """Convert PDF to images with quality optimizations"""
-    try:
-        print("Converting pdf to images using the optimization way")
-        pdf_document = fitz.open(pdf_path)
-        temp_dir = tempfile.mkdtemp()
-        images = []
-        
-        for page_num in range(len(pdf_document)):
-            page = pdf_document.load_page(page_num)
-            
-            # Calculate zoom factor for target DPI
-            zoom = target_dpi / 72
-            matrix = fitz.Matrix(zoom, zoom)
-            
-            pix = page.get_pixmap(
-                matrix=matrix,
-                colorspace=fitz.csGRAY,  # Grayscale conversion
-                alpha=False
-            )
-            
-            image_path = os.path.join(temp_dir, f"page_{page_num + 1}.png")
-            pix.save(image_path)
-            
-            # Apply post-processing
-            enhanced_image = enhance_image_quality(image_path)
-            cv2.imwrite(image_path, enhanced_image)
-            
-            # Convert to PIL Image for compatibility with existing code
-            pil_image = Image.open(image_path)
-            images.append(pil_image)
-            
-        return images
-    except Exception as e:
-        print(f"Error converting PDF: {str(e)}")
-        import traceback
-        print(f"Traceback: {traceback.format_exc()}")
-        return []
-
-def enhance_image_quality(image_path):
-    """Optimized image preprocessing pipeline"""
-    try:
-        img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-        
-        # CLAHE for contrast enhancement
-        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
-        img = clahe.apply(img)
-        
-        # Adaptive thresholding
-        img = cv2.adaptiveThreshold(
-            img, 255,
-            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-            cv2.THRESH_BINARY, 11, 2
-        )
-        
-        # Noise reduction
-        img = cv2.fastNlMeansDenoising(img, h=10, 
-                                    templateWindowSize=7, 
-                                    searchWindowSize=21)
-        return img
-    except Exception as e:
-        print(f"Error enhancing image: {str(e)}")
-        return cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-
-def enhance_pil_image(image):
-    """Enhance a PIL image for better OCR results"""
-    try:
-        print("Starting image enhancement")
-        # Convert to numpy array for OpenCV processing
-        img_np = np.array(image)
-        
-        # Convert to grayscale if it's a color image
-        if len(img_np.shape) == 3 and img_np.shape[2] == 3:
-            gray = cv2.cvtColor(img_np, cv2.COLOR_RGB2GRAY)
-        else:
-            gray = img_np
-            
-        # Apply CLAHE (Contrast Limited Adaptive Histogram Equalization)
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        enhanced = clahe.apply(gray)
-        
-        # Apply adaptive thresholding to separate text from background
-        # For tables, we need to be more conservative with thresholding to preserve grid lines
-        binary = cv2.adaptiveThreshold(
-            enhanced, 
-            255, 
-            cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-            cv2.THRESH_BINARY, 
-            15,  # Smaller block size for finer details
-            5    # Lower C value to preserve more details
-        )
-        
-        # Apply a light denoising to remove noise while preserving table structure
-        denoised = cv2.fastNlMeansDenoising(binary, None, 10, 7, 21)
-        
-        # Convert back to PIL image
-        enhanced_image = Image.fromarray(denoised)
-        print("Image enhancement completed successfully")
-        return enhanced_image
-    
-    except Exception as e:
-        print(f"Error in enhance_pil_image: {str(e)}")
-        # Return original image if enhancement fails
-        return image
-
-def detect_and_translate(text, model):
-    """Detect language and translate text to English using Gemini"""
-    try:
-        if not text or text.strip() == "":
-            return {"original": "", "language": "", "translated": ""}
-
-        # First, detect the language
-        prompt = f"""Analyze the following text and determine text language (ex. when you see Rajendra Goswami it is not Hindi, it is written in English). If it's in an Indian language, specify which one. Return ONLY the language code (e.g., 'hi' for Hindi, 'ta' for Tamil, etc.) or 'en' for English. Text to analyze:
-
-{text}"""
-        
-        response = model.generate_content(prompt)
-        language = response.text.strip().lower()
-        
-        result = {
-            "original": text,
-            "language": language,
-            "translated": text  # Default to original if English
-        }
-        
-        # Translate if not English and language was detected
-        if language and language != 'en':
-            translate_prompt = f"""Translate the following text from {language} to English. Provide ONLY the English translation, no additional text or explanations:
-
-{text}"""
-            translation = model.generate_content(translate_prompt)
-            translated_text = translation.text.strip()
-            if translated_text:  # Only update if we got a translation
-                result["translated"] = translated_text
-            print(f"Translation result for '{text}': {result}")  # Add debug logging
-            
-        return result
-    except Exception as e:
-        logger.error(f"Translation error: {str(e)}")
-        return {"original": text, "language": "unknown", "translated": text}
-
-def extract_property_data_from_image(image, model, custom_prompt=None):
-    """Extract property data from a single image using Gemini vision model"""
-    try:
-        print("\n=== Starting Property Data Extraction ===")
-        print(f"Image type: {type(image)}")
-        if isinstance(image, str):
-            print("Image is already a base64 string")
-            image_data = image
-        else:
-            print("Converting image to base64")
-            image_data = image_to_base64(image)
-
-        # Use custom prompt if provided, otherwise use default
-        if custom_prompt:
-            prompt = custom_prompt
-            print("Using custom prompt for property extraction")
-        else:
-            prompt = """Please extract the following information from this document image, keeping any text in its original language. Return the data in valid JSON format with these fields:
+# Default extraction prompts, keyed by document type in DEFAULT_PROMPTS below
+PROPERTY_EXTRACTION_PROMPT = """Please extract the following information from this document image, keeping any text in its original language. Return the data in valid JSON format with these fields:
             {
                 "property_owner": "",
                 "property_area": "",
@@ -211,201 +62,8 @@ def extract_property_data_from_image(image, model, custom_prompt=None):
             8. Keep all text in its original language - do not translate
             9. Use DOUBLE QUOTES for both property names and string values, not single quotes
             """
-            print("Using default prompt for property extraction")
 
-        print("\n=== Sending Request to Gemini ===")
-        print(f"Prompt length: {len(prompt)}")
-        print("Generating content with Gemini...")
-        
-        # Create image parts for the model
-        image_part = {'mime_type': 'image/jpeg', 'data': image_data}
-        response = model.generate_content([prompt, image_part])
-        
-        print("\n=== Processing Gemini Response ===")
-        print(f"Response type: {type(response)}")
-        print(f"Raw response preview: {str(response.text)[:200]}...")
-
-        # Extract JSON from the response
-        response_text = response.text
-        # Remove any markdown code block syntax if present
-        response_text = response_text.replace('```json', '').replace('```', '').strip()
-        print("\nCleaned response text preview:")
-        print(response_text[:200])
-
-        print("\n=== Parsing JSON ===")
-        try:
-            # First attempt - direct parsing
-            extracted_data = json.loads(response_text)
-        except json.JSONDecodeError as e:
-            print(f"Initial JSON parsing failed: {str(e)}")
-            
-            # Second attempt - try to find JSON-like content within the response
-            try:
-                # Look for content between curly braces
-                start_idx = response_text.find('{')
-                end_idx = response_text.rfind('}') + 1
-                
-                if start_idx >= 0 and end_idx > start_idx:
-                    json_content = response_text[start_idx:end_idx]
-                    print(f"Extracted JSON-like content: {json_content[:100]}...")
-                    
-                    # Fix Python-style dictionaries (with single quotes)
-                    if "'" in json_content:
-                        # Replace Python-style single quotes with double quotes for JSON compatibility
-                        import re
-                        
-                        # First, escape any existing double quotes that are inside string values
-                        # This pattern looks for double quotes that are between single quotes
-                        fixed_content = re.sub(r"'([^']*?)\"([^']*?)'", r'"\1\\"\2"', json_content)
-                        
-                        # Then, handle the property names (keys)
-                        # This regex looks for patterns like 'key': or 'key' :
-                        fixed_content = re.sub(r"'([^']+)'(\s*):(\s*)", r'"\1"\2:\3', fixed_content)
-                        
-                        # Then handle the string values
-                        # This regex looks for patterns like : 'value' or : 'value',
-                        fixed_content = re.sub(r":(\s*)'([^']*)'(,|\s*}|$)", r':\1"\2"\3', fixed_content)
-                        
-                        print(f"Fixed JSON content: {fixed_content[:100]}...")
-                        extracted_data = json.loads(fixed_content)
-                    else:
-                        extracted_data = json.loads(json_content)
-                else:
-                    # Third attempt - try to fix common JSON formatting issues
-                    fixed_text = response_text
-                    # Replace single quotes with double quotes for JSON compatibility
-                    fixed_text = fixed_text.replace("'", '"')
-                    # Ensure property names have double quotes
-                    import re
-                    fixed_text = re.sub(r'(\s*)(\w+)(\s*):(\s*)', r'\1"\2"\3:\4', fixed_text)
-                    print(f"Fixed JSON text: {fixed_text[:100]}...")
-                    extracted_data = json.loads(fixed_text)
-            except Exception as inner_e:
-                print(f"All JSON parsing attempts failed: {str(inner_e)}")
-                print("Falling back to a structured empty response")
-                
-                # Create a default structure based on custom prompt or use generic fields
-                extracted_data = {}
-                
-                # If we detected JSON-like content but couldn't parse it, try to extract key-value pairs manually
-                if start_idx >= 0 and end_idx > start_idx:
-                    json_content = response_text[start_idx:end_idx]
-                    print("Attempting manual extraction of key-value pairs from JSON-like content")
-                    
-                    # Simple regex to extract key-value pairs from the JSON-like content
-                    import re
-                    # Look for patterns like 'key': 'value' or "key": "value" or 'key': 123
-                    pairs = re.findall(r"['\"]([^'\"]+)['\"][\s]*:[\s]*['\"]?([^'\",}]*)['\"]*", json_content)
-                    
-                    for key, value in pairs:
-                        print(f"Manually extracted: {key} = {value}")
-                        extracted_data[key] = value.strip()
-                    
-                    if extracted_data:
-                        print(f"Successfully extracted {len(extracted_data)} key-value pairs manually")
-                
-                # If manual extraction didn't work or no JSON-like content was found,
-                # try to extract field names from the custom prompt
-                if not extracted_data and custom_prompt:
-                    # Look for field names in the custom prompt
-                    import re
-                    # Find words after "extract" or between commas, or after colons
-                    potential_fields = re.findall(r'extract\s+(\w+)|[,:\s]\s*(\w+)\s*[,:]', custom_prompt.lower())
-                    # Flatten and clean up the list
-                    fields = []
-                    for field_tuple in potential_fields:
-                        for field in field_tuple:
-                            if field and len(field) > 2 and field not in ['the', 'and', 'from', 'with', 'this', 'that']:
-                                fields.append(field)
-                    
-                    # Add extracted fields to the default structure
-                    for field in set(fields):
-                        extracted_data[field] = ""
-                
-                # If no fields were extracted or custom_prompt is None, use default fields
-                if not extracted_data and not custom_prompt:
-                    extracted_data = {
-                        "property_owner": "",
-                        "property_area": "",
-                        "property_size": "",
-                        "property_location": "",
-                        "property_coordinates": "",
-                        "property_value": "",
-                        "loan_limit": "",
-                        "risk_summary": "",
-                        "bank_name": "",
-                        "application_date": ""
-                    }
-        
-        print("JSON parsed successfully")
-        print(f"Extracted data keys: {list(extracted_data.keys())}")
-
-        # Process translations for text fields
-        translated_data = {}
-        
-        # If using a custom prompt, only process fields that were extracted
-        if custom_prompt:
-            for field in extracted_data.keys():
-                value = extracted_data.get(field, '')
-                if isinstance(value, str):
-                    translated_data[field] = detect_and_translate(value, model)
-                else:
-                    translated_data[field] = {
-                        'original': value if value is not None else '',
-                        'language': 'none',
-                        'translated': value if value is not None else ''
-                    }
-        else:
-            # For default prompts, ensure all required fields are present
-            for field in extracted_data.keys():
-                value = extracted_data.get(field, '')
-                if field in ["witness_details", "emi_history"]:
-                    # Handle arrays
-                    translated_array = []
-                    for item in value:
-                        if isinstance(item, str) and item.strip():  # Only translate non-empty strings
-                            translated_array.append(detect_and_translate(item, model))
-                        else:
-                            translated_array.append(item)
-                    translated_data[field] = translated_array
-                elif isinstance(value, str):
-                    translated_data[field] = detect_and_translate(value, model)
-                else:
-                    translated_data[field] = {
-                        'original': value if value is not None else '',
-                        'language': 'none',
-                        'translated': value if value is not None else ''
-                    }
-
-        print("\n=== Translation Complete ===")
-        return translated_data
-
-    except Exception as e:
-        print(f"\n!!! ERROR in extract_property_data_from_image: {str(e)}")
-
-        print(f"Error type: {type(e)}")
-        import traceback
-        print(f"Traceback: {traceback.format_exc()}")
-        return None
-
-def extract_loan_data_from_image(image, model, custom_prompt=None):
-    """Extract loan data from a single image using Gemini vision model"""
-    try:
-        print("\n=== Starting Loan Data Extraction ===")
-        print(f"Image type: {type(image)}")
-        if isinstance(image, str):
-            print("Image is already a base64 string")
-            image_data = image
-        else:
-            print("Converting image to base64")
-            image_data = image_to_base64(image)
-
-        # Use custom prompt if provided, otherwise use default
-        if custom_prompt:
-            prompt = custom_prompt
-            print("Using custom prompt for loan extraction")
-        else:
-            prompt = """Please extract the following information from this document image, keeping any text in its original language. Return the data in valid JSON format with these fields:
+LOAN_EXTRACTION_PROMPT = """Please extract the following information from this document image, keeping any text in its original language. Return the data in valid JSON format with these fields:
             {
                 "borrower_name": "",
                 "date_of_birth": "",
@@ -434,207 +92,8 @@ def extract_loan_data_from_image(image, model, custom_prompt=None):
             6. For witness_details and emi_history, use arrays even if empty
             7. Keep all text in its original language - do not translate
             8. Use DOUBLE QUOTES for both property names and string values, not single quotes"""
-            print("Using default prompt for loan extraction")
-
-        print("\n=== Sending Request to Gemini ===")
-        print(f"Prompt length: {len(prompt)}")
-        print("Generating content with Gemini...")
-        
-        # Create image parts for the model
-        image_part = {'mime_type': 'image/jpeg', 'data': image_data}
-        response = model.generate_content([prompt, image_part])
-        
-        print("\n=== Processing Gemini Response ===")
-        print(f"Response type: {type(response)}")
-        print(f"Raw response preview: {str(response.text)[:200]}...")
-
-        # Extract JSON from the response
-        response_text = response.text
-        # Remove any markdown code block syntax if present
-        response_text = response_text.replace('```json', '').replace('```', '').strip()
-        print("\nCleaned response text preview:")
-        print(response_text[:200])
-
-        print("\n=== Parsing JSON ===")
-        try:
-            # First attempt - direct parsing
-            extracted_data = json.loads(response_text)
-        except json.JSONDecodeError as e:
-            print(f"Initial JSON parsing failed: {str(e)}")
-            
-            # Second attempt - try to find JSON-like content within the response
-            try:
-                # Look for content between curly braces
-                start_idx = response_text.find('{')
-                end_idx = response_text.rfind('}') + 1
-                
-                if start_idx >= 0 and end_idx > start_idx:
-                    json_content = response_text[start_idx:end_idx]
-                    print(f"Extracted JSON-like content: {json_content[:100]}...")
-                    
-                    # Fix Python-style dictionaries (with single quotes)
-                    if "'" in json_content:
-                        # Replace Python-style single quotes with double quotes for JSON compatibility
-                        import re
-                        
-                        # First, escape any existing double quotes that are inside string values
-                        # This pattern looks for double quotes that are between single quotes
-                        fixed_content = re.sub(r"'([^']*?)\"([^']*?)'", r'"\1\\"\2"', json_content)
-                        
-                        # Then, handle the property names (keys)
-                        # This regex looks for patterns like 'key': or 'key' :
-                        fixed_content = re.sub(r"'([^']+)'(\s*):(\s*)", r'"\1"\2:\3', fixed_content)
-                        
-                        # Then handle the string values
-                        # This regex looks for patterns like : 'value' or : 'value',
-                        fixed_content = re.sub(r":(\s*)'([^']*)'(,|\s*}|$)", r':\1"\2"\3', fixed_content)
-                        
-                        print(f"Fixed JSON content: {fixed_content[:100]}...")
-                        extracted_data = json.loads(fixed_content)
-                    else:
-                        extracted_data = json.loads(json_content)
-                else:
-                    # Third attempt - try to fix common JSON formatting issues
-                    fixed_text = response_text
-                    # Replace single quotes with double quotes for JSON compatibility
-                    fixed_text = fixed_text.replace("'", '"')
-                    # Ensure property names have double quotes
-                    import re
-                    fixed_text = re.sub(r'(\s*)(\w+)(\s*):(\s*)', r'\1"\2"\3:\4', fixed_text)
-                    print(f"Fixed JSON text: {fixed_text[:100]}...")
-                    extracted_data = json.loads(fixed_text)
-            except Exception as inner_e:
-                print(f"All JSON parsing attempts failed: {str(inner_e)}")
-                print("Falling back to a structured empty response")
-                
-                # Create a default structure based on custom prompt or use generic fields
-                extracted_data = {}
-                
-                # If we detected JSON-like content but couldn't parse it, try to extract key-value pairs manually
-                if start_idx >= 0 and end_idx > start_idx:
-                    json_content = response_text[start_idx:end_idx]
-                    print("Attempting manual extraction of key-value pairs from JSON-like content")
-                    
-                    # Simple regex to extract key-value pairs from the JSON-like content
-                    import re
-                    # Look for patterns like 'key': 'value' or "key": "value" or 'key': 123
-                    pairs = re.findall(r"['\"]([^'\"]+)['\"][\s]*:[\s]*['\"]?([^'\",}]*)['\"]*", json_content)
-                    
-                    for key, value in pairs:
-                        print(f"Manually extracted: {key} = {value}")
-                        extracted_data[key] = value.strip()
-                    
-                    if extracted_data:
-                        print(f"Successfully extracted {len(extracted_data)} key-value pairs manually")
-                
-                # If manual extraction didn't work or no JSON-like content was found,
-                # try to extract field names from the custom prompt
-                if not extracted_data and custom_prompt:
-                    # Look for field names in the custom prompt
-                    import re
-                    # Find words after "extract" or between commas, or after colons
-                    potential_fields = re.findall(r'extract\s+(\w+)|[,:\s]\s*(\w+)\s*[,:]', custom_prompt.lower())
-                    # Flatten and clean up the list
-                    fields = []
-                    for field_tuple in potential_fields:
-                        for field in field_tuple:
-                            if field and len(field) > 2 and field not in ['the', 'and', 'from', 'with', 'this', 'that']:
-                                fields.append(field)
-                    
-                    # Add extracted fields to the default structure
-                    for field in set(fields):
-                        extracted_data[field] = ""
-                
-                # If no fields were extracted or custom_prompt is None, use default fields
-                if not extracted_data and not custom_prompt:
-                    extracted_data = {
-                        "borrower_name": "",
-                        "date_of_birth": "",
-                        "sex": "",
-                        "father_name": "",
-                        "spouse_name": "",
-                        "aadhar_number": "",
-                        "pan_number": "",
-                        "passport_number": "",
-                        "driving_license": "",
-                        "loan_amount": "",
-                        "loan_sanction_date": "",
-                        "loan_balance": "",
-                        "witness_details": [],
-                        "emi_history": [],
-                        "credibility_summary": "",
-                        "bank_name": ""
-                    }
-        
-        print("JSON parsed successfully")
-        print(f"Extracted data keys: {list(extracted_data.keys())}")
-
-        # Process translations for text fields
-        translated_data = {}
-        
-        # If using a custom prompt, only process fields that were extracted
-        if custom_prompt:
-            for field in extracted_data.keys():
-                value = extracted_data.get(field, '')
-                if isinstance(value, str):
-                    translated_data[field] = detect_and_translate(value, model)
-                else:
-                    translated_data[field] = {
-                        'original': value if value is not None else '',
-                        'language': 'none',
-                        'translated': value if value is not None else ''
-                    }
-        else:
-            # For default prompts, ensure all required fields are present
-            for field in extracted_data.keys():
-                value = extracted_data.get(field, '')
-                if field in ["witness_details", "emi_history"]:
-                    # Handle arrays
-                    translated_array = []
-                    for item in value:
-                        if isinstance(item, str) and item.strip():  # Only translate non-empty strings
-                            translated_array.append(detect_and_translate(item, model))
-                        else:
-                            translated_array.append(item)
-                    translated_data[field] = translated_array
-                elif isinstance(value, str):
-                    translated_data[field] = detect_and_translate(value, model)
-                else:
-                    translated_data[field] = {
-                        'original': value if value is not None else '',
-                        'language': 'none',
-                        'translated': value if value is not None else ''
-                    }
-
-        print("\n=== Translation Complete ===")
-        return translated_data
-
-    except Exception as e:
-        print(f"\n!!! ERROR in extract_loan_data_from_image: {str(e)}")
-        print(f"Error type: {type(e)}")
-        import traceback
-        print(f"Traceback: {traceback.format_exc()}")
-        return None
 
-def extract_table_data_from_image(image, model, custom_prompt=None):
-    """Extract table data from a single image using Gemini vision model"""
-    try:
-        print("\n=== Starting Table Data Extraction ===")
-        print(f"Image type: {type(image)}")
-        if isinstance(image, str):
-            print("Image is already a base64 string")
-            image_data = image
-        else:
-            # For tables, use the original image without enhancement
-            print("Using original image for table recognition")
-            image_data = image_to_base64(image)
-
-        # Use custom prompt if provided, otherwise use default
-        if custom_prompt:
-            prompt = custom_prompt
-            print("Using custom prompt for table extraction")
-        else:
-            prompt = """Please extract the data from this table image. Identify all columns and rows, and return the data in a structured JSON format with the following structure:
+TABLE_EXTRACTION_PROMPT = """Please extract the data from this table image. Identify all columns and rows, and return the data in a structured JSON format with the following structure:
             {
                 "columns": ["Column1", "Column2", "Column3", ...],
                 "rows": [
@@ -654,144 +113,526 @@ def extract_table_data_from_image(image, model, custom_prompt=None):
             7. Keep all text in its original language - do not translate
             8. If a cell contains numeric data, preserve it as a string with the original formatting
             """
-            print("Using default prompt for table extraction")
 
-        print("\n=== Sending Request to Gemini ===")
-        print(f"Prompt length: {len(prompt)}")
-        print("Generating content with Gemini...")
-        
-        # Create image parts for the model
-        image_part = {'mime_type': 'image/jpeg', 'data': image_data}
-        response = model.generate_content([prompt, image_part])
+DEFAULT_PROMPTS = {
+    'loan': LOAN_EXTRACTION_PROMPT,
+    'property': PROPERTY_EXTRACTION_PROMPT,
+    'table': TABLE_EXTRACTION_PROMPT,
+}
+
+# Appended to the default loan and property prompts in inline translation mode
+INLINE_TRANSLATION_INSTRUCTIONS = """
+            Translation:
+            For the fields {fields}, return an object instead of a plain string:
+            {{"original": "<text exactly as written>", "language": "<code>", "translated": "<English translation>"}}
+            The "original" follows the rules above and stays in its original language; only "translated" is in English.
+            Use language codes such as 'hi' for Hindi, 'ta' for Tamil, etc. or 'en' for English (ex. when you see Rajendra Goswami it is not Hindi, it is written in English). For English text, repeat the text as the translation.
+            For witness_details and emi_history, return an array of such objects. For a field that is not found, return the object with empty strings ({{"original": "", "language": "", "translated": ""}}), or an empty array for witness_details and emi_history. Keep every other field a plain string."""
+
+def get_effective_prompt(document_type, custom_prompt=None):
+    """Return the prompt actually sent to the model for a document type"""
+    if custom_prompt:
+        return custom_prompt
+    # Unknown document types are extracted as loan documents
+    return DEFAULT_PROMPTS.get(document_type, LOAN_EXTRACTION_PROMPT)
+
+def get_inline_translation_prompt(document_type):
+    """Return the default prompt of a loan or property document asking for translated values too"""
+    fields = ', '.join(INLINE_TRANSLATION_FIELDS[document_type])
+    return DEFAULT_PROMPTS[document_type] + INLINE_TRANSLATION_INSTRUCTIONS.format(fields=fields)
+
+def image_to_base64(image):
+    """Convert PIL Image to base64 string"""
+    print(f"Converting image to base64. Image size: {image.size}")
+    buffered = BytesIO()
+    image.save(buffered, format="PNG")
+    img_str = base64.b64encode(buffered.getvalue()).decode('utf-8')
+    print(f"Base64 string length: {len(img_str)}")
+    return img_str
+
+def convert_pdf_to_images(pdf_path, target_dpi=None):
+    """Convert PDF to images with quality optimizations
+
+    Pages are rendered, enhanced and converted entirely in memory; nothing is
+    written to disk.
+    """
+    try:
+        print("Converting pdf to images using the optimization way")
+        # Rendering and enhancement run in the render process pool (RASTERIZE_WORKERS)
+        return list(iter_pdf_pages(pdf_path, target_dpi))
+    except Exception as e:
+        print(f"Error converting PDF: {str(e)}")
+        import traceback
+        print(f"Traceback: {traceback.format_exc()}")
+        return []
+
+def enhance_image_quality(image_path):
+    """Optimized image preprocessing pipeline for an image file"""
+    return enhance_image_array(cv2.imread(image_path, cv2.IMREAD_GRAYSCALE))
+
+def enhance_pil_image(image, profile='full'):
+    """Enhance a PIL image for better OCR results"""
+    try:
+        print("Starting image enhancement")
+        # Convert to numpy array for OpenCV processing
+        img_np = np.array(image)
         
-        print("\n=== Processing Gemini Response ===")
-        print(f"Response type: {type(response)}")
-        print(f"Raw response preview: {str(response.text)[:200]}...")
-
-        # Extract JSON from the response
-        response_text = response.text
-        # Remove any markdown code block syntax if present
-        response_text = response_text.replace('```json', '').replace('```', '').strip()
-        print("\nCleaned response text preview:")
-        print(response_text[:200])
-
-        print("\n=== Parsing JSON ===")
-        try:
-            # First attempt - direct parsing
-            extracted_data = json.loads(response_text)
-        except json.JSONDecodeError as e:
-            print(f"Initial JSON parsing failed: {str(e)}")
-            
-            # Second attempt - try to find JSON-like content within the response
-            try:
-                # Look for content between curly braces
-                start_idx = response_text.find('{')
-                end_idx = response_text.rfind('}') + 1
-                
-                if start_idx >= 0 and end_idx > start_idx:
-                    json_content = response_text[start_idx:end_idx]
-                    print(f"Extracted JSON-like content: {json_content[:100]}...")
-                    
-                    # Fix Python-style dictionaries (with single quotes)
-                    if "'" in json_content:
-                        # Replace Python-style single quotes with double quotes for JSON compatibility
-                        import re
-                        
-                        # First, escape any existing double quotes that are inside string values
-                        # This pattern looks for double quotes that are between single quotes
-                        fixed_content = re.sub(r"'([^']*?)\"([^']*?)'", r'"\1\\"\2"', json_content)
-                        
-                        # Then, handle the property names (keys)
-                        # This regex looks for patterns like 'key': or 'key' :
-                        fixed_content = re.sub(r"'([^']+)'(\s*):(\s*)", r'"\1"\2:\3', fixed_content)
-                        
-                        # Then handle the string values
-                        # This regex looks for patterns like : 'value' or : 'value',
-                        fixed_content = re.sub(r":(\s*)'([^']*)'(,|\s*}|$)", r':\1"\2"\3', fixed_content)
-                        
-                        print(f"Fixed JSON content: {fixed_content[:100]}...")
-                        extracted_data = json.loads(fixed_content)
-                    else:
-                        extracted_data = json.loads(json_content)
-                else:
-                    # Third attempt - try to fix common JSON formatting issues
-                    fixed_text = response_text
-                    # Replace single quotes with double quotes for JSON compatibility
-                    fixed_text = fixed_text.replace("'", '"')
-                    # Ensure property names have double quotes
-                    import re
-                    fixed_text = re.sub(r'(\s*)(\w+)(\s*):(\s*)', r'\1"\2"\3:\4', fixed_text)
-                    print(f"Fixed JSON text: {fixed_text[:100]}...")
-                    extracted_data = json.loads(fixed_text)
-            except Exception as inner_e:
-                print(f"All JSON parsing attempts failed: {str(inner_e)}")
-                print("Falling back to a structured empty response")
-                
-                # Create a default structure for table data
-                extracted_data = {
-                    "columns": [],
-                    "rows": []
-                }
+        # Convert to grayscale if it's a color image
+        if len(img_np.shape) == 3 and img_np.shape[2] == 3:
+            gray = cv2.cvtColor(img_np, cv2.COLOR_RGB2GRAY)
+        else:
+            gray = img_np
         
-        print("JSON parsed successfully")
-        print(f"Extracted data keys: {list(extracted_data.keys())}")
-
-        # Ensure the extracted data has the expected structure
-        if "columns" not in extracted_data:
-            extracted_data["columns"] = []
-        if "rows" not in extracted_data:
-            extracted_data["rows"] = []
-
-        # Validate and clean up the data
-        columns = extracted_data["columns"]
-        rows = extracted_data["rows"]
+        # For tables, we need to be more conservative with thresholding to preserve grid lines:
+        # a smaller block size for finer details and a lower C value to preserve more details
+        enhanced, applied_profile = preprocess_array(gray, profile, clip_limit=2.0, block_size=15, c=5)
         
-        # Ensure all rows have all columns
-        for row in rows:
-            for col in columns:
-                if col not in row:
-                    row[col] = ""
+        # Convert back to PIL image
+        enhanced_image = Image.fromarray(enhanced)
+        print(f"Image enhancement completed successfully ({applied_profile} profile)")
+        return enhanced_image
+    
+    except Exception as e:
+        print(f"Error in enhance_pil_image: {str(e)}")
+        # Return original image if enhancement fails
+        return image
 
-        print(f"Extracted {len(columns)} columns and {len(rows)} rows")
+# Fields returned by the default prompts, used when a response cannot be parsed at all
+PROPERTY_DEFAULT_FIELDS = {
+    "property_owner": "",
+    "property_area": "",
+    "property_size": "",
+    "property_location": "",
+    "property_coordinates": "",
+    "property_value": "",
+    "loan_limit": "",
+    "risk_summary": "",
+    "bank_name": "",
+    "application_date": ""
+}
+
+LOAN_DEFAULT_FIELDS = {
+    "borrower_name": "",
+    "date_of_birth": "",
+    "sex": "",
+    "father_name": "",
+    "spouse_name": "",
+    "aadhar_number": "",
+    "pan_number": "",
+    "passport_number": "",
+    "driving_license": "",
+    "loan_amount": "",
+    "loan_sanction_date": "",
+    "loan_balance": "",
+    "witness_details": [],
+    "emi_history": [],
+    "credibility_summary": "",
+    "bank_name": ""
+}
+
+DEFAULT_FIELDS = {
+    'loan': LOAN_DEFAULT_FIELDS,
+    'property': PROPERTY_DEFAULT_FIELDS,
+}
+
+TEXT_LAYER_INTRO = """The document is provided below as the text layer extracted from a digital PDF page rather than as an image. Apply the instructions above to this text.
+
+Document text:
+"""
+
+def build_extraction_contents(image, document_type, custom_prompt=None, inline_translation=False):
+    """Build the prompt and image part sent to the vision model for one page
+
+    A ``TextPage`` is sent as text only, which is far smaller than an image.
+    """
+    print(f"Image type: {type(image)}")
+    if inline_translation:
+        prompt = get_inline_translation_prompt(document_type)
+    else:
+        prompt = get_effective_prompt(document_type, custom_prompt)
+    if isinstance(image, TextPage):
+        page_text = TEXT_LAYER_INTRO + image.text
+        image.info['payload_bytes'] = len(page_text.encode('utf-8'))
+        print(f"Sending text layer instead of an image: {image.info['payload_bytes']} bytes")
+        return [prompt, page_text]
+    if isinstance(image, str):
+        # Base64 strings produced by image_to_base64 are PNG
+        print("Image is already a base64 string")
+        image_data, mime_type = image, 'image/png'
+    else:
+        # Raw bytes in the configured PAGE_PAYLOAD format; size and encode
+        # time are recorded on the image for the per-page stats
+        image_data, mime_type = encode_page_payload(image)
+        print(f"Encoded page as {mime_type}: {image.info['payload_bytes']} bytes in {image.info['encode_ms']} ms")
+
+    print(f"Using {'custom' if custom_prompt else 'default'} prompt for {document_type} extraction")
+
+    # Create image parts for the model
+    image_part = {'mime_type': mime_type, 'data': image_data}
+    return [prompt, image_part]
+
+def fields_from_custom_prompt(custom_prompt):
+    """Guess field names from a custom prompt, for an empty record when parsing fails"""
+    template = declared_fields(custom_prompt)
+    if template:
+        return {field: type(value)() if isinstance(value, (list, dict)) else "" for field, value in template.items()}
+    # Find words after "extract" or between commas, or after colons
+    potential_fields = re.findall(r'extract\s+(\w+)|[,:\s]\s*(\w+)\s*[,:]', custom_prompt.lower())
+    # Flatten and clean up the list
+    fields = []
+    for field_tuple in potential_fields:
+        for field in field_tuple:
+            if field and len(field) > 2 and field not in ['the', 'and', 'from', 'with', 'this', 'that']:
+                fields.append(field)
+    return {field: "" for field in set(fields)}
+
+def parse_response_json(response_text, custom_prompt=None, default_fields=None, salvage=True):
+    """Parse a model response as JSON, repairing common formatting problems in one pass
+
+    When no JSON object can be recovered, returns an empty record built from
+    the custom prompt's fields (if ``salvage``) or from ``default_fields``.
+    """
+    parsed = parse_model_json(response_text)
+    if parsed.repairs:
+        print(f"Repaired model JSON: {', '.join(parsed.repairs)}")
+    if isinstance(parsed.value, dict):
+        return parsed.value
+
+    print("Could not parse the response as a JSON object, falling back to a structured empty response")
+    record_structured_output(empty_fallbacks=1)
+    extracted_data = {}
+    if salvage and custom_prompt:
+        extracted_data = fields_from_custom_prompt(custom_prompt)
+    
+    # If no fields were extracted or custom_prompt is None, use default fields
+    if not extracted_data and not (salvage and custom_prompt) and default_fields is not None:
+        extracted_data = copy.deepcopy(default_fields)
+    
+    return extracted_data
+
+def parse_extraction_response(response_text, document_type, custom_prompt=None):
+    """Turn the raw model response for one page into a dict of extracted fields"""
+    print("\n=== Processing Gemini Response ===")
+    print(f"Raw response preview: {str(response_text)[:200]}...")
+
+    print("\n=== Parsing JSON ===")
+    if document_type == 'table':
+        # Create a default structure for table data
+        extracted_data = parse_response_json(
+            response_text, custom_prompt, default_fields={"columns": [], "rows": []}, salvage=False
+        )
+    else:
+        extracted_data = parse_response_json(
+            response_text, custom_prompt, default_fields=DEFAULT_FIELDS.get(document_type, LOAN_DEFAULT_FIELDS)
+        )
+    
+    print("JSON parsed successfully")
+    print(f"Extracted data keys: {list(extracted_data.keys())}")
+
+    if document_type == 'table':
+        extracted_data = clean_table_data(extracted_data)
+    return extracted_data
+
+def clean_table_data(extracted_data):
+    """Ensure table data has columns and rows, and that every row has every column"""
+    # Ensure the extracted data has the expected structure
+    if "columns" not in extracted_data:
+        extracted_data["columns"] = []
+    if "rows" not in extracted_data:
+        extracted_data["rows"] = []
+
+    # Validate and clean up the data
+    columns = extracted_data["columns"]
+    rows = extracted_data["rows"]
+    
+    # Ensure all rows have all columns
+    for row in rows:
+        for col in columns:
+            if col not in row:
+                row[col] = ""
+
+    print(f"Extracted {len(columns)} columns and {len(rows)} rows")
+    return extracted_data
+
+def is_mostly_empty(extracted_data, document_type, threshold=None):
+    """Return True when most top-level fields of a page result came back empty"""
+    if threshold is None:
+        threshold = getattr(settings, 'RASTERIZE_RETRY_EMPTY_RATIO', 0.75)
+    if document_type == 'table':
+        return not extracted_data.get('rows')
+    if not extracted_data:
+        return True
+    empty = sum(1 for value in extracted_data.values() if value in (None, '', [], {}))
+    return empty / len(extracted_data) >= threshold
+
+def record_rerender(image, sharper):
+    """Carry the retry's DPI and payload size over to the page image that is reported"""
+    if hasattr(image, 'info'):
+        image.info.update(
+            path=sharper.info.get('path'),
+            render_dpi=sharper.info.get('render_dpi'),
+            payload_format=sharper.info.get('payload_format'),
+            payload_bytes=sharper.info.get('payload_bytes'),
+            encode_ms=sharper.info.get('encode_ms'),
+            rerendered=True,
+        )
+
+def _request_page_fields(image, model, document_type, custom_prompt=None, inline_translation=False):
+    """Send one page to the model and parse the fields it returns"""
+    contents = build_extraction_contents(image, document_type, custom_prompt, inline_translation)
+
+    print("\n=== Sending Request to Gemini ===")
+    print(f"Prompt length: {len(contents[0])}")
+    print("Generating content with Gemini...")
+    # JSON mode with the declared response schema, so the reply parses with one json.loads
+    generation_config = extraction_generation_config(document_type, custom_prompt, inline_translation)
+    record_extraction_request(generation_config)
+    if generation_config:
+        response = model.generate_content(contents, generation_config=generation_config)
+    else:
+        response = model.generate_content(contents)
+
+    return parse_extraction_response(response.text, document_type, custom_prompt)
+
+def extract_page_data(image, model, document_type, custom_prompt=None, translation_mode=None):
+    """Run the full extraction for one page: model call, JSON parsing and translation
+
+    A PDF page whose fields come back mostly empty (including a text-layer
+    page) is rendered again at RASTERIZE_RETRY_DPI and sent once more. Tables
+    on text-layer pages are rebuilt locally when that is reliable enough.
+    In 'inline' ``translation_mode`` (EXTRACTION_TRANSLATION_MODE by default)
+    the extraction call translates the fields too, and translation calls are
+    only made for the values it left untranslated.
+    """
+    if document_type == 'table' and isinstance(image, TextPage):
+        local_table = extract_local_table(image)
+        if local_table is not None:
+            print(f"Table rebuilt from the text layer (confidence {image.info['table_confidence']})")
+            return clean_table_data(local_table)
+
+    inline = uses_inline_translation(document_type, custom_prompt, translation_mode)
+    candidates = None
+    extracted_data = _request_page_fields(image, model, document_type, custom_prompt, inline)
+    if inline:
+        extracted_data, candidates = split_inline_translations(extracted_data)
+    if is_mostly_empty(extracted_data, document_type):
+        sharper = rerender_page(image)
+        if sharper is not None:
+            print(f"Page came back mostly empty, retrying as an image at {sharper.info['render_dpi']} DPI")
+            record_structured_output(retries=1)
+            extracted_data = _request_page_fields(sharper, model, document_type, custom_prompt, inline)
+            if inline:
+                extracted_data, candidates = split_inline_translations(extracted_data)
+            record_rerender(image, sharper)
+
+    if document_type == 'table':
         return extracted_data
 
+    # Process translations for all text fields (those inline mode left) in one batched request
+    translated_data = translate_extracted_fields(extracted_data, model, custom_prompt, candidates)
+
+    print("\n=== Translation Complete ===")
+    return translated_data
+
+def _extract_with_error_handling(image, model, document_type, custom_prompt, function_name):
+    try:
+        print(f"\n=== Starting {document_type.title()} Data Extraction ===")
+        if model is None:
+            model = scheduled(get_model())
+        return extract_page_data(image, model, document_type, custom_prompt)
     except Exception as e:
-        print(f"\n!!! ERROR in extract_table_data_from_image: {str(e)}")
+        print(f"\n!!! ERROR in {function_name}: {str(e)}")
         print(f"Error type: {type(e)}")
         import traceback
         print(f"Traceback: {traceback.format_exc()}")
         return None
 
-def extract_data_from_document(file_path, document_type='loan', custom_prompt=None):
-    """Process document and extract structured data using Gemini vision model"""
+def extract_property_data_from_image(image, model=None, custom_prompt=None):
+    """Extract property data from a single image using Gemini vision model"""
+    return _extract_with_error_handling(image, model, 'property', custom_prompt, 'extract_property_data_from_image')
+
+def extract_loan_data_from_image(image, model=None, custom_prompt=None):
+    """Extract loan data from a single image using Gemini vision model"""
+    return _extract_with_error_handling(image, model, 'loan', custom_prompt, 'extract_loan_data_from_image')
+
+def extract_table_data_from_image(image, model=None, custom_prompt=None):
+    """Extract table data from a single image using Gemini vision model"""
+    return _extract_with_error_handling(image, model, 'table', custom_prompt, 'extract_table_data_from_image')
+
+def merge_page_results(all_extracted_data, document_type='loan', custom_prompt=None):
+    """Merge per-page extraction results (in page order) into a single record"""
+    merged_data = all_extracted_data[0]  # Use first page as base
+    
+    # For table documents, we need special handling to merge tables across pages
+    if document_type == 'table':
+        if len(all_extracted_data) > 1:
+            # For tables, we'll merge by appending rows and ensuring columns are consistent
+            all_columns = set()
+            for data in all_extracted_data:
+                all_columns.update(data.get("columns", []))
+            
+            # Convert to list and maintain order
+            all_columns_list = list(all_columns)
+            
+            # Create a new merged structure
+            merged_rows = []
+            for data in all_extracted_data:
+                rows = data.get("rows", [])
+                # Ensure all rows have all columns
+                for row in rows:
+                    for col in all_columns_list:
+                        if col not in row:
+                            row[col] = ""
+                    merged_rows.append(row)
+            
+            merged_data = {
+                "columns": all_columns_list,
+                "rows": merged_rows
+            }
+        return merged_data
+    
+    # For custom prompts, we want to preserve the original field names
+    if custom_prompt:
+        for data in all_extracted_data[1:]:
+            # Update empty fields from subsequent pages
+            for key, value in data.items():
+                try:
+                    # Only process keys that already exist in merged_data
+                    if key in merged_data:
+                        # Handle dictionary values (like translated fields)
+                        if isinstance(value, dict) and isinstance(merged_data.get(key), dict):
+                            # If the original field is empty but this one has content, use this one
+                            if (not merged_data[key].get("original") or merged_data[key].get("original") == "") and value.get("original"):
+                                merged_data[key] = value
+                                print(f"Updated field {key} from subsequent page")
+                        # Handle list values
+                        elif isinstance(value, list) and isinstance(merged_data.get(key), list):
+                            # Extend lists with unique values
+                            for item in value:
+                                if item not in merged_data[key]:
+                                    merged_data[key].append(item)
+                        # Handle simple values (like dates and numbers)
+                        elif (not merged_data.get(key) or merged_data.get(key) == "") and value:
+                            merged_data[key] = value
+                            print(f"Updated field {key} from subsequent page")
+                except Exception as e:
+                    print(f"Error merging field {key}: {str(e)}")
+                    continue
+    else:
+        # Standard field merging for non-custom prompts
+        for data in all_extracted_data[1:]:
+            # Update empty fields from subsequent pages
+            for key, value in data.items():
+                try:
+                    # Handle dictionary values (like translated fields)
+                    if isinstance(value, dict) and isinstance(merged_data.get(key), dict):
+                        if not merged_data[key].get("original") and value.get("original"):
+                            merged_data[key] = value
+                    # Handle list values (like witness_details and emi_history)
+                    elif isinstance(value, list) and isinstance(merged_data.get(key), list):
+                        merged_data[key].extend(value)
+                    # Handle simple values (like dates and numbers)
+                    elif not merged_data.get(key) and value:
+                        merged_data[key] = value
+                except Exception as e:
+                    print(f"Error merging field {key}: {str(e)}")
+                    continue
+    
+    return merged_data
+
+def get_extract_function(document_type):
+    """Select the appropriate extraction function based on document type"""
+    if document_type == 'loan':
+        return extract_loan_data_from_image
+    elif document_type == 'property':
+        return extract_property_data_from_image
+    elif document_type == 'table':
+        return extract_table_data_from_image
+    # Default to loan document extraction
+    return extract_loan_data_from_image
+
+def track_page_info(pages, page_info):
+    """Pass pages through, appending each one's ``info`` dict to page_info as it is pulled"""
+    for page in pages:
+        page_info.append(getattr(page, 'info', {}))
+        yield page
+
+def describe_pages(page_info):
+    """Summarize how each page was sent (text layer or image), its DPI, preprocessing and payload"""
+    return [
+        {
+            'page': page_number,
+            'path': info.get('path', 'image'),
+            'dpi': info.get('render_dpi'),
+            'preprocess': info.get('preprocess'),
+            'payload_format': info.get('payload_format'),
+            'payload_bytes': info.get('payload_bytes'),
+            'encode_ms': info.get('encode_ms'),
+            'table_confidence': info.get('table_confidence'),
+            'rerendered': info.get('rerendered', False),
+        }
+        for page_number, info in enumerate(page_info, 1)
+    ]
+
+def iter_extraction_events(file_path, document_type='loan', custom_prompt=None, model=None,
+                           max_in_flight=None, use_cache=True, priority=PRIORITY_INTERACTIVE, timeout=None,
+                           page_cache=None):
+    """Run the document pipeline, yielding events as each page finishes
+
+    Every model call goes through the shared call scheduler at ``priority``
+    and gives up once ``timeout`` seconds (GEMINI_SCHEDULER DOCUMENT_TIMEOUT
+    by default) have passed since the document started. ``page_cache``
+    replaces PAGE_RESULT_CACHE for finished pages (e.g. database checkpoints).
+
+    Yields ``{'event': 'start', 'total_pages': n}``, then one
+    ``{'event': 'page', 'page': n, 'data': ...}`` (or ``'page_failed'``) per
+    page in completion order, and finally ``{'event': 'result', 'result': ...}``
+    holding the same dict ``extract_data_from_document`` returns, merged in
+    page order.
+    """
     try:
-        print(f"\n=== Starting Document Processing ===")
+        print("\n=== Starting Document Processing ===")
         print(f"Processing file: {file_path}")
         print(f"Document type: {document_type}")
         print(f"File exists: {os.path.exists(file_path)}")
         print(f"File size: {os.path.getsize(file_path)} bytes")
         print(f"Custom prompt provided: {bool(custom_prompt)}")
 
-        # Configure Gemini
-        print("\nConfiguring Gemini API...")
-        genai.configure(api_key=settings.GOOGLE_API_KEY)
-        model = genai.GenerativeModel('gemini-2.0-flash')
-        print("Gemini model initialized")
-        
-        all_extracted_data = []
-        
-        # Select the appropriate extraction function based on document type
-        if document_type == 'loan':
-            extract_function = extract_loan_data_from_image
-        elif document_type == 'property':
-            extract_function = extract_property_data_from_image
-        elif document_type == 'table':
-            extract_function = extract_table_data_from_image
-        else:
-            # Default to loan document extraction
-            extract_function = extract_loan_data_from_image
+        cache = get_extraction_cache() if use_cache else None
+        if cache:
+            cache_key = cache.make_key(
+                hash_file(file_path), document_type, get_effective_prompt(document_type, custom_prompt)
+            )
+            cached_data = cache.get(cache_key)
+            if cached_data is not None:
+                print(f"Extraction cache hit, skipping model calls. Cache stats: {cache.stats()}")
+                yield {'event': 'start', 'total_pages': 1}
+                yield {'event': 'result', 'result': {
+                    'success': True,
+                    'structured_data': cached_data,
+                    'cached': True
+                }}
+                return
+
+        if model is None:
+            # Reuse the process-wide Gemini client
+            model = get_model()
+            print("Gemini model ready")
+        # Record every model call of this document: latency, tokens and payload per page and field
+        model, ledger = metered(model)
+        # Rate limits, retries and the deadline apply to every call, translation included
+        model = scheduled(model, priority, get_deadline(timeout))
+        
+        # Memoize each page so retrying a partially failed document only redoes the missing pages
+        extract_function = get_extract_function(document_type)
+        if page_cache is None and use_cache:
+            page_cache = get_page_cache()
+        extract_function = with_page_cache(
+            extract_function, page_cache, document_type, get_effective_prompt(document_type, custom_prompt)
+        )
         
         # Handle PDF files
+        page_info = []
         if file_path.lower().endswith('.pdf'):
             print("\nProcessing PDF file...")
             poppler_path = r"C:\Program Files\poppler-24.08.0\Library\bin"
@@ -799,138 +640,161 @@ def extract_data_from_document(file_path, document_type='loan', custom_prompt=No
             print(f"Poppler path exists: {os.path.exists(poppler_path)}")
             
             try:
-                images = convert_pdf_to_images(file_path)
-                print(f"Converted PDF to {len(images)} images")
+                # Pages are rendered lazily: iter_pages only pulls the next one when a slot frees up
+                total_pages = get_pdf_page_count(file_path)
+                images = track_page_info(
+                    iter_pdf_pages(file_path, profile=get_preprocess_profile(document_type)), page_info
+                )
+                print(f"Streaming {total_pages} PDF pages")
             except Exception as e:
                 print(f"Error converting PDF: {str(e)}")
                 print("Checking Poppler installation:")
                 print(f"1. Checking if pdftoppm exists: {os.path.exists(os.path.join(poppler_path, 'pdftoppm.exe'))}")
                 print(f"2. Checking if pdfinfo exists: {os.path.exists(os.path.join(poppler_path, 'pdfinfo.exe'))}")
                 raise Exception(f"PDF conversion failed. Please ensure Poppler is installed correctly at {poppler_path}")
-            
-            for i, image in enumerate(images, 1):
-                print(f"\nProcessing page {i}/{len(images)}")
-                print(f"Image size: {image.size}")
-                extracted = extract_function(image, model, custom_prompt)
-                if extracted:
-                    print(f"Successfully extracted data from page {i}")
-                    all_extracted_data.append(extracted)
-                else:
-                    print(f"Failed to extract data from page {i}")
-        
         else:
             print("\nProcessing image file...")
             with Image.open(file_path) as image:
                 print(f"Image opened successfully. Size: {image.size}, Mode: {image.mode}")
-                extracted = extract_function(image, model, custom_prompt)
-                if extracted:
-                    print("Successfully extracted data from image")
-                    all_extracted_data.append(extracted)
-                else:
-                    print("Failed to extract data from image")
+                image.load()
+                images = track_page_info([limit_long_side(image.copy())], page_info)
+                total_pages = 1
+        
+        print(f"\nProcessing {total_pages} pages with up to {max_in_flight or get_max_in_flight()} concurrent model calls")
+        yield {'event': 'start', 'total_pages': total_pages}
+        
+        page_results = {}
+        for index, extracted in iter_pages(images, extract_function, model, custom_prompt, max_in_flight):
+            page_results[index] = extracted
+            if extracted:
+                print(f"Successfully extracted data from page {index + 1}")
+                yield {'event': 'page', 'page': index + 1, 'data': extracted}
+            else:
+                print(f"Failed to extract data from page {index + 1}")
+                yield {'event': 'page_failed', 'page': index + 1}
+        
+        # Merge in page order, exactly as a sequential run would
+        all_extracted_data = [page_results[i] for i in range(total_pages) if page_results.get(i)]
+        failed_pages = [i + 1 for i in range(total_pages) if not page_results.get(i)]
         
         if not all_extracted_data:
             print("\n!!! No data could be extracted from the document")
-            return {
+            yield {'event': 'result', 'result': {
                 'success': False,
                 'error': 'Failed to extract data from document'
-            }
+            }}
+            return
         
         print("\n=== Merging Data ===")
         # Merge data from all pages (for PDFs) or use single image data
-        merged_data = all_extracted_data[0]  # Use first page as base
-        
-        # For table documents, we need special handling to merge tables across pages
-        if document_type == 'table':
-            if len(all_extracted_data) > 1:
-                # For tables, we'll merge by appending rows and ensuring columns are consistent
-                all_columns = set()
-                for data in all_extracted_data:
-                    all_columns.update(data.get("columns", []))
-                
-                # Convert to list and maintain order
-                all_columns_list = list(all_columns)
-                
-                # Create a new merged structure
-                merged_rows = []
-                for data in all_extracted_data:
-                    rows = data.get("rows", [])
-                    # Ensure all rows have all columns
-                    for row in rows:
-                        for col in all_columns_list:
-                            if col not in row:
-                                row[col] = ""
-                        merged_rows.append(row)
-                
-                merged_data = {
-                    "columns": all_columns_list,
-                    "rows": merged_rows
-                }
-            return {
-                'success': True,
-                'structured_data': merged_data
-            }
+        merged_data = merge_page_results(all_extracted_data, document_type, custom_prompt)
         
-        # For custom prompts, we want to preserve the original field names
-        if custom_prompt:
-            for data in all_extracted_data[1:]:
-                # Update empty fields from subsequent pages
-                for key, value in data.items():
-                    try:
-                        # Only process keys that already exist in merged_data
-                        if key in merged_data:
-                            # Handle dictionary values (like translated fields)
-                            if isinstance(value, dict) and isinstance(merged_data.get(key), dict):
-                                # If the original field is empty but this one has content, use this one
-                                if (not merged_data[key].get("original") or merged_data[key].get("original") == "") and value.get("original"):
-                                    merged_data[key] = value
-                                    print(f"Updated field {key} from subsequent page")
-                            # Handle list values
-                            elif isinstance(value, list) and isinstance(merged_data.get(key), list):
-                                # Extend lists with unique values
-                                for item in value:
-                                    if item not in merged_data[key]:
-                                        merged_data[key].append(item)
-                            # Handle simple values (like dates and numbers)
-                            elif (not merged_data.get(key) or merged_data.get(key) == "") and value:
-                                merged_data[key] = value
-                                print(f"Updated field {key} from subsequent page")
-                    except Exception as e:
-                        print(f"Error merging field {key}: {str(e)}")
-                        continue
-        else:
-            # Standard field merging for non-custom prompts
-            for data in all_extracted_data[1:]:
-                # Update empty fields from subsequent pages
-                for key, value in data.items():
-                    try:
-                        # Handle dictionary values (like translated fields)
-                        if isinstance(value, dict) and isinstance(merged_data.get(key), dict):
-                            if not merged_data[key].get("original") and value.get("original"):
-                                merged_data[key] = value
-                        # Handle list values (like witness_details and emi_history)
-                        elif isinstance(value, list) and isinstance(merged_data.get(key), list):
-                            merged_data[key].extend(value)
-                        # Handle simple values (like dates and numbers)
-                        elif not merged_data.get(key) and value:
-                            merged_data[key] = value
-                    except Exception as e:
-                        print(f"Error merging field {key}: {str(e)}")
-                        continue
+        # Partial results are not cached so a retry gets another chance at the failed pages
+        if cache and not failed_pages:
+            cache.set(cache_key, merged_data)
         
         print("\n=== Processing Complete ===")
         print(f"Final data keys: {list(merged_data.keys())}")
-        return {
+        print(f"Translation stats: {get_translation_stats()}, memory: {get_translation_memory_stats()}")
+        print(f"Structured output stats: {get_structured_output_stats()}, JSON repairs: {get_repair_stats()}")
+        if failed_pages:
+            print(f"Pages without extracted data: {failed_pages}")
+        page_stats = describe_pages(page_info)
+        usage = ledger.summary()
+        print(f"Page render stats: {page_stats}")
+        print(f"Model usage: {usage['totals']}")
+        yield {'event': 'result', 'result': {
             'success': True,
-            'structured_data': merged_data
-        }
+            'structured_data': merged_data,
+            'failed_pages': failed_pages,
+            'page_stats': page_stats,
+            'usage': usage
+        }}
         
     except Exception as e:
         print(f"\n!!! ERROR in extract_data_from_document: {str(e)}")
         print(f"Error type: {type(e)}")
         import traceback
         print(f"Traceback: {traceback.format_exc()}")
-        return {
+        yield {'event': 'result', 'result': {
             'success': False,
             'error': str(e)
-        }
\ No newline at end of file
+        }}
+
+def extract_data_from_document(file_path, document_type='loan', custom_prompt=None, model=None,
+                               max_in_flight=None, use_cache=True, progress_callback=None,
+                               priority=PRIORITY_INTERACTIVE, timeout=None, page_cache=None):
+    """Process document and extract structured data using Gemini vision model
+
+    Pages of a PDF are sent to the model concurrently, with at most
+    ``max_in_flight`` calls outstanding (``GEMINI_MAX_CONCURRENT_CALLS`` by
+    default). The model comes from the shared registry unless one is passed in.
+    Results are cached by file content, document type and effective prompt
+    (see ``EXTRACTION_CACHE``); a hit skips rasterizing and the model entirely.
+    ``progress_callback(processed_pages, total_pages)`` is called as pages finish.
+    Calls are queued at ``priority`` (background jobs pass PRIORITY_BULK) and
+    retried on rate limits and transient errors until ``timeout``.
+    """
+    total_pages = 0
+    processed_pages = 0
+    for event in iter_extraction_events(file_path, document_type, custom_prompt, model, max_in_flight, use_cache,
+                                        priority, timeout, page_cache):
+        if event['event'] == 'start':
+            total_pages = event['total_pages']
+            if progress_callback:
+                progress_callback(0, total_pages)
+        elif event['event'] in ('page', 'page_failed'):
+            processed_pages += 1
+            if progress_callback:
+                progress_callback(processed_pages, total_pages)
+        elif event['event'] == 'result':
+            if progress_callback and event['result'].get('cached'):
+                progress_callback(total_pages, total_pages)
+            return event['result']
+    return {
+        'success': False,
+        'error': 'Extraction finished without a result'
+    }
+
+
+def build_processed_data(document_type, extracted_data):
+    """Normalize merged extraction output into the structure stored on CustomExtraction"""
+    # For table documents, keep the original structure
+    if document_type == 'table':
+        return extracted_data
+    
+    processed_data = {}
+    # Process each field to ensure it has the right structure
+    for key, value in extracted_data.items():
+        # If value is already a dict with 'original', 'language', 'translated' structure, keep it as is
+        if isinstance(value, dict) and 'original' in value and 'language' in value and 'translated' in value:
+            processed_data[key] = value
+        # If value is a string, convert it to the structured format
+        elif isinstance(value, str):
+            # Only process non-empty strings
+            if value.strip():
+                processed_data[key] = {
+                    'original': value,
+                    'language': 'auto',  # Will be determined during translation
+                    'translated': value  # Default to original, will be translated if needed
+                }
+            else:
+                processed_data[key] = {
+                    'original': '',
+                    'language': 'none',
+                    'translated': ''
+                }
+        # For other types (like lists or empty values), keep as is
+        else:
+            processed_data[key] = value
+    return processed_data
+
+def get_detected_languages(document_type, processed_data):
+    """Return (field name, language) pairs for fields that were not in English"""
+    languages_detected = []
+    if document_type != 'table':
+        for key, value in processed_data.items():
+            if isinstance(value, dict) and 'language' in value and value.get('language') not in ['en', 'none', '']:
+                field_name = key.replace('_', ' ').title()
+                languages_detected.append((field_name, value.get('language')))
+    return languages_detected
@@ -0,0 +1,379 @@
+import logging
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+from .page_encoder import encode_page_payload, get_payload_config, keep_page_payload
+from .text_layer import TextPage, get_text_layer_config, page_words, usable_page_text
+
+logger = logging.getLogger(__name__)
+
+# The vision model downsamples large images, so pages are rendered at a modest
+# DPI with a cap on the longest side and only re-rendered sharper when needed
+DEFAULT_DPI = 200
+DEFAULT_MAX_LONG_SIDE = 2000
+DEFAULT_RETRY_DPI = 300
+DEFAULT_RENDER_WORKERS = 1
+# 'none', 'fast' (CLAHE + threshold), 'full' (denoise first) or 'auto' (full only on noisy pages)
+PREPROCESS_PROFILES = ('none', 'fast', 'full', 'auto')
+DEFAULT_PROFILE = 'auto'
+# Estimated noise sigma (in gray levels) above which 'auto' runs the denoiser
+DEFAULT_NOISE_THRESHOLD = 4.0
+DEFAULT_RENDER_CHUNK_PAGES = 4
+
+
+def pixmap_to_array(pix):
+    """Return a uint8 NumPy view over a pixmap's sample buffer.
+
+    ``samples_mv`` exposes the pixmap memory directly, so no copy is made; the
+    array is only valid while ``pix`` is alive. Older PyMuPDF versions only
+    offer ``samples`` (a bytes copy).
+    """
+    samples = getattr(pix, 'samples_mv', None)
+    if samples is None:
+        samples = pix.samples
+    array = np.frombuffer(samples, dtype=np.uint8)
+    # Rows can be padded, so slice by stride rather than reshaping to w * n
+    array = array.reshape(pix.height, pix.stride)[:, :pix.width * pix.n]
+    if pix.n == 1:
+        return array
+    return array.reshape(pix.height, pix.width, pix.n)
+
+
+def estimate_noise(img):
+    """Estimate the standard deviation of Gaussian noise in a grayscale image.
+
+    Uses Immerkaer's method: the image is convolved with a Laplacian-difference
+    kernel that cancels out edges and smooth gradients, leaving mostly noise.
+    It is a single filter pass, so much cheaper than the denoiser it gates.
+    """
+    kernel = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+    height, width = img.shape[:2]
+    if height < 3 or width < 3:
+        return 0.0
+    response = cv2.filter2D(img.astype(np.float32), -1, kernel)[1:-1, 1:-1]
+    return float(np.sqrt(np.pi / 2) * np.abs(response).sum() / (6 * (width - 2) * (height - 2)))
+
+
+def get_noise_threshold():
+    return getattr(settings, 'PREPROCESS_NOISE_THRESHOLD', DEFAULT_NOISE_THRESHOLD)
+
+
+def get_preprocess_profile(document_type=None):
+    """Return the preprocessing profile configured for a document type"""
+    profiles = getattr(settings, 'PREPROCESS_PROFILES', {})
+    return profiles.get(document_type, profiles.get('default', DEFAULT_PROFILE))
+
+
+def preprocess_array(img, profile=DEFAULT_PROFILE, clip_limit=3.0, block_size=11, c=2):
+    """Apply a preprocessing profile to a grayscale array.
+
+    Returns ``(array, applied_profile)``, where 'auto' resolves to 'full' on
+    noisy pages and 'fast' otherwise. The returned array never shares memory
+    with ``img``, so ``img`` may be a view over a pixmap.
+    """
+    if profile not in PREPROCESS_PROFILES:
+        raise ValueError(f"Unknown preprocessing profile: {profile}")
+    if profile == 'none':
+        return np.array(img, copy=True), 'none'
+    if profile == 'auto':
+        profile = 'full' if estimate_noise(img) > get_noise_threshold() else 'fast'
+    try:
+        enhanced = img
+        if profile == 'full':
+            # Denoise the grayscale page, where it helps; after binarization it does little
+            enhanced = cv2.fastNlMeansDenoising(enhanced, h=10,
+                                                templateWindowSize=7,
+                                                searchWindowSize=21)
+
+        # CLAHE for contrast enhancement
+        clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=(8, 8))
+        enhanced = clahe.apply(enhanced)
+
+        # Adaptive thresholding
+        enhanced = cv2.adaptiveThreshold(
+            enhanced, 255,
+            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            cv2.THRESH_BINARY, block_size, c
+        )
+        return enhanced, profile
+    except Exception as e:
+        logger.error(f"Error enhancing image: {str(e)}")
+        return np.array(img, copy=True), 'none'
+
+
+def enhance_image_array(img, profile=DEFAULT_PROFILE):
+    """Optimized image preprocessing pipeline on a grayscale array"""
+    return preprocess_array(img, profile)[0]
+
+
+def render_page_array(page, target_dpi=DEFAULT_DPI, profile=DEFAULT_PROFILE):
+    """Render a PDF page to a grayscale array without touching the disk.
+
+    Returns ``(array, applied_profile)``.
+    """
+    zoom = target_dpi / 72
+    pix = page.get_pixmap(
+        matrix=fitz.Matrix(zoom, zoom),
+        colorspace=fitz.csGRAY,  # Grayscale conversion
+        alpha=False
+    )
+    # The result owns its memory, as the pixmap is freed with this frame
+    return preprocess_array(pixmap_to_array(pix), profile)
+
+
+def get_render_dpi():
+    return getattr(settings, 'RASTERIZE_DPI', DEFAULT_DPI)
+
+
+def get_max_long_side():
+    return getattr(settings, 'RASTERIZE_MAX_LONG_SIDE', DEFAULT_MAX_LONG_SIDE)
+
+
+def get_retry_dpi():
+    return getattr(settings, 'RASTERIZE_RETRY_DPI', DEFAULT_RETRY_DPI)
+
+
+def effective_dpi(page, target_dpi, max_long_side=None):
+    """Return target_dpi, lowered if needed so the page's longest side fits in max_long_side pixels"""
+    if max_long_side:
+        long_side_points = max(page.rect.width, page.rect.height)
+        target_dpi = min(target_dpi, max_long_side * 72 / long_side_points)
+    return target_dpi
+
+
+def tag_page_image(image, pdf_path, page_num, dpi, profile=None, applied_profile=None):
+    """Record where a page image came from and how it was rendered in ``image.info``.
+
+    The pipeline reads these back to re-render a page and to report per-page
+    DPI, preprocessing and payload size.
+    """
+    image.info['path'] = 'image'
+    image.info['render_source'] = (pdf_path, page_num)
+    image.info['render_dpi'] = round(dpi)
+    if profile is not None:
+        image.info['preprocess_profile'] = profile
+    if applied_profile is not None:
+        image.info['preprocess'] = applied_profile
+    return image
+
+
+def render_page_image(page, target_dpi=DEFAULT_DPI, profile=DEFAULT_PROFILE, max_long_side=None):
+    """Render and enhance a PDF page into a PIL image ready for the encoder"""
+    dpi = effective_dpi(page, target_dpi, max_long_side)
+    array, applied_profile = render_page_array(page, dpi, profile)
+    image = Image.fromarray(array)
+    image.info.update(render_dpi=round(dpi), preprocess_profile=profile, preprocess=applied_profile)
+    return image
+
+
+def limit_long_side(image, max_long_side=None):
+    """Downscale an uploaded image in place so its longest side fits in max_long_side pixels"""
+    if max_long_side is None:
+        max_long_side = get_max_long_side()
+    if max_long_side and max(image.size) > max_long_side:
+        image.thumbnail((max_long_side, max_long_side), Image.LANCZOS)
+    return image
+
+
+def rerender_page(image, target_dpi=None):
+    """Render the PDF page behind ``image`` again at the retry DPI, without the size cap.
+
+    For a ``TextPage`` this is the fallback to rasterizing. Returns None when
+    the image did not come from a PDF or was already rendered at least that
+    sharply.
+    """
+    source = image.info.get('render_source') if hasattr(image, 'info') else None
+    if source is None:
+        return None
+    target_dpi = target_dpi or get_retry_dpi()
+    if image.info.get('render_dpi', 0) >= target_dpi:
+        return None
+    pdf_path, page_num = source
+    with fitz.open(pdf_path) as pdf_document:
+        sharper = render_page_image(
+            pdf_document.load_page(page_num), target_dpi, image.info.get('preprocess_profile', DEFAULT_PROFILE)
+        )
+    return tag_page_image(sharper, pdf_path, page_num, target_dpi)
+
+
+def encode_page_array(array, payload_config):
+    """Encode a rendered page in the model's payload format, so the bytes can be sent without encoding again"""
+    data, _ = encode_page_payload(Image.fromarray(array), payload_config)
+    return data
+
+
+def decode_page_image(data):
+    """Turn bytes produced by encode_page_array back into a PIL image that still carries them"""
+    image = Image.open(BytesIO(data))
+    image.load()
+    return keep_page_payload(image, data)
+
+
+def text_page(text, words, pdf_path, page_num, profile):
+    """Wrap a page's text layer, remembering how to rasterize it if the text falls short"""
+    page = TextPage(text, pdf_path, page_num, words)
+    page.info['preprocess_profile'] = profile
+    return page
+
+
+def render_page_range(pdf_path, start, stop, target_dpi=DEFAULT_DPI, profile=DEFAULT_PROFILE, max_long_side=None,
+                      use_text_layer=False, payload_config=None):
+    """Render pages ``start`` to ``stop - 1``.
+
+    Returns ``(text, words, payload bytes, dpi, applied profile)`` for each
+    page, where ``text`` is the page's usable text layer (and nothing is
+    rendered) or None.
+    Runs in a render worker process, which opens the PDF itself so only the
+    path and page numbers are sent to it and only compact buffers come back.
+    """
+    rendered = []
+    with fitz.open(pdf_path) as pdf_document:
+        for page_num in range(start, stop):
+            page = pdf_document.load_page(page_num)
+            text = usable_page_text(page) if use_text_layer else None
+            if text is not None:
+                rendered.append((text, page_words(page), None, None, None))
+                continue
+            dpi = effective_dpi(page, target_dpi, max_long_side)
+            array, applied_profile = render_page_array(page, dpi, profile)
+            rendered.append((None, None, encode_page_array(array, payload_config), dpi, applied_profile))
+    return rendered
+
+
+def get_render_workers():
+    """Return the configured number of render worker processes"""
+    return max(1, int(getattr(settings, 'RASTERIZE_WORKERS', DEFAULT_RENDER_WORKERS)))
+
+
+_pool = None
+_pool_key = None
+_pool_lock = threading.Lock()
+
+
+def get_render_pool(workers):
+    """Return the process-wide render pool, creating it on first use.
+
+    Workers are spawned rather than forked, as the web process runs threads
+    (model calls, job workers) that must not be copied into the children.
+    """
+    global _pool, _pool_key
+    key = (os.getpid(), workers)
+    with _pool_lock:
+        if _pool is None or _pool_key != key:
+            if _pool is not None and _pool_key[0] == os.getpid():
+                _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _pool_key = key
+            logger.info(f"Started render pool with {workers} worker(s)")
+        return _pool
+
+
+def shutdown_render_pool():
+    """Stop the render pool, if one was started in this process"""
+    global _pool, _pool_key
+    with _pool_lock:
+        if _pool is not None and _pool_key[0] == os.getpid():
+            _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+        _pool_key = None
+
+
+def get_pdf_page_count(pdf_path):
+    """Return the number of pages in a PDF without rendering any of them"""
+    with fitz.open(pdf_path) as pdf_document:
+        return len(pdf_document)
+
+
+def iter_pdf_pages(pdf_path, target_dpi=None, profile=None, workers=None, chunk_pages=None,
+                   max_pending=None, max_long_side=None, use_text_layer=None):
+    """Yield one page per PDF page, in page order.
+
+    Born-digital pages with a usable text layer come back as a ``TextPage``
+    and are not rasterized at all (unless TEXT_LAYER is disabled or
+    ``use_text_layer`` is False). Every other page is an enhanced PIL image.
+
+    Images are rendered at ``target_dpi`` (RASTERIZE_DPI), scaled down where
+    needed so the longest side fits ``max_long_side`` pixels
+    (RASTERIZE_MAX_LONG_SIDE), preprocessed with ``profile`` (the 'default'
+    entry of PREPROCESS_PROFILES) and tagged with ``tag_page_image``.
+
+    Pages are produced only as the consumer pulls them, so a caller such as
+    ``iter_pages`` holds at most its in-flight pages plus the pool's queue of
+    encoded buffers.
+
+    With more than one worker, ranges of ``chunk_pages`` pages are rendered in
+    the process pool. At most ``max_pending`` ranges (two per worker by
+    default) are queued or held at once, so memory stays flat however long the
+    document is. With one worker, pages are rendered in this process.
+    """
+    if target_dpi is None:
+        target_dpi = get_render_dpi()
+    if profile is None:
+        profile = get_preprocess_profile()
+    if max_long_side is None:
+        max_long_side = get_max_long_side()
+    if workers is None:
+        workers = get_render_workers()
+    if use_text_layer is None:
+        use_text_layer = get_text_layer_config()['ENABLED']
+    with fitz.open(pdf_path) as pdf_document:
+        page_count = len(pdf_document)
+        if workers <= 1 or page_count <= 1:
+            for page_num in range(page_count):
+                page = pdf_document.load_page(page_num)
+                text = usable_page_text(page) if use_text_layer else None
+                if text is not None:
+                    yield text_page(text, page_words(page), pdf_path, page_num, profile)
+                    continue
+                image = render_page_image(page, target_dpi, profile, max_long_side)
+                yield tag_page_image(image, pdf_path, page_num, image.info['render_dpi'])
+            return
+
+    if chunk_pages is None:
+        chunk_pages = getattr(settings, 'RASTERIZE_CHUNK_PAGES', DEFAULT_RENDER_CHUNK_PAGES)
+    # Don't let one worker take the whole document when it is short
+    chunk_pages = max(1, min(int(chunk_pages), -(-page_count // workers)))
+    max_pending = max(1, int(max_pending or workers * 2))
+
+    pool = get_render_pool(workers)
+    # Sent with each range, so workers encode pages exactly as this process would
+    payload_config = get_payload_config()
+    ranges = iter([(start, min(start + chunk_pages, page_count)) for start in range(0, page_count, chunk_pages)])
+    pending = deque()
+
+    def top_up():
+        while len(pending) < max_pending:
+            page_range = next(ranges, None)
+            if page_range is None:
+                return
+            pending.append(pool.submit(
+                render_page_range, pdf_path, *page_range, target_dpi, profile, max_long_side, use_text_layer,
+                payload_config
+            ))
+
+    try:
+        top_up()
+        page_num = 0
+        while pending:
+            rendered = pending.popleft().result()
+            top_up()
+            for text, words, data, dpi, applied_profile in rendered:
+                if text is not None:
+                    yield text_page(text, words, pdf_path, page_num, profile)
+                else:
+                    yield tag_page_image(decode_page_image(data), pdf_path, page_num, dpi, profile, applied_profile)
+                page_num += 1
+    finally:
+        # Stop queued ranges if the consumer gave up early
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,401 @@
+import asyncio
+import heapq
+import inspect
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Lower numbers are served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+
+DEFAULT_SCHEDULER_CONFIG = {
+    # Also the ceiling on throughput: 60 is one call a second, however many are allowed in flight
+    'REQUESTS_PER_MINUTE': 60,
+    'TOKENS_PER_MINUTE': 1000000,
+    'MAX_RETRIES': 5,
+    'BASE_DELAY': 1.0,     # seconds, doubled on every retry
+    'MAX_DELAY': 32.0,
+    # Seconds a document may take before its remaining calls give up; None for no limit
+    'DOCUMENT_TIMEOUT': 600,
+}
+
+# Rough prompt cost used to reserve tokens before the call; the bucket is
+# corrected with the response's usage metadata afterwards
+IMAGE_PART_TOKENS = 258
+CHARS_PER_TOKEN = 4
+# Buckets hold this many seconds of quota, so calls are spread over the
+# minute instead of bursting and tripping the API's own limiter
+BURST_SECONDS = 5
+
+_RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+_RATE_LIMIT_ERRORS = {'ResourceExhausted', 'TooManyRequests'}
+_TRANSIENT_ERRORS = {'ServiceUnavailable', 'InternalServerError', 'DeadlineExceeded', 'GatewayTimeout'}
+
+
+class DeadlineExceeded(TimeoutError):
+    """The call could not be made or retried before its deadline"""
+
+
+def get_scheduler_config():
+    """Return GEMINI_SCHEDULER merged over the defaults"""
+    return {**DEFAULT_SCHEDULER_CONFIG, **getattr(settings, 'GEMINI_SCHEDULER', {})}
+
+
+def get_deadline(timeout=None):
+    """Return the monotonic deadline for a document, using DOCUMENT_TIMEOUT when timeout is None"""
+    if timeout is None:
+        timeout = get_scheduler_config()['DOCUMENT_TIMEOUT']
+    return time.monotonic() + timeout if timeout else None
+
+
+def _status_code(error):
+    code = getattr(error, 'code', None)
+    if callable(code):
+        # grpc errors expose code() as a method returning a StatusCode
+        return None
+    try:
+        return int(code)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_rate_limit_error(error):
+    return _status_code(error) == 429 or type(error).__name__ in _RATE_LIMIT_ERRORS
+
+
+def is_retryable_error(error):
+    if isinstance(error, DeadlineExceeded):
+        return False
+    if isinstance(error, (TimeoutError, ConnectionError)) or is_rate_limit_error(error):
+        return True
+    return _status_code(error) in _RETRYABLE_STATUS or type(error).__name__ in _TRANSIENT_ERRORS
+
+
+def accepts_request_options(func):
+    """True when a model method takes ``request_options``, as the Gemini SDK's generate_content does.
+
+    Wrappers that keep the client they wrap in ``self.model`` (e.g. the usage
+    ledger's) are looked through to the client's own method.
+    """
+    client = getattr(func, '__self__', None)
+    while client is not None and 'model' in getattr(client, '__dict__', {}):
+        client = client.__dict__['model']
+    if client is not None:
+        func = getattr(client, func.__name__, func)
+    try:
+        parameters = inspect.signature(func).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    return any(p.name == 'request_options' or p.kind == p.VAR_KEYWORD for p in parameters)
+
+
+def estimate_tokens(contents):
+    """Estimate the prompt tokens of a generate_content ``contents`` argument"""
+    if isinstance(contents, (list, tuple)):
+        return sum(estimate_tokens(part) for part in contents)
+    if isinstance(contents, dict) or not isinstance(contents, str):
+        return IMAGE_PART_TOKENS
+    return len(contents) // CHARS_PER_TOKEN + 1
+
+
+class TokenBucket:
+    """Refills at ``per_minute`` units a minute up to ``capacity``; not thread-safe on its own"""
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60 if per_minute else None
+        self.capacity = capacity or max(1, (self.rate or 0) * BURST_SECONDS)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if self.rate is not None:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until ``amount`` units are available"""
+        if self.rate is None:
+            return 0.0
+        self._refill(now)
+        # A request larger than the bucket waits for a full bucket rather than forever
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        if self.rate is not None:
+            self.level -= min(amount, self.capacity)
+
+    def adjust(self, amount):
+        """Give back (positive) or charge (negative) units once the real cost is known"""
+        if self.rate is not None:
+            self.level = min(self.capacity, self.level + amount)
+
+
+class CallScheduler:
+    """Shared gate for model calls: rate limits, priority order, retries and deadlines.
+
+    Callers wait in one priority queue and only the head of the queue may
+    take from the requests-per-minute and tokens-per-minute buckets, so bulk
+    work never overtakes an interactive upload. Retryable failures back off
+    exponentially with jitter; a 429 pauses every caller, since the quota is
+    shared. No call is started or retried past its deadline.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, max_retries=5,
+                 base_delay=1.0, max_delay=32.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._condition = threading.Condition()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        self._stats = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._condition:
+            self._stats = {
+                'calls': 0,               # calls that went through the scheduler
+                'attempts': 0,            # requests actually sent, including retries
+                'retries': 0,
+                'rate_limited': 0,        # 429 responses
+                'transient_errors': 0,    # other retryable failures
+                'deadline_exceeded': 0,
+                'failed': 0,              # calls that gave up with an error
+                'queue_wait_s': 0.0,      # time spent waiting for a turn
+            }
+
+    def get_stats(self):
+        with self._condition:
+            stats = dict(self._stats)
+        stats['queue_wait_s'] = round(stats['queue_wait_s'], 3)
+        return stats
+
+    def _count(self, **increments):
+        with self._condition:
+            for key, value in increments.items():
+                self._stats[key] += value
+
+    def _poll(self, ticket, tokens):
+        """Take a turn for ``ticket`` if possible. Call with the lock held.
+
+        Returns 0 when the turn was taken, the seconds to wait when the ticket
+        is at the head of the queue, or None while others are ahead of it.
+        """
+        if self._queue[0] != ticket:
+            return None
+        now = time.monotonic()
+        wait = max(self._paused_until - now, self._requests.wait_time(1, now),
+                   self._tokens.wait_time(tokens, now))
+        if wait > 0:
+            return wait
+        self._requests.take(1)
+        self._tokens.take(tokens)
+        heapq.heappop(self._queue)
+        self._condition.notify_all()
+        return 0
+
+    def _leave(self, ticket):
+        """Drop a ticket that gave up waiting. Call with the lock held."""
+        if ticket in self._queue:
+            self._queue.remove(ticket)
+            heapq.heapify(self._queue)
+            self._condition.notify_all()
+
+    def _check_deadline(self, deadline, wait=0.0):
+        if deadline is not None and time.monotonic() + (wait or 0.0) > deadline:
+            self._count(failed=1, deadline_exceeded=1)
+            raise DeadlineExceeded("Model call deadline exceeded while waiting for quota")
+
+    def acquire(self, priority=PRIORITY_INTERACTIVE, tokens=1, deadline=None):
+        """Block until this caller may send a request"""
+        start = time.monotonic()
+        with self._condition:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._queue, ticket)
+            try:
+                while True:
+                    wait = self._poll(ticket, tokens)
+                    if wait == 0:
+                        break
+                    self._check_deadline(deadline, wait)
+                    if wait is None and deadline is not None:
+                        wait = deadline - time.monotonic()
+                    self._condition.wait(timeout=wait)
+            except BaseException:
+                self._leave(ticket)
+                raise
+            self._stats['queue_wait_s'] += time.monotonic() - start
+
+    async def acquire_async(self, priority=PRIORITY_INTERACTIVE, tokens=1, deadline=None):
+        """Async variant of acquire; polls instead of blocking the event loop"""
+        start = time.monotonic()
+        with self._condition:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._queue, ticket)
+        try:
+            while True:
+                with self._condition:
+                    wait = self._poll(ticket, tokens)
+                if wait == 0:
+                    break
+                self._check_deadline(deadline, wait)
+                await asyncio.sleep(min(wait or 0.01, 1.0))
+        except BaseException:
+            with self._condition:
+                self._leave(ticket)
+            raise
+        self._count(queue_wait_s=time.monotonic() - start)
+
+    def _backoff(self, attempt):
+        """Exponential backoff with jitter: between half and all of base * 2**attempt"""
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _after_failure(self, error, attempt, deadline):
+        """Decide whether to retry a failed attempt; returns the delay or raises"""
+        if not is_retryable_error(error) or attempt >= self.max_retries:
+            self._count(failed=1)
+            raise error
+        delay = self._backoff(attempt)
+        if deadline is not None and time.monotonic() + delay > deadline:
+            self._count(failed=1, deadline_exceeded=1)
+            raise DeadlineExceeded(f"Model call deadline exceeded after {attempt + 1} attempt(s)") from error
+        if is_rate_limit_error(error):
+            self._count(retries=1, rate_limited=1)
+            with self._condition:
+                # The quota is shared, so everyone waits, not just this caller
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            logger.warning(f"Model rate limited, pausing calls for {delay:.1f}s")
+            return 0.0
+        self._count(retries=1, transient_errors=1)
+        logger.warning(f"Transient model error ({type(error).__name__}: {str(error)}), retrying in {delay:.1f}s")
+        return delay
+
+    def _settle(self, estimate, response):
+        """Correct the token bucket with the tokens the call really used"""
+        usage = getattr(response, 'usage_metadata', None)
+        actual = getattr(usage, 'total_token_count', 0) or 0
+        if actual:
+            with self._condition:
+                self._tokens.adjust(estimate - actual)
+
+    @staticmethod
+    def _with_timeout(func, kwargs, deadline):
+        """Pass the time left before the deadline on to the request itself, if the client takes it"""
+        if deadline is None or not accepts_request_options(func):
+            return kwargs
+        remaining = max(1.0, deadline - time.monotonic())
+        return {**kwargs, 'request_options': {**kwargs.get('request_options', {}), 'timeout': remaining}}
+
+    def call(self, func, contents, kwargs=None, priority=PRIORITY_INTERACTIVE, deadline=None):
+        """Run ``func(contents, **kwargs)`` under the rate limits, retrying transient failures"""
+        kwargs = kwargs or {}
+        estimate = estimate_tokens(contents)
+        self._count(calls=1)
+        attempt = 0
+        while True:
+            self.acquire(priority, estimate, deadline)
+            self._count(attempts=1)
+            try:
+                response = func(contents, **self._with_timeout(func, kwargs, deadline))
+            except Exception as e:
+                delay = self._after_failure(e, attempt, deadline)
+                attempt += 1
+                if delay:
+                    time.sleep(delay)
+                continue
+            self._settle(estimate, response)
+            return response
+
+    async def call_async(self, func, contents, kwargs=None, priority=PRIORITY_INTERACTIVE, deadline=None):
+        """Async variant of call; ``func`` returns an awaitable"""
+        kwargs = kwargs or {}
+        estimate = estimate_tokens(contents)
+        self._count(calls=1)
+        attempt = 0
+        while True:
+            await self.acquire_async(priority, estimate, deadline)
+            self._count(attempts=1)
+            try:
+                response = await func(contents, **self._with_timeout(func, kwargs, deadline))
+            except Exception as e:
+                delay = self._after_failure(e, attempt, deadline)
+                attempt += 1
+                if delay:
+                    await asyncio.sleep(delay)
+                continue
+            self._settle(estimate, response)
+            return response
+
+
+class ScheduledModel:
+    """Wrap a model client so its generate_content calls go through a CallScheduler.
+
+    One wrapper is made per document (or request), carrying that work's
+    priority and deadline to every call made with it, translation included.
+    """
+
+    def __init__(self, model, scheduler=None, priority=PRIORITY_INTERACTIVE, deadline=None):
+        self.model = model
+        self.scheduler = scheduler or get_scheduler()
+        self.priority = priority
+        self.deadline = deadline
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def generate_content(self, contents, **kwargs):
+        return self.scheduler.call(self.model.generate_content, contents, kwargs, self.priority, self.deadline)
+
+    async def generate_content_async(self, contents, **kwargs):
+        return await self.scheduler.call_async(
+            self.model.generate_content_async, contents, kwargs, self.priority, self.deadline
+        )
+
+
+def scheduled(model, priority=PRIORITY_INTERACTIVE, deadline=None):
+    """Return ``model`` wrapped in a ScheduledModel, unless it already is one"""
+    if isinstance(model, ScheduledModel):
+        return model
+    return ScheduledModel(model, get_scheduler(), priority, deadline)
+
+
+_lock = threading.Lock()
+_schedulers = {}
+
+
+def get_scheduler():
+    """Return the process-wide scheduler, built from GEMINI_SCHEDULER"""
+    pid = os.getpid()
+    with _lock:
+        scheduler = _schedulers.get(pid)
+        if scheduler is None:
+            config = get_scheduler_config()
+            scheduler = CallScheduler(
+                requests_per_minute=config['REQUESTS_PER_MINUTE'],
+                tokens_per_minute=config['TOKENS_PER_MINUTE'],
+                max_retries=config['MAX_RETRIES'],
+                base_delay=config['BASE_DELAY'],
+                max_delay=config['MAX_DELAY'],
+            )
+            _schedulers.clear()
+            _schedulers[pid] = scheduler
+        return scheduler
+
+
+def reset_scheduler():
+    """Drop the process-wide scheduler so the next call rebuilds it from settings"""
+    with _lock:
+        _schedulers.clear()
@@ -0,0 +1,243 @@
+import json
+import logging
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# EXTRACTION_STRUCTURED_OUTPUT modes: 'schema' sends a response schema with
+# JSON mode, 'json' only asks for a JSON response, 'off' relies on the prompt
+STRUCTURED_OUTPUT_MODES = ('schema', 'json', 'off')
+DEFAULT_STRUCTURED_OUTPUT = 'schema'
+
+JSON_MIME_TYPE = 'application/json'
+
+# EXTRACTION_TRANSLATION_MODE: 'separate' extracts original-language values and
+# translates them with text calls afterwards; 'inline' asks the vision call to
+# translate the text fields of the default loan and property prompts itself
+TRANSLATION_MODES = ('separate', 'inline')
+DEFAULT_TRANSLATION_MODE = 'separate'
+
+# Free-text fields returned as {original, language, translated} in inline mode;
+# dates, amounts and ID numbers stay plain strings and are resolved locally
+INLINE_TRANSLATION_FIELDS = {
+    'loan': ['borrower_name', 'sex', 'father_name', 'spouse_name', 'witness_details', 'emi_history',
+             'credibility_summary', 'bank_name'],
+    'property': ['property_owner', 'property_area', 'property_size', 'property_location', 'risk_summary',
+                 'bank_name'],
+}
+
+
+def _string_fields(*names):
+    return {name: {'type': 'STRING'} for name in names}
+
+
+def _object_schema(properties):
+    return {'type': 'OBJECT', 'properties': properties, 'required': list(properties)}
+
+
+_STRING_LIST = {'type': 'ARRAY', 'items': {'type': 'STRING'}}
+
+LOAN_RESPONSE_SCHEMA = _object_schema({
+    **_string_fields(
+        'borrower_name', 'date_of_birth', 'sex', 'father_name', 'spouse_name', 'aadhar_number',
+        'pan_number', 'passport_number', 'driving_license', 'loan_amount', 'loan_sanction_date',
+        'loan_balance',
+    ),
+    'witness_details': _STRING_LIST,
+    'emi_history': _STRING_LIST,
+    **_string_fields('credibility_summary', 'bank_name'),
+})
+
+PROPERTY_RESPONSE_SCHEMA = _object_schema(_string_fields(
+    'property_owner', 'property_area', 'property_size', 'property_location', 'property_coordinates',
+    'property_value', 'loan_limit', 'risk_summary', 'bank_name', 'application_date',
+))
+
+# Row keys are the table's own column names, so rows cannot be declared
+# field by field; such open objects are sent in plain JSON mode
+TABLE_RESPONSE_SCHEMA = _object_schema({
+    'columns': _STRING_LIST,
+    'rows': {'type': 'ARRAY', 'items': {'type': 'OBJECT'}},
+})
+
+RESPONSE_SCHEMAS = {
+    'loan': LOAN_RESPONSE_SCHEMA,
+    'property': PROPERTY_RESPONSE_SCHEMA,
+    'table': TABLE_RESPONSE_SCHEMA,
+}
+
+TRANSLATED_VALUE_SCHEMA = _object_schema(_string_fields('original', 'language', 'translated'))
+
+
+def get_structured_output_mode():
+    mode = getattr(settings, 'EXTRACTION_STRUCTURED_OUTPUT', DEFAULT_STRUCTURED_OUTPUT)
+    if mode not in STRUCTURED_OUTPUT_MODES:
+        logger.warning(f"Unknown EXTRACTION_STRUCTURED_OUTPUT {mode!r}, using {DEFAULT_STRUCTURED_OUTPUT!r}")
+        return DEFAULT_STRUCTURED_OUTPUT
+    return mode
+
+
+def get_translation_mode():
+    mode = getattr(settings, 'EXTRACTION_TRANSLATION_MODE', DEFAULT_TRANSLATION_MODE)
+    if mode not in TRANSLATION_MODES:
+        logger.warning(f"Unknown EXTRACTION_TRANSLATION_MODE {mode!r}, using {DEFAULT_TRANSLATION_MODE!r}")
+        return DEFAULT_TRANSLATION_MODE
+    return mode
+
+
+def uses_inline_translation(document_type, custom_prompt=None, mode=None):
+    """True when a page is extracted and translated in one call.
+
+    Only the default loan and property prompts have an inline form; custom
+    prompts and tables always use the separate translation calls.
+    """
+    mode = mode or get_translation_mode()
+    return mode == 'inline' and not custom_prompt and document_type in INLINE_TRANSLATION_FIELDS
+
+
+def inline_translation_schema(document_type):
+    """Response schema of the default prompt with its free-text fields as translated values"""
+    schema = RESPONSE_SCHEMAS[document_type]
+    properties = dict(schema['properties'])
+    for field in INLINE_TRANSLATION_FIELDS[document_type]:
+        if properties[field]['type'] == 'ARRAY':
+            properties[field] = {'type': 'ARRAY', 'items': TRANSLATED_VALUE_SCHEMA}
+        else:
+            properties[field] = TRANSLATED_VALUE_SCHEMA
+    return _object_schema(properties)
+
+
+def declared_fields(custom_prompt):
+    """Return the JSON object template a custom prompt declares, or None.
+
+    A prompt declares its fields the way the default prompts do, with an
+    example object such as ``{"owner": "", "survey_numbers": []}``.
+    """
+    if not custom_prompt:
+        return None
+    start = custom_prompt.find('{')
+    end = custom_prompt.rfind('}')
+    if start < 0 or end <= start:
+        return None
+    try:
+        template = json.loads(custom_prompt[start:end + 1])
+    except ValueError:
+        return None
+    return template if isinstance(template, dict) and template else None
+
+
+def schema_from_template(template):
+    """Build a response schema from an example value such as a prompt's field template"""
+    if isinstance(template, dict):
+        return _object_schema({str(key): schema_from_template(value) for key, value in template.items()})
+    if isinstance(template, list):
+        return {'type': 'ARRAY', 'items': schema_from_template(template[0] if template else '')}
+    if isinstance(template, bool):
+        return {'type': 'BOOLEAN'}
+    if isinstance(template, (int, float)):
+        return {'type': 'NUMBER'}
+    return {'type': 'STRING'}
+
+
+def get_response_schema(document_type, custom_prompt=None):
+    """Return the declared response schema for a document type and prompt, or None.
+
+    A custom prompt replaces the default fields, so it only has a schema when
+    it declares its own field template.
+    """
+    if custom_prompt:
+        template = declared_fields(custom_prompt)
+        return schema_from_template(template) if template else None
+    # Unknown document types are extracted as loan documents
+    return RESPONSE_SCHEMAS.get(document_type, LOAN_RESPONSE_SCHEMA)
+
+
+def _is_closed(schema):
+    """True when every object in the schema lists its properties, as the API requires"""
+    if schema.get('type') == 'OBJECT':
+        properties = schema.get('properties')
+        return bool(properties) and all(_is_closed(value) for value in properties.values())
+    if schema.get('type') == 'ARRAY':
+        return _is_closed(schema.get('items', {}))
+    return True
+
+
+_supported_fields = None
+
+
+def _supported_generation_fields():
+    """Names the installed SDK accepts in a generation config"""
+    global _supported_fields
+    if _supported_fields is None:
+        try:
+            from google.generativeai.types import GenerationConfig
+            _supported_fields = frozenset(getattr(GenerationConfig, '__dataclass_fields__', ()))
+        except ImportError:
+            _supported_fields = frozenset()
+    return _supported_fields
+
+
+def extraction_generation_config(document_type, custom_prompt=None, inline_translation=False):
+    """Return the per-request generation config for an extraction call, or None.
+
+    Uses JSON mode with the declared response schema when the installed SDK
+    supports it, JSON mode alone for open schemas (tables) or older SDKs, and
+    nothing when EXTRACTION_STRUCTURED_OUTPUT is 'off'. ``inline_translation``
+    selects the schema with translated values (see uses_inline_translation).
+    """
+    mode = get_structured_output_mode()
+    supported = _supported_generation_fields()
+    if mode == 'off' or 'response_mime_type' not in supported:
+        return None
+    config = {'response_mime_type': JSON_MIME_TYPE}
+    if mode == 'schema' and 'response_schema' in supported:
+        if inline_translation:
+            schema = inline_translation_schema(document_type)
+        else:
+            schema = get_response_schema(document_type, custom_prompt)
+        if schema is not None and _is_closed(schema):
+            config['response_schema'] = schema
+    return config
+
+
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def reset_structured_output_stats():
+    """Reset the process-wide structured output counters"""
+    with _stats_lock:
+        _stats.clear()
+        _stats.update({
+            'requests': 0,          # extraction calls issued
+            'schema_requests': 0,   # ... with a response schema
+            'json_requests': 0,     # ... in JSON mode without a schema
+            'retries': 0,           # pages sent a second time because they came back mostly empty
+            'empty_fallbacks': 0,   # responses with no JSON object, replaced by an empty record
+        })
+
+
+def record_structured_output(**increments):
+    with _stats_lock:
+        for key, value in increments.items():
+            _stats[key] = _stats.get(key, 0) + value
+
+
+def record_extraction_request(generation_config):
+    if not generation_config:
+        record_structured_output(requests=1)
+    elif 'response_schema' in generation_config:
+        record_structured_output(requests=1, schema_requests=1)
+    else:
+        record_structured_output(requests=1, json_requests=1)
+
+
+def get_structured_output_stats():
+    """Return a snapshot of the structured output counters"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+reset_structured_output_stats()
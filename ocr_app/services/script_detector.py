@@ -0,0 +1,64 @@
+import unicodedata
+
+# Unicode blocks of the Indian scripts we see in uploaded documents, with the
+# language code reported for each. Devanagari is shared by Hindi, Marathi and
+# others; we report Hindi as that is by far the most common in our documents.
+INDIC_SCRIPTS = [
+    ('devanagari', 0x0900, 0x097F, 'hi'),
+    ('bengali', 0x0980, 0x09FF, 'bn'),
+    ('gurmukhi', 0x0A00, 0x0A7F, 'pa'),
+    ('gujarati', 0x0A80, 0x0AFF, 'gu'),
+    ('odia', 0x0B00, 0x0B7F, 'or'),
+    ('tamil', 0x0B80, 0x0BFF, 'ta'),
+    ('telugu', 0x0C00, 0x0C7F, 'te'),
+    ('kannada', 0x0C80, 0x0CFF, 'kn'),
+    ('malayalam', 0x0D00, 0x0D7F, 'ml'),
+    ('devanagari', 0xA8E0, 0xA8FF, 'hi'),  # Devanagari Extended
+]
+
+SCRIPT_LANGUAGES = {name: language for name, _, _, language in INDIC_SCRIPTS}
+
+LATIN = 'latin'
+OTHER = 'other'
+
+
+def _char_script(char):
+    """Return the script name of a single letter, or None for non-letters"""
+    code_point = ord(char)
+    for name, start, end, _ in INDIC_SCRIPTS:
+        if start <= code_point <= end:
+            return name
+    if not unicodedata.category(char).startswith('L'):
+        # Digits, punctuation, currency symbols and whitespace carry no script
+        return None
+    if code_point < 0x0250 or 0x1E00 <= code_point <= 0x1EFF:
+        return LATIN
+    return OTHER
+
+
+def classify_script(text):
+    """Classify the dominant script of text.
+
+    Returns ``'latin'`` for Latin-script or purely numeric/punctuation text,
+    the name of an Indian script (e.g. ``'tamil'``) when any Indian-script
+    letters are present, or ``'other'`` for anything else.
+    """
+    counts = {}
+    for char in text:
+        script = _char_script(char)
+        if script:
+            counts[script] = counts.get(script, 0) + 1
+
+    indic_counts = {name: count for name, count in counts.items() if name in SCRIPT_LANGUAGES}
+    if indic_counts:
+        return max(indic_counts, key=indic_counts.get)
+    if counts.get(OTHER):
+        return OTHER
+    return LATIN
+
+
+def language_for_script(script):
+    """Return the language code for a script, 'en' for Latin and None if unknown"""
+    if script == LATIN:
+        return 'en'
+    return SCRIPT_LANGUAGES.get(script)
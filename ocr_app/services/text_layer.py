@@ -0,0 +1,75 @@
+import logging
+import unicodedata
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TEXT_LAYER_CONFIG = {
+    'ENABLED': True,
+    # Fewer non-whitespace characters than this and the page is treated as a scan
+    'MIN_CHARS': 200,
+    # Share of characters that must be real text rather than replacement,
+    # private-use or control characters (broken font encodings produce those)
+    'MIN_VALID_RATIO': 0.9,
+}
+
+
+def get_text_layer_config():
+    """Return TEXT_LAYER merged over the defaults"""
+    return {**DEFAULT_TEXT_LAYER_CONFIG, **getattr(settings, 'TEXT_LAYER', {})}
+
+
+class TextPage:
+    """A PDF page sent to the model as its text layer instead of a rendered image.
+
+    ``words`` holds the page's ``(x0, y0, x1, y1, text)`` word boxes, used to
+    rebuild tables locally. ``info`` mirrors ``PIL.Image.info`` so the pipeline
+    can record and report per-page details for text and image pages alike.
+    """
+
+    def __init__(self, text, pdf_path=None, page_num=None, words=None):
+        self.text = text
+        self.words = words or []
+        self.info = {'path': 'text'}
+        if pdf_path is not None:
+            self.info['render_source'] = (pdf_path, page_num)
+
+    def copy(self):
+        """Return a copy with its own ``info``, like ``PIL.Image.copy``"""
+        page = TextPage(self.text, words=self.words)
+        page.info = dict(self.info)
+        return page
+
+    def __repr__(self):
+        return f"<TextPage {len(self.text)} chars>"
+
+
+def _is_valid_char(char):
+    if char == '�':
+        return False
+    category = unicodedata.category(char)
+    # Co: private use (unmapped glyphs), Cc/Cs/Cn: control, surrogate, unassigned
+    return category not in ('Co', 'Cc', 'Cs', 'Cn')
+
+
+def usable_page_text(page, config=None):
+    """Return the page's text layer if it looks complete enough to extract from, else None"""
+    config = config or get_text_layer_config()
+    try:
+        text = page.get_text()
+    except Exception as e:
+        logger.warning(f"Could not read text layer: {str(e)}")
+        return None
+    chars = [char for char in text if not char.isspace()]
+    if len(chars) < config['MIN_CHARS']:
+        return None
+    valid = sum(1 for char in chars if _is_valid_char(char))
+    if valid / len(chars) < config['MIN_VALID_RATIO']:
+        return None
+    return text
+
+
+def page_words(page):
+    """Return the page's word boxes as ``(x0, y0, x1, y1, text)`` tuples"""
+    return [tuple(word[:5]) for word in page.get_text('words')]
@@ -0,0 +1,479 @@
+import asyncio
+import json
+import logging
+import threading
+
+from .json_repair import parse_model_json
+from .model_registry import get_model
+from .scheduler import scheduled
+from .script_detector import classify_script, language_for_script
+from .translation_memory import get_translation_memory
+from .usage import usage_scope
+
+logger = logging.getLogger(__name__)
+
+# Fields of the default loan prompt that hold arrays of free-text items
+LIST_FIELDS = ["witness_details", "emi_history"]
+
+
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def reset_translation_stats():
+    """Reset the process-wide translation counters"""
+    with _stats_lock:
+        _stats.clear()
+        _stats.update({
+            'values_seen': 0,            # non-empty values that reached translation
+            'latin_short_circuits': 0,   # values resolved as 'en' by the local script detector
+            'script_detections': 0,      # values whose language came from their script
+            'model_calls': 0,            # generate_content calls issued for translation
+            'model_calls_avoided': 0,    # calls skipped thanks to the local script detector
+            'memory_hits': 0,            # values answered by the translation memory
+            'inline_accepted': 0,        # values translated by the extraction call itself
+            'inline_fallbacks': 0,       # values it left untranslated, sent to translation calls
+        })
+
+
+def _record(**increments):
+    with _stats_lock:
+        for key, value in increments.items():
+            _stats[key] = _stats.get(key, 0) + value
+
+
+def get_translation_stats():
+    """Return a snapshot of the process-wide translation counters"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+reset_translation_stats()
+
+
+def _empty_translation():
+    return {"original": "", "language": "", "translated": ""}
+
+
+def _local_result(text):
+    """Resolve Latin-script or numeric text locally, without a model call"""
+    return {"original": text, "language": "en", "translated": text}
+
+
+def _resolve_locally(text):
+    """Resolve what we can without the model.
+
+    Returns ``(result, language)``: a finished result for Latin/numeric text,
+    otherwise ``None`` and the script's language code (``None`` if unknown).
+    """
+    _record(values_seen=1)
+    language = language_for_script(classify_script(text))
+    if language == 'en':
+        # Latin or numeric text - no need to ask the model anything
+        _record(latin_short_circuits=1)
+        return _local_result(text), language
+    if language:
+        _record(script_detections=1)
+    return None, language
+
+
+def _detection_prompt(text):
+    return f"""Analyze the following text and determine text language (ex. when you see Rajendra Goswami it is not Hindi, it is written in English). If it's in an Indian language, specify which one. Return ONLY the language code (e.g., 'hi' for Hindi, 'ta' for Tamil, etc.) or 'en' for English. Text to analyze:
+
+{text}"""
+
+
+def _translation_prompt(text, language):
+    return f"""Translate the following text from {language} to English. Provide ONLY the English translation, no additional text or explanations:
+
+{text}"""
+
+
+def _apply_translation(result, translated_text):
+    translated_text = translated_text.strip()
+    if translated_text:  # Only update if we got a translation
+        result["translated"] = translated_text
+    logger.debug(f"Translation result for '{result['original']}': {result}")
+    return result
+
+
+def detect_and_translate(text, model=None):
+    """Detect language and translate text to English using Gemini"""
+    try:
+        if not text or text.strip() == "":
+            return _empty_translation()
+
+        local_result, language = _resolve_locally(text)
+        if local_result:
+            _record(model_calls_avoided=1)
+            return local_result
+        if model is None:
+            model = scheduled(get_model())
+        if language:
+            # The script tells us the language, so only the translation call is needed
+            _record(model_calls_avoided=1)
+        else:
+            _record(model_calls=1)
+            language = model.generate_content(_detection_prompt(text)).text.strip().lower()
+
+        result = {
+            "original": text,
+            "language": language,
+            "translated": text  # Default to original if English
+        }
+
+        # Translate if not English and language was detected
+        if language and language != 'en':
+            _record(model_calls=1)
+            translation = model.generate_content(_translation_prompt(text, language))
+            _apply_translation(result, translation.text)
+
+        return result
+    except Exception as e:
+        logger.error(f"Translation error: {str(e)}")
+        return {"original": text, "language": "unknown", "translated": text}
+
+
+async def _generate_async(model, contents, semaphore=None, generation_config=None):
+    """Call the model's async API, holding the semaphore only for the call itself"""
+    kwargs = {'generation_config': generation_config} if generation_config else {}
+    if semaphore is None:
+        return await model.generate_content_async(contents, **kwargs)
+    async with semaphore:
+        return await model.generate_content_async(contents, **kwargs)
+
+
+async def detect_and_translate_async(text, model=None, semaphore=None):
+    """Async variant of detect_and_translate using the model's async API"""
+    try:
+        if not text or text.strip() == "":
+            return _empty_translation()
+
+        local_result, language = _resolve_locally(text)
+        if local_result:
+            _record(model_calls_avoided=1)
+            return local_result
+        if model is None:
+            model = scheduled(get_model())
+        if language:
+            _record(model_calls_avoided=1)
+        else:
+            _record(model_calls=1)
+            response = await _generate_async(model, _detection_prompt(text), semaphore)
+            language = response.text.strip().lower()
+
+        result = {"original": text, "language": language, "translated": text}
+        if language and language != 'en':
+            _record(model_calls=1)
+            translation = await _generate_async(model, _translation_prompt(text, language), semaphore)
+            _apply_translation(result, translation.text)
+        return result
+    except Exception as e:
+        logger.error(f"Translation error: {str(e)}")
+        return {"original": text, "language": "unknown", "translated": text}
+
+
+def _build_batch_prompt(values):
+    """Build a single prompt asking for language and translation of every value"""
+    payload = json.dumps(values, ensure_ascii=False, indent=2)
+    return f"""For every entry of the JSON object below, determine the language of the text (ex. when you see Rajendra Goswami it is not Hindi, it is written in English) and translate it to English. If it's in an Indian language, specify which one.
+
+Return ONLY a JSON object with exactly the same keys, where each value is an object of the form {{"language": "<code>", "translated": "<English text>"}}. Use language codes such as 'hi' for Hindi, 'ta' for Tamil, etc. or 'en' for English. For English text, repeat the text unchanged as the translation. Use DOUBLE QUOTES for both property names and string values.
+
+{payload}"""
+
+
+def _parse_batch_response(response_text):
+    """Parse the JSON object returned for a batched translation request"""
+    parsed = parse_model_json(response_text)
+    if parsed.repairs:
+        logger.info(f"Repaired batched translation JSON: {', '.join(parsed.repairs)}")
+    return parsed.value if isinstance(parsed.value, dict) else {}
+
+
+def _batch_entry_to_result(text, entry):
+    """Turn one entry of the batched response into an original/language/translated dict"""
+    if not isinstance(entry, dict):
+        return None
+    language = str(entry.get("language") or "").strip().lower()
+    if not language:
+        return None
+    translated = entry.get("translated")
+    if language == 'en' or not isinstance(translated, str) or not translated.strip():
+        translated = text
+    return {"original": text, "language": language, "translated": translated.strip()}
+
+
+def _prepare_batch(values):
+    """Split values into locally resolved results and those that need the model"""
+    results = {}
+    pending = {}
+    script_languages = {}
+    for key, text in values.items():
+        if not text or text.strip() == "":
+            results[key] = _empty_translation()
+            continue
+        local_result, language = _resolve_locally(text)
+        if local_result:
+            # Latin or numeric text never needs to reach the model
+            results[key] = local_result
+            continue
+        if language:
+            script_languages[key] = language
+        pending[key] = text
+    return results, pending, script_languages
+
+
+def _apply_memory(results, pending, script_languages, remembered):
+    """Move pending values the translation memory already knows into results"""
+    found = [key for key, text in pending.items() if text in remembered]
+    for key in found:
+        result = dict(remembered[pending.pop(key)])
+        if key in script_languages:
+            result["language"] = script_languages[key]
+        results[key] = result
+    if found:
+        _record(memory_hits=len(found))
+
+
+def _field_name(key):
+    """Return the extracted field a batch key belongs to (``emi_history[2]`` -> ``emi_history``)"""
+    return key.split('[', 1)[0]
+
+
+def _batch_scope(pending):
+    """Usage scope for a batched call, split between fields by the size of their text"""
+    field_bytes = {}
+    for key, text in pending.items():
+        field = _field_name(key)
+        field_bytes[field] = field_bytes.get(field, 0) + len(text.encode('utf-8'))
+    return usage_scope(kind='translation', field_bytes=field_bytes)
+
+
+def _merge_batch(results, pending, script_languages, batched):
+    """Add batched entries to results and return the keys that still need a per-field call"""
+    missing = []
+    for key, text in pending.items():
+        result = _batch_entry_to_result(text, batched.get(key))
+        if result is None:
+            missing.append(key)
+            continue
+        if key in script_languages:
+            # Trust the script over the model for the language code
+            result["language"] = script_languages[key]
+        results[key] = result
+    if missing:
+        logger.warning(f"Batched translation missing {len(missing)} of {len(pending)} fields, falling back per field")
+    return missing
+
+
+def batch_detect_and_translate(values, model=None):
+    """Detect language and translate many text values with a single Gemini call
+
+    ``values`` maps arbitrary keys (field names, ``field[index]`` for list
+    items, or keys spanning a whole document) to text. Returns a dict with the
+    same keys, each mapped to ``{original, language, translated}``. Latin-script
+    and numeric values are resolved locally and never sent, values translated
+    before are taken from the translation memory, and only the remaining
+    values go to the model. Keys that are missing or malformed in the batched
+    response fall back to ``detect_and_translate``.
+    """
+    results, pending, script_languages = _prepare_batch(values)
+    memory = get_translation_memory()
+    if memory and pending:
+        _apply_memory(results, pending, script_languages, memory.lookup_many(pending.values()))
+    if not pending:
+        if results:
+            _record(model_calls_avoided=1)
+        return results
+
+    if model is None:
+        model = scheduled(get_model())
+    batched = {}
+    try:
+        _record(model_calls=1)
+        with _batch_scope(pending):
+            response = model.generate_content(_build_batch_prompt(pending))
+        batched = _parse_batch_response(response.text)
+    except Exception as e:
+        logger.error(f"Batched translation error: {str(e)}")
+
+    for key in _merge_batch(results, pending, script_languages, batched):
+        with usage_scope(kind='translation', field=_field_name(key)):
+            results[key] = detect_and_translate(pending[key], model)
+    if memory:
+        memory.store_many(results[key] for key in pending)
+    return results
+
+
+async def batch_detect_and_translate_async(values, model=None, semaphore=None):
+    """Async variant of batch_detect_and_translate; fallbacks run concurrently"""
+    results, pending, script_languages = _prepare_batch(values)
+    memory = get_translation_memory()
+    if memory and pending:
+        _apply_memory(results, pending, script_languages, await memory.lookup_many_async(pending.values()))
+    if not pending:
+        if results:
+            _record(model_calls_avoided=1)
+        return results
+
+    if model is None:
+        model = scheduled(get_model())
+    batched = {}
+    try:
+        _record(model_calls=1)
+        with _batch_scope(pending):
+            response = await _generate_async(model, _build_batch_prompt(pending), semaphore)
+        batched = _parse_batch_response(response.text)
+    except Exception as e:
+        logger.error(f"Batched translation error: {str(e)}")
+
+    async def fallback(key):
+        with usage_scope(kind='translation', field=_field_name(key)):
+            return await detect_and_translate_async(pending[key], model, semaphore)
+
+    missing = _merge_batch(results, pending, script_languages, batched)
+    fallbacks = await asyncio.gather(*[fallback(key) for key in missing])
+    results.update(zip(missing, fallbacks))
+    if memory:
+        await memory.store_many_async([results[key] for key in pending])
+    return results
+
+
+def _inline_original(value):
+    if isinstance(value, dict):
+        original = value.get("original")
+        return original if isinstance(original, str) else ""
+    return value
+
+
+def split_inline_translations(extracted_data):
+    """Split a page extracted with inline translation into original values and the model's translations
+
+    Returns ``(extracted_data, candidates)``: the page with every
+    ``{original, language, translated}`` object replaced by its original
+    text, as the separate mode would have extracted it, and those objects
+    keyed the way collect_translatable_values keys values.
+    """
+    plain = {}
+    candidates = {}
+    for field, value in extracted_data.items():
+        if isinstance(value, list):
+            plain[field] = []
+            for item in value:
+                original = _inline_original(item)
+                if isinstance(item, dict) and not original.strip():
+                    continue
+                if isinstance(item, dict):
+                    candidates[f"{field}[{len(plain[field])}]"] = item
+                plain[field].append(original)
+        else:
+            plain[field] = _inline_original(value)
+            if isinstance(value, dict):
+                candidates[field] = value
+    return plain, candidates
+
+
+def _inline_result(text, script_language, candidate):
+    """Turn a translation returned by the extraction call into a result, or None if it cannot be used"""
+    if not isinstance(candidate, dict):
+        return None
+    language = str(candidate.get("language") or "").strip().lower()
+    translated = candidate.get("translated")
+    if not language or language == 'unknown' or not isinstance(translated, str) or not translated.strip():
+        return None
+    # Trust the script over the model for the language code, as the batch does
+    language = script_language or language
+    if language != 'en' and ' '.join(translated.split()) == ' '.join(text.split()):
+        # Echoed back untranslated
+        return None
+    return {"original": text, "language": language, "translated": translated.strip()}
+
+
+def accept_inline_translations(values, candidates):
+    """Take the translations an inline extraction call returned where they can be used
+
+    Returns ``(accepted, remaining)``. Empty, Latin and numeric values are
+    left in ``remaining`` to be resolved locally as usual, as are values
+    whose translation is missing, malformed or an unchanged non-English
+    echo; only those last ones cost translation calls.
+    """
+    accepted = {}
+    remaining = {}
+    fallbacks = 0
+    for key, text in values.items():
+        script_language = language_for_script(classify_script(text)) if text and text.strip() else 'en'
+        result = None if script_language == 'en' else _inline_result(text, script_language, candidates.get(key))
+        if result is not None:
+            accepted[key] = result
+            continue
+        remaining[key] = text
+        if script_language != 'en':
+            fallbacks += 1
+    _record(inline_accepted=len(accepted), inline_fallbacks=fallbacks)
+    return accepted, remaining
+
+
+def collect_translatable_values(extracted_data, custom_prompt=None):
+    """Collect every translatable string of a page, keyed so it can be put back afterwards"""
+    values = {}
+    for field, value in extracted_data.items():
+        if not custom_prompt and field in LIST_FIELDS and isinstance(value, list):
+            for index, item in enumerate(value):
+                if isinstance(item, str) and item.strip():  # Only translate non-empty strings
+                    values[f"{field}[{index}]"] = item
+        elif isinstance(value, str):
+            values[field] = value
+    return values
+
+
+def apply_translations(extracted_data, translations, custom_prompt=None):
+    """Rebuild a page's fields as {original, language, translated} from batched translations"""
+    translated_data = {}
+    for field, value in extracted_data.items():
+        if not custom_prompt and field in LIST_FIELDS and isinstance(value, list):
+            translated_data[field] = [
+                translations.get(f"{field}[{index}]", item)
+                for index, item in enumerate(value)
+            ]
+        elif isinstance(value, str):
+            translated_data[field] = translations[field]
+        else:
+            translated_data[field] = {
+                'original': value if value is not None else '',
+                'language': 'none',
+                'translated': value if value is not None else ''
+            }
+    return translated_data
+
+
+def translate_extracted_fields(extracted_data, model=None, custom_prompt=None, candidates=None):
+    """Translate all string fields of one extracted page in a single batched request
+
+    ``candidates`` are the translations an inline extraction call returned
+    (see split_inline_translations); only the values they leave untranslated
+    are sent to the model.
+    """
+    values = collect_translatable_values(extracted_data, custom_prompt)
+    translations = {}
+    if candidates is not None:
+        translations, values = accept_inline_translations(values, candidates)
+        memory = get_translation_memory()
+        if memory:
+            memory.store_many(translations.values())
+    translations.update(batch_detect_and_translate(values, model))
+    return apply_translations(extracted_data, translations, custom_prompt)
+
+
+async def translate_extracted_fields_async(extracted_data, model=None, custom_prompt=None, semaphore=None,
+                                           candidates=None):
+    """Async variant of translate_extracted_fields"""
+    values = collect_translatable_values(extracted_data, custom_prompt)
+    translations = {}
+    if candidates is not None:
+        translations, values = accept_inline_translations(values, candidates)
+        memory = get_translation_memory()
+        if memory:
+            await memory.store_many_async(list(translations.values()))
+    translations.update(await batch_detect_and_translate_async(values, model, semaphore))
+    return apply_translations(extracted_data, translations, custom_prompt)
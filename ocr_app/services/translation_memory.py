@@ -0,0 +1,241 @@
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRANSLATION_MEMORY = {
+    'ENABLED': True,
+    'PERSIST': True,            # False keeps the memory in-process only
+    'MAX_ENTRIES': 10000,       # in-process LRU size
+    'MAX_TEXT_LENGTH': 300,     # longer values are rarely repeated and are not memoized
+}
+
+
+def normalize_source(text):
+    """Normalize a value for lookup: NFC, surrounding and repeated whitespace collapsed"""
+    return unicodedata.normalize('NFC', ' '.join((text or '').split()))
+
+
+def source_hash(normalized):
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def is_memorable(result):
+    """True for a finished model translation worth reusing.
+
+    Errors ('unknown'), empty answers and non-English values the model
+    echoed back untranslated are left out so they get another chance.
+    """
+    language = (result.get('language') or '').strip().lower()
+    translated = (result.get('translated') or '').strip()
+    if not language or language in ('unknown', 'none') or not translated:
+        return False
+    return language == 'en' or normalize_source(translated) != normalize_source(result.get('original'))
+
+
+class TranslationMemory:
+    """Translations of field values shared across documents.
+
+    An in-process LRU sits in front of the TranslationMemory table, so
+    repeated bank names, districts and boilerplate are translated once and
+    then served without a model call, in this process and in every other.
+    Database errors are logged and treated as misses.
+    """
+
+    def __init__(self, max_entries=DEFAULT_TRANSLATION_MEMORY['MAX_ENTRIES'], persist=True,
+                 max_text_length=DEFAULT_TRANSLATION_MEMORY['MAX_TEXT_LENGTH']):
+        self.max_entries = max_entries
+        self.persist = persist
+        self.max_text_length = max_text_length
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {
+                'lookups': 0,      # values looked up
+                'lru_hits': 0,     # served from the in-process LRU
+                'db_hits': 0,      # loaded from the table
+                'misses': 0,       # left for the model
+                'stores': 0,       # new translations remembered
+                'evictions': 0,    # LRU entries dropped to stay under max_entries
+                'db_errors': 0,
+            }
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        hits = stats['lru_hits'] + stats['db_hits']
+        stats['hit_rate'] = round(hits / stats['lookups'], 3) if stats['lookups'] else 0.0
+        return stats
+
+    def _remember(self, key, entry):
+        """Add an entry to the LRU; the caller holds the lock"""
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def _keys(self, texts):
+        """Map each memorable text to its hash"""
+        keys = {}
+        for text in texts:
+            normalized = normalize_source(text)
+            if normalized and len(normalized) <= self.max_text_length:
+                keys[text] = source_hash(normalized)
+        return keys
+
+    def _lookup_lru(self, texts):
+        """Return ``(hits, misses)``: results found in the LRU and ``{text: hash}`` left to look up"""
+        keys = self._keys(texts)
+        hits = {}
+        misses = {}
+        with self._lock:
+            self._stats['lookups'] += len(keys)
+            for text, key in keys.items():
+                entry = self._entries.get(key)
+                if entry is None:
+                    misses[text] = key
+                    continue
+                self._entries.move_to_end(key)
+                self._stats['lru_hits'] += 1
+                hits[text] = {"original": text, "language": entry[0], "translated": entry[1]}
+        return hits, misses
+
+    def _lookup_db(self, misses):
+        """Load missed texts from the table in one query, adding what is found to the LRU"""
+        hits = {}
+        if self.persist and misses:
+            from ..models import TranslationMemory as TranslationMemoryEntry
+            try:
+                rows = dict(
+                    (source, (language, translated)) for source, language, translated in
+                    TranslationMemoryEntry.objects.filter(source_hash__in=set(misses.values()))
+                    .values_list('source_hash', 'language', 'translated')
+                )
+            except Exception as e:
+                logger.warning(f"Translation memory lookup failed: {str(e)}")
+                rows = {}
+                with self._lock:
+                    self._stats['db_errors'] += 1
+            with self._lock:
+                for text, key in misses.items():
+                    if key in rows:
+                        self._remember(key, rows[key])
+                        self._stats['db_hits'] += 1
+                        hits[text] = {"original": text, "language": rows[key][0], "translated": rows[key][1]}
+        with self._lock:
+            self._stats['misses'] += len(misses) - len(hits)
+        return hits
+
+    def lookup_many(self, texts):
+        """Return ``{text: {original, language, translated}}`` for the texts already translated"""
+        hits, misses = self._lookup_lru(texts)
+        hits.update(self._lookup_db(misses))
+        return hits
+
+    async def lookup_many_async(self, texts):
+        """Async variant of lookup_many; only the database query leaves the event loop"""
+        hits, misses = self._lookup_lru(texts)
+        if misses:
+            hits.update(await sync_to_async(self._lookup_db)(misses))
+        return hits
+
+    def _new_entries(self, results):
+        """Add memorable results to the LRU, returning ``{hash: (normalized, language, translated)}``"""
+        entries = {}
+        with self._lock:
+            for result in results:
+                if not is_memorable(result):
+                    continue
+                normalized = normalize_source(result['original'])
+                if len(normalized) > self.max_text_length:
+                    continue
+                key = source_hash(normalized)
+                entry = (result['language'].strip().lower(), result['translated'].strip())
+                if self._entries.get(key) != entry:
+                    entries[key] = (normalized, *entry)
+                self._remember(key, entry)
+            self._stats['stores'] += len(entries)
+        return entries
+
+    def _store_db(self, entries):
+        if not self.persist or not entries:
+            return
+        from ..models import TranslationMemory as TranslationMemoryEntry
+        try:
+            # The first translation of a value wins; concurrent writers of the same value are ignored
+            TranslationMemoryEntry.objects.bulk_create([
+                TranslationMemoryEntry(source_hash=key, source_text=normalized, language=language, translated=translated)
+                for key, (normalized, language, translated) in entries.items()
+            ], ignore_conflicts=True)
+        except Exception as e:
+            logger.warning(f"Translation memory store failed: {str(e)}")
+            with self._lock:
+                self._stats['db_errors'] += 1
+
+    def store_many(self, results):
+        """Remember model translations (``{original, language, translated}`` dicts) for later lookups"""
+        self._store_db(self._new_entries(results))
+
+    async def store_many_async(self, results):
+        """Async variant of store_many"""
+        entries = self._new_entries(results)
+        if self.persist and entries:
+            await sync_to_async(self._store_db)(entries)
+
+    def clear(self):
+        """Drop the in-process entries; the table is left alone"""
+        with self._lock:
+            self._entries.clear()
+
+
+_memory = None
+_memory_lock = threading.Lock()
+_disabled = ContextVar('translation_memory_disabled', default=False)
+
+
+@contextmanager
+def without_translation_memory():
+    """Bypass the translation memory for the calls made inside the block (e.g. to benchmark the model)"""
+    token = _disabled.set(True)
+    try:
+        yield
+    finally:
+        _disabled.reset(token)
+
+
+def get_translation_memory_config():
+    return {**DEFAULT_TRANSLATION_MEMORY, **getattr(settings, 'TRANSLATION_MEMORY', {})}
+
+
+def get_translation_memory():
+    """Return the process-wide translation memory configured by TRANSLATION_MEMORY, or None when disabled"""
+    global _memory
+    if _disabled.get():
+        return None
+    with _memory_lock:
+        if _memory is None:
+            config = get_translation_memory_config()
+            _memory = TranslationMemory(
+                max_entries=config['MAX_ENTRIES'], persist=config['PERSIST'],
+                max_text_length=config['MAX_TEXT_LENGTH'],
+            ) if config['ENABLED'] else False
+        return _memory or None
+
+
+def get_translation_memory_stats():
+    """Return a snapshot of the process-wide translation memory counters"""
+    memory = get_translation_memory()
+    return memory.stats() if memory else {}
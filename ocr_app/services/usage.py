@@ -0,0 +1,202 @@
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Labels (page, field, kind, field_bytes) attached to the model calls made
+# inside a usage_scope; context variables follow each page's thread or task
+_scope = contextvars.ContextVar('usage_scope', default={})
+
+_TOTAL_KEYS = ('calls', 'failed_calls', 'latency_ms', 'prompt_tokens', 'response_tokens',
+               'total_tokens', 'payload_bytes')
+
+
+@contextmanager
+def usage_scope(**labels):
+    """Attribute the model calls made within the block to ``labels``.
+
+    Labels nest, so a ``field`` scope inside a ``page`` scope records both.
+    """
+    token = _scope.set({**_scope.get(), **labels})
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def _empty_totals():
+    return dict.fromkeys(_TOTAL_KEYS, 0)
+
+
+def _add(totals, entry, share=1.0):
+    totals['calls'] += share
+    totals['failed_calls'] += 0 if entry['ok'] else share
+    for key in _TOTAL_KEYS[2:]:
+        totals[key] += entry[key] * share
+
+
+def _rounded(totals):
+    return {key: round(value, 1) if key == 'latency_ms' else round(value) for key, value in totals.items()}
+
+
+def payload_size(contents):
+    """Return the number of bytes sent for a generate_content ``contents`` argument"""
+    if isinstance(contents, (list, tuple)):
+        return sum(payload_size(part) for part in contents)
+    if isinstance(contents, dict):
+        data = contents.get('data', b'')
+        if isinstance(data, str):
+            # Base64 text decodes to three bytes for every four characters
+            return len(data) * 3 // 4
+        return len(data)
+    if isinstance(contents, (bytes, bytearray)):
+        return len(contents)
+    return len(str(contents).encode('utf-8'))
+
+
+def _usage_counts(response):
+    """Read the token counts from a response's usage metadata, or zeros when it has none"""
+    usage = getattr(response, 'usage_metadata', None)
+    prompt_tokens = getattr(usage, 'prompt_token_count', 0) or 0
+    response_tokens = getattr(usage, 'candidates_token_count', 0) or 0
+    total_tokens = getattr(usage, 'total_token_count', 0) or prompt_tokens + response_tokens
+    return prompt_tokens, response_tokens, total_tokens
+
+
+class UsageLedger:
+    """Per-document record of the model calls made, their latency, tokens and payload size"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.entries = []
+
+    def record(self, latency, payload_bytes, response=None, ok=True):
+        labels = _scope.get()
+        prompt_tokens, response_tokens, total_tokens = _usage_counts(response)
+        entry = {
+            'kind': labels.get('kind', 'extraction'),
+            'page': labels.get('page'),
+            'field': labels.get('field'),
+            'field_bytes': labels.get('field_bytes'),
+            'ok': ok,
+            'latency_ms': latency * 1000,
+            'prompt_tokens': prompt_tokens,
+            'response_tokens': response_tokens,
+            'total_tokens': total_tokens,
+            'payload_bytes': payload_bytes,
+        }
+        with self._lock:
+            self.entries.append(entry)
+        return entry
+
+    def summary(self):
+        """Return totals overall and per kind, page and field.
+
+        A batched call covering several fields is split between them by the
+        size of each field's text.
+        """
+        with self._lock:
+            entries = list(self.entries)
+        totals = _empty_totals()
+        kinds, pages, fields = {}, {}, {}
+        for entry in entries:
+            _add(totals, entry)
+            _add(kinds.setdefault(entry['kind'], _empty_totals()), entry)
+            if entry['page'] is not None:
+                _add(pages.setdefault(str(entry['page']), _empty_totals()), entry)
+            if entry['field'] is not None:
+                _add(fields.setdefault(entry['field'], _empty_totals()), entry)
+            elif entry['field_bytes']:
+                batch_bytes = sum(entry['field_bytes'].values()) or 1
+                for field, size in entry['field_bytes'].items():
+                    _add(fields.setdefault(field, _empty_totals()), entry, size / batch_bytes)
+        return {
+            'totals': _rounded(totals),
+            'kinds': {kind: _rounded(value) for kind, value in kinds.items()},
+            'pages': {page: _rounded(value) for page, value in sorted(pages.items(), key=lambda i: int(i[0]))},
+            'fields': {field: _rounded(value) for field, value in fields.items()},
+        }
+
+
+class MeteredModel:
+    """Wrap a model client so every generate_content call is recorded in a UsageLedger.
+
+    Everything other than ``generate_content`` and ``generate_content_async``
+    is passed through to the wrapped model.
+    """
+
+    def __init__(self, model, ledger):
+        self.model = model
+        self.ledger = ledger
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def generate_content(self, contents, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.model.generate_content(contents, **kwargs)
+        except Exception:
+            self.ledger.record(time.perf_counter() - start, payload_size(contents), ok=False)
+            raise
+        self.ledger.record(time.perf_counter() - start, payload_size(contents), response)
+        return response
+
+    async def generate_content_async(self, contents, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await self.model.generate_content_async(contents, **kwargs)
+        except Exception:
+            self.ledger.record(time.perf_counter() - start, payload_size(contents), ok=False)
+            raise
+        self.ledger.record(time.perf_counter() - start, payload_size(contents), response)
+        return response
+
+
+def metered(model, ledger=None):
+    """Return ``(metered_model, ledger)``, reusing the ledger of an already metered model"""
+    if isinstance(model, MeteredModel):
+        return model, model.ledger
+    ledger = ledger or UsageLedger()
+    return MeteredModel(model, ledger), ledger
+
+
+def build_extraction_usage(extraction, usage):
+    """Return an unsaved ExtractionUsage for a usage summary (from ``UsageLedger.summary``)"""
+    from ..models import ExtractionUsage
+
+    totals = usage['totals']
+    return ExtractionUsage(
+        extraction=extraction,
+        calls=totals['calls'],
+        failed_calls=totals['failed_calls'],
+        latency_ms=totals['latency_ms'],
+        prompt_tokens=totals['prompt_tokens'],
+        response_tokens=totals['response_tokens'],
+        total_tokens=totals['total_tokens'],
+        payload_bytes=totals['payload_bytes'],
+        kinds=usage['kinds'],
+        pages=usage['pages'],
+        fields=usage['fields'],
+    )
+
+
+def save_extraction_usage(extraction, usage):
+    """Persist a usage summary (from ``UsageLedger.summary``) for a CustomExtraction"""
+    if not usage:
+        return None
+    try:
+        # A savepoint, so a failed insert does not break a surrounding transaction
+        with transaction.atomic():
+            record = build_extraction_usage(extraction, usage)
+            record.save()
+        return record
+    except Exception as e:
+        # Accounting must never lose the extraction itself
+        logger.error(f"Could not save usage for extraction {extraction.pk}: {str(e)}")
+        return None
@@ -1,3 +1,538 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+import numpy as np
+from PIL import Image
+
+from .models import CustomExtraction, CustomUser, ExtractionFileCheckpoint, ExtractionJob, ExtractionUsage
+
+from .services.async_extraction import extract_data_from_document_async
+from .services.extraction_cache import ExtractionCache, InMemoryLRUBackend
+from .services.job_queue import claim_next_job, process_job, requeue_stale_jobs
+from .services.json_repair import parse_model_json
+from .services.model_registry import get_model, set_model_factory, use_model
+from .services.page_encoder import encode_page_payload, release_page_payload
+from .services.rag_utils import extract_data_from_document
+from .services.rasterize import decode_page_image, encode_page_array
+from .services.scheduler import (
+    PRIORITY_BULK, PRIORITY_INTERACTIVE, CallScheduler, DeadlineExceeded, ScheduledModel, reset_scheduler,
+)
+from .services.text_layer import TextPage
+
+# No request or token quota, so the tests measure the pipeline rather than the rate limiter
+UNLIMITED_SCHEDULER = {'REQUESTS_PER_MINUTE': 0, 'TOKENS_PER_MINUTE': 0, 'DOCUMENT_TIMEOUT': None}
+
+
+class FakeResponse:
+    usage_metadata = None
+
+    def __init__(self, text):
+        self.text = text
+
+
+class SleepingModel:
+    """Fake model answering each page after a delay, recording how many calls overlap.
+
+    Later pages answer sooner, so with several calls in flight pages finish
+    out of order.
+    """
+
+    def __init__(self, pages, delay=0.05):
+        self.pages = pages
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents, **kwargs):
+        page = int(re.search(r'Page (\d+)', contents[-1]).group(1))
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay * (self.pages - page + 1))
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        return FakeResponse(json.dumps({
+            'borrower_name': f'Borrower {page}',
+            'loan_amount': f'{page}000',
+            'emi_history': [f'EMI {page}'],
+        }))
+
+
+@override_settings(GEMINI_SCHEDULER=UNLIMITED_SCHEDULER)
+class ConcurrentPageExtractionTests(SimpleTestCase):
+    pages = 6
+
+    def setUp(self):
+        reset_scheduler()
+        self.addCleanup(reset_scheduler)
+        handle, self.pdf_path = tempfile.mkstemp(suffix='.pdf')
+        os.close(handle)
+        self.addCleanup(os.remove, self.pdf_path)
+        # Text pages stand in for a rendered PDF; each names its page for the fake model
+        for target, replacement in (
+            ('get_pdf_page_count', lambda path: self.pages),
+            ('iter_pdf_pages', lambda path, profile=None: (
+                TextPage(f'Page {number}') for number in range(1, self.pages + 1)
+            )),
+        ):
+            patcher = mock.patch(f'ocr_app.services.rag_utils.{target}', replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def extract(self, model, max_in_flight):
+        with use_model(model), contextlib.redirect_stdout(io.StringIO()):
+            return extract_data_from_document(self.pdf_path, 'loan', max_in_flight=max_in_flight, use_cache=False)
+
+    def test_concurrent_merge_matches_sequential(self):
+        sequential = self.extract(SleepingModel(self.pages, delay=0.01), max_in_flight=1)
+        concurrent = self.extract(SleepingModel(self.pages, delay=0.01), max_in_flight=4)
+
+        self.assertTrue(sequential['success'])
+        self.assertTrue(concurrent['success'])
+        self.assertEqual(concurrent['failed_pages'], [])
+        self.assertEqual(concurrent['structured_data'], sequential['structured_data'])
+        # Pages are merged in page order, not in the order they finished
+        self.assertEqual(
+            [item['original'] for item in concurrent['structured_data']['emi_history']],
+            [f'EMI {page}' for page in range(1, self.pages + 1)],
+        )
+        self.assertEqual(concurrent['structured_data']['borrower_name']['original'], 'Borrower 1')
+
+    def test_calls_in_flight_are_bounded(self):
+        model = SleepingModel(self.pages)
+        result = self.extract(model, max_in_flight=3)
+
+        self.assertTrue(result['success'])
+        self.assertEqual(model.calls, self.pages)
+        self.assertLessEqual(model.max_in_flight, 3)
+        self.assertGreater(model.max_in_flight, 1)
+
+    def test_single_slot_runs_sequentially(self):
+        model = SleepingModel(self.pages, delay=0.01)
+        self.extract(model, max_in_flight=1)
+
+        self.assertEqual(model.max_in_flight, 1)
+
+
+class HangingAsyncModel:
+    """Fake async model whose calls never answer, counting the calls that were cancelled"""
+
+    def __init__(self):
+        self.started = 0
+        self.cancelled = 0
+
+    async def generate_content_async(self, contents, **kwargs):
+        self.started += 1
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+
+@override_settings(GEMINI_SCHEDULER=UNLIMITED_SCHEDULER)
+class AsyncPageExtractionTests(SimpleTestCase):
+    def test_pages_in_flight_are_cancelled_when_rendering_fails(self):
+        def pages(path, profile=None):
+            yield TextPage('Page 1')
+            yield TextPage('Page 2')
+            time.sleep(0.05)
+            raise RuntimeError('corrupt page 3')
+
+        async def extract():
+            result = await extract_data_from_document_async(
+                'scan.pdf', 'loan', model=model, max_in_flight=4, use_cache=False
+            )
+            # Counted before asyncio.run cancels whatever was left behind
+            return result, model.cancelled
+
+        model = HangingAsyncModel()
+        with mock.patch('ocr_app.services.async_extraction.get_pdf_page_count', lambda path: 3), \
+                mock.patch('ocr_app.services.async_extraction.iter_pdf_pages', pages), \
+                contextlib.redirect_stdout(io.StringIO()):
+            result, cancelled = asyncio.run(extract())
+
+        self.assertEqual(result, {'success': False, 'error': 'corrupt page 3'})
+        self.assertEqual((model.started, cancelled), (2, 2))
+
+
+class PagePayloadTests(SimpleTestCase):
+    def test_rendered_page_is_sent_without_encoding_again(self):
+        rendered = encode_page_array(np.full((40, 30), 255, dtype=np.uint8), None)
+        page = decode_page_image(rendered)
+
+        with mock.patch.object(Image.Image, 'save') as save:
+            data, mime_type = encode_page_payload(page)
+        save.assert_not_called()
+        self.assertEqual((data, mime_type), (rendered, 'image/png'))
+
+        # A page resized in place no longer matches its bytes
+        page.thumbnail((15, 15))
+        self.assertNotEqual(encode_page_payload(page)[0], rendered)
+        release_page_payload(page)
+        self.assertNotIn('payload', page.info)
+
+
+class ModelRegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.created = []
+        self.addCleanup(set_model_factory, None)
+        set_model_factory(self.factory)
+
+    def factory(self, model_name, generation_config):
+        model = SleepingModel(pages=1)
+        self.created.append((model_name, generation_config))
+        return model
+
+    def test_clients_are_reused_per_name_and_config(self):
+        model = get_model('gemini-test')
+
+        self.assertIs(get_model('gemini-test'), model)
+        self.assertIs(
+            get_model('gemini-test', {'temperature': 0, 'top_p': 1}),
+            get_model('gemini-test', {'top_p': 1, 'temperature': 0}),
+        )
+        self.assertIsNot(get_model('gemini-test', {'temperature': 0}), model)
+        self.assertIsNot(get_model('gemini-other'), model)
+        self.assertEqual(len(self.created), 4)
+
+    def test_threads_share_one_client(self):
+        models = []
+        threads = [threading.Thread(target=lambda: models.append(get_model('gemini-test'))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.created), 1)
+        self.assertTrue(all(model is models[0] for model in models))
+
+    def test_use_model_serves_the_fake_within_the_block(self):
+        fake = SleepingModel(pages=1)
+        with use_model(fake):
+            self.assertIs(get_model(), fake)
+            self.assertIs(get_model('gemini-other', {'temperature': 0}), fake)
+        self.assertIsNot(get_model(), fake)
+        self.assertEqual(len(self.created), 1)
+
+
+class ModelError(Exception):
+    def __init__(self, code):
+        super().__init__(f"{code} error")
+        self.code = code
+
+
+class FlakyModel:
+    """Fake model that fails with the queued status codes before answering; ``attempts`` records start times"""
+
+    def __init__(self, errors=(), latency=0.0):
+        self.errors = list(errors)
+        self.latency = latency
+        self.attempts = []
+        self.kwargs = []
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents, **kwargs):
+        with self._lock:
+            self.attempts.append(time.monotonic())
+            self.kwargs.append(kwargs)
+            code = self.errors.pop(0) if self.errors else None
+        time.sleep(self.latency)
+        if code:
+            raise ModelError(code)
+        return FakeResponse(contents)
+
+
+class CallSchedulerTests(SimpleTestCase):
+    def test_retries_after_rate_limit_with_backoff(self):
+        scheduler = CallScheduler(base_delay=0.05, max_delay=1.0)
+        model = FlakyModel(errors=[429, 429], latency=0.01)
+
+        response = ScheduledModel(model, scheduler).generate_content('prompt')
+
+        self.assertEqual(response.text, 'prompt')
+        self.assertEqual(len(model.attempts), 3)
+        # Jittered backoff waits at least half of base * 2**attempt before each retry
+        self.assertGreaterEqual(model.attempts[1] - model.attempts[0], 0.025)
+        self.assertGreaterEqual(model.attempts[2] - model.attempts[1], 0.05)
+        stats = scheduler.get_stats()
+        self.assertEqual((stats['calls'], stats['attempts']), (1, 3))
+        self.assertEqual((stats['retries'], stats['rate_limited'], stats['failed']), (2, 2, 0))
+
+    def test_gives_up_on_errors_that_are_not_retryable(self):
+        scheduler = CallScheduler(base_delay=0.01)
+        model = FlakyModel(errors=[400])
+
+        with self.assertRaises(ModelError):
+            ScheduledModel(model, scheduler).generate_content('prompt')
+        self.assertEqual(len(model.attempts), 1)
+        self.assertEqual(scheduler.get_stats()['failed'], 1)
+
+    def test_rate_limit_pauses_every_caller(self):
+        scheduler = CallScheduler(base_delay=0.4, max_delay=1.0)
+        limited = FlakyModel(errors=[429])
+        other = FlakyModel()
+        thread = threading.Thread(target=ScheduledModel(limited, scheduler).generate_content, args=('a',))
+        thread.start()
+        while not limited.attempts:
+            time.sleep(0.005)
+        time.sleep(0.05)
+
+        ScheduledModel(other, scheduler).generate_content('b')
+        thread.join()
+
+        # The pause is at least 0.2s from the 429, shared by a caller that never saw it
+        self.assertGreaterEqual(other.attempts[0] - limited.attempts[0], 0.15)
+        self.assertEqual(len(limited.attempts), 2)
+
+    def test_interactive_calls_go_ahead_of_bulk(self):
+        scheduler = CallScheduler(requests_per_minute=120)
+        model = FlakyModel()
+        # Spend the burst so the next calls queue for the bucket, one every half second
+        for _ in range(10):
+            ScheduledModel(model, scheduler).generate_content('burst')
+        order = []
+
+        def call(priority, name):
+            ScheduledModel(model, scheduler, priority).generate_content(name)
+            order.append(name)
+
+        bulk = threading.Thread(target=call, args=(PRIORITY_BULK, 'bulk'))
+        bulk.start()
+        time.sleep(0.1)
+        interactive = threading.Thread(target=call, args=(PRIORITY_INTERACTIVE, 'interactive'))
+        interactive.start()
+        bulk.join()
+        interactive.join()
+
+        self.assertEqual(order, ['interactive', 'bulk'])
+
+    def test_retries_stop_at_the_document_deadline(self):
+        scheduler = CallScheduler(base_delay=0.2, max_delay=1.0)
+        model = FlakyModel(errors=[503] * 10, latency=0.05)
+        start = time.monotonic()
+
+        with self.assertRaises(DeadlineExceeded):
+            ScheduledModel(model, scheduler, deadline=start + 0.5).generate_content('prompt')
+
+        # No attempt starts past the deadline, and no backoff sleeps beyond it
+        self.assertLessEqual(max(model.attempts), start + 0.5)
+        self.assertLess(time.monotonic() - start, 0.5 + model.latency + 0.05)
+        self.assertLess(len(model.attempts), 10)
+        stats = scheduler.get_stats()
+        self.assertEqual((stats['deadline_exceeded'], stats['failed']), (1, 1))
+        self.assertGreaterEqual(stats['transient_errors'], 1)
+
+    def test_deadline_is_sent_as_timeout_only_to_clients_that_take_it(self):
+        class StrictModel:
+            def generate_content(self, contents, generation_config=None):
+                return FakeResponse(contents)
+
+        scheduler = CallScheduler()
+        deadline = time.monotonic() + 30
+        model = FlakyModel()
+        ScheduledModel(model, scheduler, deadline=deadline).generate_content('prompt')
+
+        self.assertEqual(ScheduledModel(StrictModel(), scheduler, deadline=deadline).generate_content('x').text, 'x')
+        self.assertLessEqual(model.kwargs[0]['request_options']['timeout'], 30)
+
+
+class ExtractionUsageAdminTests(TestCase):
+    def test_changelist_renders_usage_summaries(self):
+        superuser = CustomUser.objects.create_superuser('admin', 'admin@example.com', 'password')
+        for document_type, tokens in (('loan', 1200), ('loan', 800), ('table', 300)):
+            extraction = CustomExtraction.objects.create(
+                user=superuser, document_type=document_type, extracted_data={}, custom_prompt="Default extraction"
+            )
+            ExtractionUsage.objects.create(
+                extraction=extraction, calls=2, total_tokens=tokens, payload_bytes=1024, latency_ms=150.0
+            )
+        self.client.force_login(superuser)
+
+        response = self.client.get(reverse('admin:ocr_app_extractionusage_changelist'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Usage by document type')
+        loan = next(row for row in response.context['summary_by_type'] if row['extraction__document_type'] == 'loan')
+        self.assertEqual(
+            (loan['documents'], loan['sum_calls'], loan['sum_tokens'], loan['avg_tokens']), (2, 4, 2000, 1000)
+        )
+
+
+class PageModel:
+    def generate_content(self, contents, **kwargs):
+        return FakeResponse(json.dumps({'borrower_name': 'Borrower'}))
+
+
+@override_settings(GEMINI_SCHEDULER=UNLIMITED_SCHEDULER, EXTRACTION_JOB_AUTOSTART_WORKERS=False)
+class BatchJobTests(TestCase):
+    def test_batch_runs_as_one_job_and_reports_its_summary(self):
+        user = CustomUser.objects.create_user('reader', password='password', is_app_user=True)
+        self.client.force_login(user)
+        image = io.BytesIO()
+        Image.new('RGB', (20, 20), 'white').save(image, 'PNG')
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            response = self.client.post(reverse('ocr_app:batch-process'), {
+                'document_type': 'loan',
+                'documents': [
+                    SimpleUploadedFile('page.png', image.getvalue()),
+                    SimpleUploadedFile('broken.pdf', b'not a pdf'),
+                ],
+            })
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(ExtractionJob.objects.count(), 1)
+
+            with use_model(PageModel()), contextlib.redirect_stdout(io.StringIO()):
+                process_job(claim_next_job())
+            self.assertEqual(os.listdir(media_root), [])
+
+        job = self.client.get(response.json()['status_url']).json()
+        self.assertEqual(job['status'], ExtractionJob.STATUS_DONE)
+        self.assertEqual((job['summary']['succeeded'], job['summary']['failed']), (1, 1))
+        # Finishing the job keeps the progress the worker reported
+        self.assertEqual((job['processed_pages'], job['total_pages']), (1, 1))
+        documents = {document['name']: document for document in job['documents']}
+        self.assertEqual(
+            CustomExtraction.objects.get(pk=documents['page.png']['extraction_id']).user, user
+        )
+        self.assertFalse(documents['broken.pdf']['success'])
+
+
+class StaleJobTests(TestCase):
+    def test_requeues_on_a_missing_heartbeat_not_on_run_time(self):
+        user = CustomUser.objects.create_user('reader', password='password')
+        long_ago = timezone.now() - timedelta(hours=2)
+        beating, silent = (
+            ExtractionJob.objects.create(
+                user=user, document_type='loan', original_filename=name, file_path=name,
+                status=ExtractionJob.STATUS_RUNNING, started_at=long_ago, heartbeat_at=heartbeat, processed_pages=3,
+            )
+            for name, heartbeat in (('beating.pdf', timezone.now()), ('silent.pdf', long_ago))
+        )
+
+        self.assertEqual(requeue_stale_jobs(stale_after=60), 1)
+        beating.refresh_from_db()
+        silent.refresh_from_db()
+        self.assertEqual(beating.status, ExtractionJob.STATUS_RUNNING)
+        self.assertEqual((silent.status, silent.heartbeat_at, silent.processed_pages), (ExtractionJob.STATUS_QUEUED, None, 0))
+
+
+@override_settings(GEMINI_SCHEDULER=UNLIMITED_SCHEDULER, EXTRACTION_JOB_AUTOSTART_WORKERS=False)
+class DocumentProcessViewTests(TestCase):
+    def setUp(self):
+        self.client.force_login(CustomUser.objects.create_user('reader', password='password', is_app_user=True))
+        image = io.BytesIO()
+        Image.new('RGB', (20, 20), 'white').save(image, 'PNG')
+        self.upload = SimpleUploadedFile('page.png', image.getvalue())
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = self.settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def post(self, **headers):
+        return self.client.post(reverse('ocr_app:document-process'), {
+            'document_type': 'loan', 'document': self.upload, 'use_custom_prompt': 'on',
+            'custom_prompt': 'Read the borrower', 'save_prompt': 'on', 'prompt_name': 'Borrower',
+        }, **headers)
+
+    def test_form_post_renders_the_extraction(self):
+        with use_model(PageModel()), contextlib.redirect_stdout(io.StringIO()):
+            response = self.post()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['extraction'].extracted_data['borrower_name']['original'], 'Borrower')
+        self.assertContains(response, 'Saved custom prompt: Borrower')
+        self.assertFalse(ExtractionJob.objects.exists())
+
+    def test_script_post_queues_a_job_and_returns_the_prompt_messages(self):
+        response = self.post(HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['messages'], [{'level': 'success', 'message': 'Saved custom prompt: Borrower'}])
+        self.assertEqual(ExtractionJob.objects.get().custom_prompt, 'Read the borrower')
+
+
+@override_settings(GEMINI_SCHEDULER=UNLIMITED_SCHEDULER)
+class ExtractDocumentsResumeTests(TransactionTestCase):
+    # The command saves from worker threads, which must see committed rows
+    def test_retried_file_updates_its_extraction(self):
+        CustomUser.objects.create_user('reader', password='password')
+        source = tempfile.TemporaryDirectory()
+        self.addCleanup(source.cleanup)
+        Image.new('RGB', (20, 20), 'white').save(os.path.join(source.name, 'page.png'))
+
+        def run():
+            with use_model(PageModel()), contextlib.redirect_stdout(io.StringIO()):
+                call_command('extract_documents', source.name, document_type='loan', user='reader', no_cache=True,
+                             stdout=io.StringIO(), stderr=io.StringIO())
+
+        run()
+        first = CustomExtraction.objects.get()
+        # As if the first attempt had left pages unextracted, so the next run retries the file
+        ExtractionFileCheckpoint.objects.update(status=ExtractionFileCheckpoint.STATUS_FAILED)
+        run()
+
+        self.assertEqual(CustomExtraction.objects.get().pk, first.pk)
+        self.assertEqual(ExtractionFileCheckpoint.objects.get().status, ExtractionFileCheckpoint.STATUS_DONE)
+        self.assertEqual(ExtractionUsage.objects.filter(extraction=first).count(), 1)
+
+
+class ExtractionCacheKeyTests(SimpleTestCase):
+    def make_key(self, **modes):
+        with self.settings(**modes):
+            return ExtractionCache(InMemoryLRUBackend()).make_key('abc123', 'loan', 'Extract the borrower')
+
+    def test_key_changes_with_translation_and_structured_output_modes(self):
+        keys = {
+            self.make_key(EXTRACTION_TRANSLATION_MODE=translation, EXTRACTION_STRUCTURED_OUTPUT=structured)
+            for translation in ('separate', 'inline') for structured in ('schema', 'json', 'off')
+        }
+
+        self.assertEqual(len(keys), 6)
+        self.assertEqual(
+            self.make_key(EXTRACTION_TRANSLATION_MODE='inline', EXTRACTION_STRUCTURED_OUTPUT='json'),
+            self.make_key(EXTRACTION_TRANSLATION_MODE='inline', EXTRACTION_STRUCTURED_OUTPUT='json'),
+        )
+
+
+class JsonRepairTests(SimpleTestCase):
+    def test_repairs_common_model_output_mistakes(self):
+        cases = [
+            ('```json\n{"a": "x",}\n```', {'a': 'x'}, ['code_fence', 'trailing_comma']),
+            ('{"a": "1" "b": [1, 2', {'a': '1', 'b': [1, 2]}, ['missing_comma', 'truncated']),
+            ('{"a": , "b": "c\\q"}', {'b': 'cq'}, ['missing_value', 'invalid_escape']),
+            (
+                "Here: {'a': 'x', b: True",
+                {'a': 'x', 'b': True},
+                ['surrounding_text', 'single_quotes', 'unquoted_key', 'python_literal', 'truncated'],
+            ),
+        ]
+        for text, value, repairs in cases:
+            with self.subTest(text=text):
+                parsed = parse_model_json(text)
+                self.assertTrue(parsed.ok)
+                self.assertEqual((parsed.value, parsed.repairs), (value, repairs))
+
+    def test_clean_json_needs_no_repair_and_text_without_json_fails(self):
+        self.assertEqual(parse_model_json('{"a": [1, null]}').repairs, [])
+        self.assertFalse(parse_model_json('no json here').ok)
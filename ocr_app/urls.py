@@ -1,8 +1,9 @@
 # ocr_app/urls.py
 from django.urls import path
 from .views import (
-    HomeView, DocumentProcessView, SignUpView, logout_view,
-    DownloadJSONView, DownloadCSVView, get_saved_prompts
+    HomeView, DocumentProcessView, AsyncDocumentProcessView, SignUpView, logout_view,
+    DownloadJSONView, DownloadCSVView, get_saved_prompts,
+    ExtractionJobStatusView, DocumentStreamView, BatchProcessView
 )
 
 app_name = 'ocr_app'
@@ -10,8 +11,12 @@ urlpatterns = [
     path('', HomeView.as_view(), name='home'),
     path('signup/', SignUpView.as_view(), name='signup'),
     path('document-process/', DocumentProcessView.as_view(), name='document-process'),
+    path('document-process-async/', AsyncDocumentProcessView.as_view(), name='document-process-async'),
+    path('document-process-stream/', DocumentStreamView.as_view(), name='document-process-stream'),
     path('download-json/<str:document_type>/<int:document_id>/', DownloadJSONView.as_view(), name='download-json'),
     path('download-csv/<str:document_type>/<int:document_id>/', DownloadCSVView.as_view(), name='download-csv'),
     path('get-saved-prompts/', get_saved_prompts, name='get-saved-prompts'),
+    path('batch-process/', BatchProcessView.as_view(), name='batch-process'),
+    path('jobs/<int:job_id>/status/', ExtractionJobStatusView.as_view(), name='job-status'),
     path('logout/', logout_view, name='logout'),
 ]
\ No newline at end of file
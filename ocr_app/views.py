@@ -1,22 +1,34 @@
 # ocr_app/views.py
+from django.conf import settings
 from django.views import View
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from django.contrib import messages
 from django.core.files.storage import FileSystemStorage
-from .services.rag_utils import extract_data_from_document
-from .models import CustomUser, LoanDocument, PropertyDocument, TableDocument, ExtractionPrompt, CustomExtraction
+from .services.rag_utils import (
+    extract_data_from_document, iter_extraction_events, build_processed_data, get_detected_languages
+)
+from .services.async_extraction import extract_data_from_document_async
+from .services.job_queue import enqueue_batch_job, enqueue_job, ensure_worker_pool
+from .services.usage import save_extraction_usage
+from .services.batch import extract_archive, is_supported_document
+from .models import CustomUser, LoanDocument, PropertyDocument, TableDocument, ExtractionPrompt, CustomExtraction, ExtractionJob
 from django.views.generic.edit import CreateView
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from .forms import CustomUserCreationForm
 import logging
 from datetime import datetime
 import json
 import csv
-from django.http import HttpResponse, JsonResponse
+import os
+import shutil
+import tempfile
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib.auth import logout
 from django.contrib.auth.mixins import LoginRequiredMixin
+from asgiref.sync import sync_to_async
 
 logger = logging.getLogger(__name__)
 
@@ -39,6 +51,47 @@ def app_access_required(view_func):
     return wrapper
 
 
+def save_custom_prompt(request, document_type, prompt_name, custom_prompt):
+    """Create or update a named extraction prompt for the current user"""
+    try:
+        # Check if a prompt with this name already exists
+        existing_prompt = ExtractionPrompt.objects.filter(
+            user=request.user,
+            name=prompt_name,
+            document_type=document_type
+        ).first()
+        
+        if existing_prompt:
+            # Update existing prompt
+            existing_prompt.prompt_text = custom_prompt
+            existing_prompt.save()
+            messages.success(request, f'Updated existing prompt: {prompt_name}')
+        else:
+            # Create new prompt
+            ExtractionPrompt.objects.create(
+                user=request.user,
+                document_type=document_type,
+                name=prompt_name,
+                prompt_text=custom_prompt
+            )
+            messages.success(request, f'Saved custom prompt: {prompt_name}')
+    except Exception as e:
+        messages.error(request, f'Error saving prompt: {str(e)}')
+
+
+def wants_json(request):
+    """True for requests made by the upload page's JavaScript rather than a plain form post"""
+    return (
+        request.headers.get('x-requested-with') == 'XMLHttpRequest'
+        or 'application/json' in request.headers.get('accept', '')
+    )
+
+
+def pop_messages(request):
+    """Consume the request's pending messages, for JSON responses that are never rendered"""
+    return [{'level': message.tags, 'message': str(message)} for message in messages.get_messages(request)]
+
+
 class DocumentProcessView(View):
     template_name = 'ocr_app/document_upload.html'
     
@@ -48,142 +101,376 @@ class DocumentProcessView(View):
     
     @method_decorator(app_access_required)
     def post(self, request):
+        """Queue the upload as a background job for the page's JavaScript, or extract it inline for a plain form post"""
+        if not wants_json(request):
+            return self.process_inline(request)
+        
+        if 'document' not in request.FILES:
+            return JsonResponse({'success': False, 'error': 'Please select a document to upload'}, status=400)
+        
+        document = request.FILES['document']
+        document_type = request.POST.get('document_type')
+        if not document_type:
+            return JsonResponse({'success': False, 'error': 'Please select a document type'}, status=400)
+        
+        custom_prompt = self.get_custom_prompt(request, document_type)
+        
+        # The file is kept until the worker has processed it
+        fs = FileSystemStorage()
+        filename = fs.save(document.name, document)
+        job = enqueue_job(request.user, document_type, fs.path(filename), document.name, custom_prompt)
+        ensure_worker_pool()
+        
+        return JsonResponse({
+            'success': True,
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': reverse('ocr_app:job-status', kwargs={'job_id': job.id}),
+            'messages': pop_messages(request)
+        }, status=202)
+    
+    def process_inline(self, request):
+        """Extract the upload within the request and render the result, as without JavaScript"""
         if 'document' not in request.FILES:
             messages.error(request, 'Please select a document to upload')
             return render(request, self.template_name)
         
         document = request.FILES['document']
         document_type = request.POST.get('document_type')
-        
         if not document_type:
             messages.error(request, 'Please select a document type')
             return render(request, self.template_name)
         
-        print(f"\nProcessing uploaded file: {document.name}")
+        custom_prompt = self.get_custom_prompt(request, document_type)
         
         fs = FileSystemStorage()
         filename = fs.save(document.name, document)
+        try:
+            result = extract_data_from_document(fs.path(filename), document_type, custom_prompt)
+            return self.render_result(request, result, document_type, custom_prompt)
+        except Exception as e:
+            logger.error(f"Error processing document: {str(e)}")
+            messages.error(request, f"Error processing document: {str(e)}")
+            return render(request, self.template_name)
+        finally:
+            fs.delete(filename)
+    
+    def get_custom_prompt(self, request, document_type):
+        """Return the custom prompt of the form, if enabled, saving it when asked to"""
+        use_custom_prompt = request.POST.get('use_custom_prompt') == 'on'
+        custom_prompt = request.POST.get('custom_prompt', '') if use_custom_prompt else None
+        prompt_name = request.POST.get('prompt_name', '')
+        if use_custom_prompt and request.POST.get('save_prompt') == 'on' and prompt_name and custom_prompt:
+            save_custom_prompt(request, document_type, prompt_name, custom_prompt)
+        return custom_prompt
+    
+    def render_result(self, request, result, document_type, custom_prompt=None):
+        """Save a successful extraction and render it, or report the error"""
+        if not result['success']:
+            messages.error(request, f"Error processing document: {result.get('error', 'Unknown error')}")
+            return render(request, self.template_name)
+        
+        if result.get('failed_pages'):
+            pages = ', '.join(str(page) for page in result['failed_pages'])
+            messages.warning(request, f"No data could be extracted from page(s) {pages}. Upload the document again to retry only those pages.")
+        
+        # Get the structured data
+        extracted_data = result.get('structured_data', {})
+        
+        # Process the extracted data to ensure proper structure for all fields
+        processed_data = build_processed_data(document_type, extracted_data)
+        
+        # Save extraction with processed data
+        custom_extraction = CustomExtraction.objects.create(
+            user=request.user,
+            document_type=document_type,
+            extracted_data=processed_data,
+            custom_prompt=custom_prompt or "Default extraction"
+        )
+        save_extraction_usage(custom_extraction, result.get('usage'))
+        
+        # Create a list of fields and their languages for the template
+        languages_detected = get_detected_languages(document_type, processed_data)
+        
+        messages.success(request, f'{document_type.title()} document processed successfully!')
+        
+        # Use different template for table documents
+        if document_type == 'table':
+            template_name = 'ocr_app/table_display.html'
+        else:
+            template_name = self.template_name
+        
+        # Render the template with the data
+        return render(request, template_name, {
+            'extraction': custom_extraction,
+            'document_type': document_type,
+            'processed_data': True,
+            'extraction_data': processed_data,
+            'languages_detected': languages_detected
+        })
+
+
+async def check_app_access_async(request):
+    """Async counterpart of app_access_required; returns a redirect when access is denied"""
+    is_authenticated, is_app_user = await sync_to_async(
+        lambda: (request.user.is_authenticated, getattr(request.user, 'is_app_user', False))
+    )()
+    if not is_authenticated:
+        messages.error(request, "Please log in to access this feature")
+        return redirect('login')
+    if not is_app_user:
+        messages.error(request, "You don't have access to document processing features")
+        return redirect('ocr_app:home')
+    return None
+
+
+class AsyncDocumentProcessView(DocumentProcessView):
+    """DocumentProcessView served natively under ASGI.
+
+    Model calls for all pages and translations are awaited concurrently, so a
+    single worker can keep many uploads in flight.
+    """
+    
+    async def get(self, request):
+        denied = await check_app_access_async(request)
+        if denied:
+            return denied
+        return await sync_to_async(render)(request, self.template_name)
+    
+    async def post(self, request):
+        denied = await check_app_access_async(request)
+        if denied:
+            return denied
+        
+        if 'document' not in request.FILES:
+            messages.error(request, 'Please select a document to upload')
+            return await sync_to_async(render)(request, self.template_name)
+        
+        document = request.FILES['document']
+        document_type = request.POST.get('document_type')
+        
+        if not document_type:
+            messages.error(request, 'Please select a document type')
+            return await sync_to_async(render)(request, self.template_name)
+        
+        fs = FileSystemStorage()
+        filename = await sync_to_async(fs.save)(document.name, document)
         file_path = fs.path(filename)
-        print(f"File saved to: {file_path}")
         
         # Check if custom prompt is being used
         use_custom_prompt = request.POST.get('use_custom_prompt') == 'on'
         custom_prompt = request.POST.get('custom_prompt', '') if use_custom_prompt else None
-        save_prompt = request.POST.get('save_prompt') == 'on'
         prompt_name = request.POST.get('prompt_name', '')
-        
-        # Save the custom prompt if requested
-        if use_custom_prompt and save_prompt and prompt_name and custom_prompt:
-            try:
-                # Check if a prompt with this name already exists
-                existing_prompt = ExtractionPrompt.objects.filter(
-                    user=request.user,
-                    name=prompt_name,
-                    document_type=document_type
-                ).first()
-                
-                if existing_prompt:
-                    # Update existing prompt
-                    existing_prompt.prompt_text = custom_prompt
-                    existing_prompt.save()
-                    messages.success(request, f'Updated existing prompt: {prompt_name}')
-                else:
-                    # Create new prompt
-                    ExtractionPrompt.objects.create(
-                        user=request.user,
-                        document_type=document_type,
-                        name=prompt_name,
-                        prompt_text=custom_prompt
-                    )
-                    messages.success(request, f'Saved custom prompt: {prompt_name}')
-            except Exception as e:
-                messages.error(request, f'Error saving prompt: {str(e)}')
+        if use_custom_prompt and request.POST.get('save_prompt') == 'on' and prompt_name and custom_prompt:
+            await sync_to_async(save_custom_prompt)(request, document_type, prompt_name, custom_prompt)
         
         try:
-            # Extract data from document with optional custom prompt
-            print("Calling extract_data_from_document...")
-            result = extract_data_from_document(file_path, document_type, custom_prompt)
-            print(f"Extraction result: {result}")
-            
-            if not result['success']:
-                messages.error(request, f"Error processing document: {result.get('error', 'Unknown error')}")
-                return render(request, self.template_name)
-            
-            # Get the structured data
-            extracted_data = result.get('structured_data', {})
-            
-            # Process the extracted data to ensure proper structure for all fields
-            processed_data = {}
-            
-            # For table documents, keep the original structure
-            if document_type == 'table':
-                processed_data = extracted_data
-            else:
-                # Process each field to ensure it has the right structure
-                for key, value in extracted_data.items():
-                    # If value is already a dict with 'original', 'language', 'translated' structure, keep it as is
-                    if isinstance(value, dict) and 'original' in value and 'language' in value and 'translated' in value:
-                        processed_data[key] = value
-                    # If value is a string, convert it to the structured format
-                    elif isinstance(value, str):
-                        # Only process non-empty strings
-                        if value.strip():
-                            processed_data[key] = {
-                                'original': value,
-                                'language': 'auto',  # Will be determined during translation
-                                'translated': value  # Default to original, will be translated if needed
-                            }
-                        else:
-                            processed_data[key] = {
-                                'original': '',
-                                'language': 'none',
-                                'translated': ''
-                            }
-                    # For other types (like lists or empty values), keep as is
-                    else:
-                        processed_data[key] = value
-            
-            # Save extraction with processed data
-            custom_extraction = CustomExtraction.objects.create(
-                user=request.user,
-                document_type=document_type,
-                extracted_data=processed_data,
-                custom_prompt=custom_prompt if use_custom_prompt else "Default extraction"
-            )
-            
-            # Create a list of fields and their languages for the template
-            languages_detected = []
-            if document_type != 'table':
-                for key, value in processed_data.items():
-                    if isinstance(value, dict) and 'language' in value and value.get('language') not in ['en', 'none', '']:
-                        field_name = key.replace('_', ' ').title()
-                        languages_detected.append((field_name, value.get('language')))
-            
-            messages.success(request, f'{document_type.title()} document processed successfully!')
-            
-            # Use different template for table documents
-            if document_type == 'table':
-                template_name = 'ocr_app/table_display.html'
-            else:
-                template_name = self.template_name
-            
-            # Render the template with the data
-            return render(request, template_name, {
-                'extraction': custom_extraction,
-                'document_type': document_type,
-                'processed_data': True,
-                'extraction_data': processed_data,
-                'languages_detected': languages_detected
-            })
-        
+            result = await extract_data_from_document_async(file_path, document_type, custom_prompt)
+            return await sync_to_async(self.render_result)(request, result, document_type, custom_prompt)
         except Exception as e:
             print(f"Error processing document: {str(e)}")
             messages.error(request, f"Error processing document: {str(e)}")
-            return render(request, self.template_name)
-            
+            return await sync_to_async(render)(request, self.template_name)
+        finally:
+            await sync_to_async(fs.delete)(filename)
+
+
+def format_sse(event, data):
+    """Format one server-sent event frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class DocumentStreamView(View):
+    """Stream each page's fields as server-sent events as soon as the page is extracted,
+    followed by the merged record once every page is done"""
+    
+    @method_decorator(app_access_required)
+    def post(self, request):
+        if 'document' not in request.FILES:
+            return JsonResponse({'success': False, 'error': 'Please select a document to upload'}, status=400)
+        
+        document = request.FILES['document']
+        document_type = request.POST.get('document_type')
+        if not document_type:
+            return JsonResponse({'success': False, 'error': 'Please select a document type'}, status=400)
+        
+        use_custom_prompt = request.POST.get('use_custom_prompt') == 'on'
+        custom_prompt = request.POST.get('custom_prompt', '') if use_custom_prompt else None
+        prompt_name = request.POST.get('prompt_name', '')
+        if use_custom_prompt and request.POST.get('save_prompt') == 'on' and prompt_name and custom_prompt:
+            save_custom_prompt(request, document_type, prompt_name, custom_prompt)
+        
+        fs = FileSystemStorage()
+        filename = fs.save(document.name, document)
+        
+        # Django buffers a sync iterator under ASGI and an async one under WSGI,
+        # so each server gets the generator it can stream
+        if isinstance(request, ASGIRequest):
+            events = self.astream_events(request.user, fs, filename, document_type, custom_prompt)
+        else:
+            events = self.stream_events(request.user, fs, filename, document_type, custom_prompt)
+        response = StreamingHttpResponse(events, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx and similar proxies from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    
+    def format_progress(self, document_type, event):
+        """Format a start, page or page_failed event of iter_extraction_events"""
+        if event['event'] == 'start':
+            return format_sse('start', {'total_pages': event['total_pages']})
+        if event['event'] == 'page':
+            return format_sse('page', {
+                'page': event['page'],
+                'data': build_processed_data(document_type, event['data'])
+            })
+        return format_sse('page_failed', {'page': event['page']})
+    
+    def format_result(self, user, document_type, custom_prompt, result):
+        """Save a finished extraction and format its result event, or the error event of a failed one"""
+        if not result['success']:
+            return format_sse('error', {'error': result.get('error', 'Unknown error')})
+        processed_data = build_processed_data(document_type, result.get('structured_data', {}))
+        extraction = CustomExtraction.objects.create(
+            user=user,
+            document_type=document_type,
+            extracted_data=processed_data,
+            custom_prompt=custom_prompt or "Default extraction"
+        )
+        save_extraction_usage(extraction, result.get('usage'))
+        url_kwargs = {'document_type': document_type, 'document_id': extraction.id}
+        return format_sse('result', {
+            'extraction_id': extraction.id,
+            'data': processed_data,
+            'failed_pages': result.get('failed_pages', []),
+            'languages_detected': get_detected_languages(document_type, processed_data),
+            'download_json_url': reverse('ocr_app:download-json', kwargs=url_kwargs),
+            'download_csv_url': reverse('ocr_app:download-csv', kwargs=url_kwargs)
+        })
+    
+    def stream_events(self, user, fs, filename, document_type, custom_prompt):
+        """Event stream for WSGI servers"""
+        try:
+            for event in iter_extraction_events(fs.path(filename), document_type, custom_prompt):
+                if event['event'] == 'result':
+                    yield self.format_result(user, document_type, custom_prompt, event['result'])
+                else:
+                    yield self.format_progress(document_type, event)
+        except Exception as e:
+            print(f"Error streaming document: {str(e)}")
+            yield format_sse('error', {'error': str(e)})
         finally:
-            if 'file_path' in locals():
-                fs.delete(filename)
+            fs.delete(filename)
+    
+    async def astream_events(self, user, fs, filename, document_type, custom_prompt):
+        """Event stream for ASGI servers.
+
+        The blocking pipeline is advanced in a worker thread outside the
+        thread-sensitive executor, so a long document does not hold up other
+        requests' ORM calls, and the result is saved through sync_to_async.
+        """
+        events = iter_extraction_events(fs.path(filename), document_type, custom_prompt)
+        next_event = sync_to_async(next, thread_sensitive=False)
+        try:
+            while True:
+                event = await next_event(events, None)
+                if event is None:
+                    break
+                if event['event'] == 'result':
+                    yield await sync_to_async(self.format_result)(user, document_type, custom_prompt, event['result'])
+                else:
+                    yield self.format_progress(document_type, event)
+        except Exception as e:
+            print(f"Error streaming document: {str(e)}")
+            yield format_sse('error', {'error': str(e)})
+        finally:
+            try:
+                await sync_to_async(events.close, thread_sensitive=False)()
+            except ValueError:
+                # The client went away while a page was still running; the generator is left to finish
+                pass
+            await sync_to_async(fs.delete)(filename)
+
+
+class BatchProcessView(View):
+    """Queue the documents of a ZIP archive or a multi-file upload as one background batch job"""
+    
+    @method_decorator(app_access_required)
+    def post(self, request):
+        document_type = request.POST.get('document_type')
+        if not document_type:
+            return JsonResponse({'success': False, 'error': 'Please select a document type'}, status=400)
+        if 'archive' not in request.FILES and not request.FILES.getlist('documents'):
+            return JsonResponse({'success': False, 'error': 'Please upload a ZIP archive or documents'}, status=400)
+        
+        use_custom_prompt = request.POST.get('use_custom_prompt') == 'on'
+        custom_prompt = request.POST.get('custom_prompt', '') if use_custom_prompt else None
+        
+        # The directory is kept until the worker has processed the batch
+        os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
+        workdir = tempfile.mkdtemp(prefix='batch_', dir=settings.MEDIA_ROOT)
+        try:
+            documents = []
+            if 'archive' in request.FILES:
+                documents.extend(extract_archive(request.FILES['archive'], workdir))
+            fs = FileSystemStorage(location=workdir)
+            for document in request.FILES.getlist('documents'):
+                if is_supported_document(document.name):
+                    documents.append((document.name, fs.path(fs.save(os.path.basename(document.name), document))))
+        except ValueError as e:
+            shutil.rmtree(workdir, ignore_errors=True)
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
+        except Exception:
+            shutil.rmtree(workdir, ignore_errors=True)
+            raise
+        if not documents:
+            shutil.rmtree(workdir, ignore_errors=True)
+            return JsonResponse({'success': False, 'error': 'No supported documents in the upload'}, status=400)
+        
+        job = enqueue_batch_job(request.user, document_type, workdir, documents, custom_prompt)
+        ensure_worker_pool()
+        
+        return JsonResponse({
+            'success': True,
+            'job_id': job.id,
+            'status': job.status,
+            'documents': [name for name, _ in documents],
+            'status_url': reverse('ocr_app:job-status', kwargs={'job_id': job.id})
+        }, status=202)
+
+
+class ExtractionJobStatusView(View):
+    """Report the progress of a background extraction job as JSON"""
+    
+    def get(self, request, job_id):
+        # Polled by JavaScript, so access errors are JSON rather than a login redirect
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Authentication required'}, status=401)
+        if not getattr(request.user, 'is_app_user', False):
+            return JsonResponse({'error': "You don't have access to document processing features"}, status=403)
+        job = ExtractionJob.objects.filter(id=job_id, user=request.user).first()
+        if job is None:
+            return JsonResponse({'error': 'Job not found'}, status=404)
+        data = {
+            'job_id': job.id,
+            'status': job.status,
+            'document_type': job.document_type,
+            'filename': job.original_filename,
+            'processed_pages': job.processed_pages,
+            'total_pages': job.total_pages,
+            'progress': round(job.progress * 100),
+            'failed_pages': job.failed_pages,
+            'error': job.error,
+            'extraction_id': job.extraction_id,
+        }
+        if job.batch_result:
+            data['summary'] = job.batch_result['summary']
+            data['documents'] = job.batch_result['documents']
+        if job.extraction_id:
+            url_kwargs = {'document_type': job.document_type, 'document_id': job.extraction_id}
+            data['download_json_url'] = reverse('ocr_app:download-json', kwargs=url_kwargs)
+            data['download_csv_url'] = reverse('ocr_app:download-csv', kwargs=url_kwargs)
+        return JsonResponse(data)
 
 
 class SignUpView(CreateView):
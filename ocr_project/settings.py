@@ -83,6 +83,10 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Background extraction workers write job progress concurrently with requests
+            'timeout': 20,
+        },
     }
 }
 
@@ -132,12 +136,132 @@ MEDIA_ROOT = BASE_DIR / 'media'
 # File upload settings
 MAX_UPLOAD_SIZE = 10485760  # 10MB
 ALLOWED_EXTENSIONS = ['pdf', 'png', 'jpg', 'jpeg']
+# Largest uncompressed size accepted for a batch ZIP archive
+BATCH_MAX_BYTES = 1024 * 1024 * 1024  # 1GB
 
 # Together API configuration
 TOGETHER_API_KEY = os.getenv('TOGETHER_API_KEY')
 
 # Google Generative AI configuration
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
+GEMINI_MODEL_NAME = os.getenv('GEMINI_MODEL_NAME', 'gemini-2.0-flash')
+
+# Extraction responses: 'schema' requests JSON mode with the document type's declared
+# response schema, 'json' requests JSON mode only and 'off' relies on the prompt alone
+EXTRACTION_STRUCTURED_OUTPUT = os.getenv('EXTRACTION_STRUCTURED_OUTPUT', 'schema')
+
+# 'separate' extracts fields in their original language and translates them with text
+# calls; 'inline' has the extraction call of default loan and property prompts return
+# {original, language, translated} per field, translating only what it left untranslated
+# (compare the two with `manage.py benchmark_translation_mode`)
+EXTRACTION_TRANSLATION_MODE = os.getenv('EXTRACTION_TRANSLATION_MODE', 'separate')
+
+# Maximum number of Gemini calls in flight at once while extracting the pages of a document
+GEMINI_MAX_CONCURRENT_CALLS = int(os.getenv('GEMINI_MAX_CONCURRENT_CALLS', '4'))
+
+# Process-wide Gemini call scheduler: request and token quotas shared by every
+# extraction and translation call, retries with jittered exponential backoff
+# (BASE_DELAY doubling up to MAX_DELAY seconds) and a per-document deadline.
+# REQUESTS_PER_MINUTE caps throughput whatever GEMINI_MAX_CONCURRENT_CALLS is:
+# the default 60 starts at most one call a second once the 5-second burst
+# (5 calls) is spent, so set it to the project's real quota before raising
+# the concurrency
+GEMINI_SCHEDULER = {
+    'REQUESTS_PER_MINUTE': int(os.getenv('GEMINI_REQUESTS_PER_MINUTE', '60')),
+    'TOKENS_PER_MINUTE': int(os.getenv('GEMINI_TOKENS_PER_MINUTE', '1000000')),
+    'MAX_RETRIES': 5,
+    'BASE_DELAY': 1.0,
+    'MAX_DELAY': 32.0,
+    'DOCUMENT_TIMEOUT': 600,  # seconds, None for no deadline
+}
+
+# Cache of extraction results keyed by file hash, document type and prompt.
+# BACKEND is 'memory' (per-process LRU), 'filesystem', 'django' (uses CACHES[CACHE_ALIAS]) or 'none'
+EXTRACTION_CACHE = {
+    'BACKEND': os.getenv('EXTRACTION_CACHE_BACKEND', 'memory'),
+    'LOCATION': BASE_DIR / 'extraction_cache',
+    'CACHE_ALIAS': 'default',
+    'TTL': 7 * 24 * 60 * 60,  # seconds
+    'MAX_ENTRIES': 256,
+    'MAX_BYTES': 64 * 1024 * 1024,
+}
+
+# Cache of single-page results keyed by rendered page hash, document type and prompt,
+# so re-running a partially failed document only calls the model for the missing pages
+PAGE_RESULT_CACHE = {
+    'BACKEND': os.getenv('PAGE_RESULT_CACHE_BACKEND', 'memory'),
+    'LOCATION': BASE_DIR / 'extraction_cache' / 'pages',
+    'CACHE_ALIAS': 'default',
+    'TTL': 24 * 60 * 60,  # seconds
+    'MAX_ENTRIES': 2048,
+    'MAX_BYTES': 64 * 1024 * 1024,
+}
+
+# Translations of field values (bank names, districts, boilerplate) are remembered in the
+# TranslationMemory table, with a per-process LRU of MAX_ENTRIES in front of it, and reused
+# across documents instead of asking the model again. Values longer than MAX_TEXT_LENGTH
+# characters are not remembered; PERSIST False keeps the memory in-process only
+TRANSLATION_MEMORY = {
+    'ENABLED': os.getenv('TRANSLATION_MEMORY_ENABLED', 'true').lower() == 'true',
+    'PERSIST': True,
+    'MAX_ENTRIES': 10000,
+    'MAX_TEXT_LENGTH': 300,
+}
+
+# Born-digital PDF pages whose text layer has at least MIN_CHARS characters, of which
+# MIN_VALID_RATIO are real text, are sent to the model as text instead of an image
+TEXT_LAYER = {
+    'ENABLED': os.getenv('TEXT_LAYER_ENABLED', 'true').lower() == 'true',
+    'MIN_CHARS': 200,
+    'MIN_VALID_RATIO': 0.9,
+}
+
+# Tables on text-layer pages are rebuilt from word positions without a model call
+# when the layout confidence (0-1) is at least this; otherwise the model is used
+LOCAL_TABLE_MIN_CONFIDENCE = 0.8
+
+# Page resolution policy. Pages are rendered at RASTERIZE_DPI, scaled down so the longest
+# side is at most RASTERIZE_MAX_LONG_SIDE pixels (the model downsamples larger images
+# anyway), and re-rendered at RASTERIZE_RETRY_DPI only when at least
+# RASTERIZE_RETRY_EMPTY_RATIO of the page's fields come back empty
+RASTERIZE_DPI = int(os.getenv('RASTERIZE_DPI', '200'))
+RASTERIZE_MAX_LONG_SIDE = int(os.getenv('RASTERIZE_MAX_LONG_SIDE', '2000'))
+RASTERIZE_RETRY_DPI = 300
+RASTERIZE_RETRY_EMPTY_RATIO = 0.75
+
+# Encoding of page images sent to the model. FORMAT is 'png', 'jpeg' or 'webp';
+# per-page size and encode time are reported in the extraction result's page_stats
+PAGE_PAYLOAD = {
+    'FORMAT': os.getenv('PAGE_PAYLOAD_FORMAT', 'png'),
+    'PNG_COMPRESS_LEVEL': 1,  # 0-9, higher is smaller but slower
+    'JPEG_QUALITY': 85,
+    'WEBP_QUALITY': 80,
+}
+
+# Page preprocessing profile per document type: 'none', 'fast' (CLAHE + adaptive
+# threshold), 'full' (non-local-means denoising first) or 'auto', which only denoises
+# pages whose estimated noise sigma is above PREPROCESS_NOISE_THRESHOLD
+PREPROCESS_PROFILES = {
+    'default': 'auto',
+    'loan': 'auto',
+    'property': 'auto',
+    'table': 'fast',
+}
+PREPROCESS_NOISE_THRESHOLD = 4.0
+
+# Processes used to render and enhance PDF pages (1 renders in the calling process).
+# Each worker renders RASTERIZE_CHUNK_PAGES pages at a time; at most two chunks per
+# worker are queued, so memory stays flat on long documents
+RASTERIZE_WORKERS = int(os.getenv('RASTERIZE_WORKERS', str(min(8, os.cpu_count() or 1))))
+RASTERIZE_CHUNK_PAGES = 4
+
+# Background extraction jobs (see ocr_app/services/job_queue.py)
+# Workers start inside the web process on the first queued job unless disabled;
+# they can also be run separately with `python manage.py run_extraction_workers`
+EXTRACTION_JOB_AUTOSTART_WORKERS = os.getenv('EXTRACTION_JOB_AUTOSTART_WORKERS', 'true').lower() == 'true'
+EXTRACTION_JOB_WORKERS = int(os.getenv('EXTRACTION_JOB_WORKERS', '2'))
+EXTRACTION_JOB_POLL_INTERVAL = 1.0  # seconds
+EXTRACTION_JOB_STALE_AFTER = 15 * 60  # seconds without a heartbeat before a 'running' job is considered abandoned
 
 # Tesseract configuration
 # TESSERACT_CMD = r'C:\Program Files\Tesseract-OCR\tesseract.exe'